@@ -3,30 +3,39 @@ __version__ = "0.0.1"
 from ._reader import napari_get_reader
 from ._sample_data import make_sample_data
 from ._widget import ExampleQWidget, ImageThreshold, threshold_autogenerate_widget, threshold_magic_widget
-from ._writer import write_multiple, write_single_image
+from ._writer import write_labels, write_multiple, write_single_image
 from .adjust_mask import load_mask, adjust_mask
-from .sam_segmentation_widget import sam_segmentation_widget
+from .sam_segmentation_widget import sam_auto_segmentation_widget, sam_segmentation_widget
+from .sam_model_cache import get_model_cache, unload_sam_models
 from .mask_lable import MaskLabelViewer
 from .set_mask_val import BrushValueSetter
 from .label_value_setter import LabelValueSetter
 from .lable_filter import LabelFilter
 from .merge_masks import merge_masks
+from .multi_mask_merge import MultiMaskMerger
+from .autosave_widget import AnnotationAutosave
 
 __all__ = (
     "napari_get_reader",
     "write_single_image",
     "write_multiple",
+    "write_labels",
     "make_sample_data",
     "ExampleQWidget",
     "ImageThreshold",
     "threshold_autogenerate_widget",
     "threshold_magic_widget",
     "sam_segmentation_widget",
+    "sam_auto_segmentation_widget",
+    "get_model_cache",
+    "unload_sam_models",
     "load_mask",
     "adjust_mask",
     "MaskLabelViewer",
     "BrushValueSetter",
     "LabelValueSetter",
     "LabelFilter",
-    "merge_masks"
+    "merge_masks",
+    "MultiMaskMerger",
+    "AnnotationAutosave",
 )
@@ -5,8 +5,19 @@ It implements the Reader specification, but your plugin may choose to
 implement multiple readers or even other plugin contributions. see:
 https://napari.org/stable/plugins/guides.html?#readers
 """
+import os
+
+import dask.array as da
 import numpy as np
 
+from .tiff_stack import (
+    is_tiff,
+    is_tiff_stack_path,
+    read_tiff_file,
+    read_tiff_stack,
+)
+from .zarr_io import read_ome_zarr
+
 
 def napari_get_reader(path):
     """A basic implementation of a Reader contribution.
@@ -22,12 +33,24 @@ def napari_get_reader(path):
         If the path is a recognized format, return a function that accepts the
         same path or list of paths, and returns a list of layer data tuples.
     """
+    # a directory, glob pattern or list of per-slice TIFF files is one stack
+    if is_tiff_stack_path(path):
+        return tiff_stack_reader_function
+
     if isinstance(path, list):
         # reader plugins may be handed single path, or a list of paths.
         # if it is a list, it is assumed to be an image stack...
         # so we are only going to look at the first file.
         path = path[0]
 
+    # chunked (OME-)Zarr directories are read lazily, level by level
+    if str(path).rstrip("/\\").endswith(".zarr"):
+        return zarr_reader_function
+
+    # a single (multi-page) TIFF is read lazily page by page
+    if is_tiff(path) and os.path.isfile(path):
+        return tiff_reader_function
+
     # if we know we cannot read the file, we immediately return None.
     if not path.endswith(".npy"):
         return None
@@ -60,13 +83,51 @@ def reader_function(path):
     """
     # handle both a string and a list of strings
     paths = [path] if isinstance(path, str) else path
-    # load all files into array
-    arrays = [np.load(_path) for _path in paths]
-    # stack arrays into single array
-    data = np.squeeze(np.stack(arrays))
+    # memory-map the files: only the header is read here, napari pulls in
+    # the slices it actually displays
+    arrays = [np.load(_path, mmap_mode="r") for _path in paths]
+    if len(arrays) == 1:
+        data = np.squeeze(arrays[0])
+    else:
+        # stack lazily instead of copying every file into one new array
+        data = np.squeeze(da.stack([_lazy_array(array) for array in arrays]))
 
     # optional kwargs for the corresponding viewer.add_* method
     add_kwargs = {}
 
     layer_type = "image"  # optional, default is "image"
     return [(data, add_kwargs, layer_type)]
+
+
+def _lazy_array(array):
+    """Wrap a memory-mapped array in dask, one chunk per leading-axis plane."""
+    chunks = (1,) + array.shape[1:] if array.ndim >= 3 else array.shape
+    return da.from_array(array, chunks=chunks)
+
+
+def zarr_reader_function(path):
+    """Read a Zarr or OME-Zarr directory as lazy (multiscale) dask layers.
+
+    Every group with OME-Zarr ``multiscales`` metadata becomes a layer, groups
+    under ``labels/`` become labels layers. A plain Zarr array is returned as
+    a single image layer.
+    """
+    if isinstance(path, list):
+        path = path[0]
+    return read_ome_zarr(path)
+
+
+def tiff_stack_reader_function(path):
+    """Open per-slice TIFF files as one lazy image stack.
+
+    Only the first file's metadata is read when opening; slices are decoded
+    when napari displays them.
+    """
+    return [(read_tiff_stack(path), {}, "image")]
+
+
+def tiff_reader_function(path):
+    """Open a single (multi-page) TIFF file as a lazy image layer."""
+    if isinstance(path, list):
+        path = path[0]
+    return [(read_tiff_file(path), {}, "image")]
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+import torch
+
+from napari_segment_annotation import annotation_journal
+
+
+class _IdentityTransform:
+    def apply_coords(self, coords, original_size):
+        return np.asarray(coords, dtype=float)
+
+    def apply_boxes(self, boxes, original_size):
+        return np.asarray(boxes, dtype=float)
+
+
+class _FakeModel:
+    mask_threshold = 0.0
+
+
+class FakePredictor:
+    """Stand-in for ``SamPredictor`` that avoids loading real SAM weights.
+
+    ``set_image`` counts encoder runs; ``predict`` and ``predict_torch``
+    return a disk of radius ``radius`` around every foreground point.
+    """
+
+    def __init__(self, radius=2):
+        self.device = torch.device("cpu")
+        self.model = _FakeModel()
+        self.transform = _IdentityTransform()
+        self.radius = radius
+        self.encoder_calls = 0
+        self.decoder_calls = 0
+        self.reset_image()
+
+    def reset_image(self):
+        self.is_image_set = False
+        self.features = None
+
+    def set_image(self, image):
+        # shallow copies made by ``compute_embedding`` share this counter
+        self._count_encoder()
+        self.features = torch.as_tensor(image[..., 0], dtype=torch.float)[None, None]
+        self.original_size = tuple(image.shape[:2])
+        self.input_size = (8, 8)
+        self.is_image_set = True
+
+    def _count_encoder(self):
+        owner = getattr(self, "_owner", self)
+        owner.encoder_calls += 1
+
+    def __copy__(self):
+        clone = FakePredictor(self.radius)
+        clone._owner = getattr(self, "_owner", self)
+        return clone
+
+    def predict(self, point_coords=None, point_labels=None, multimask_output=True, **kwargs):
+        masks, iou, low_res = self.predict_torch(
+            torch.as_tensor(point_coords[None], dtype=torch.float),
+            torch.as_tensor(point_labels[None]),
+            multimask_output=multimask_output,
+        )
+        return masks[0].numpy(), iou[0].numpy(), low_res[0].numpy()
+
+    def predict_torch(
+        self,
+        point_coords,
+        point_labels,
+        boxes=None,
+        mask_input=None,
+        multimask_output=True,
+        return_logits=False,
+    ):
+        """Point prompts: logits are ``radius - distance`` to the nearest
+        foreground point. Box prompts: the nonzero image pixels inside the
+        box grown by ``radius`` (the "embedding" is the image itself).
+        """
+        assert self.is_image_set
+        self.decoder_calls += 1
+        image = self.features[0, 0]
+        yy, xx = torch.meshgrid(
+            torch.arange(self.original_size[0], dtype=torch.float),
+            torch.arange(self.original_size[1], dtype=torch.float),
+            indexing="ij",
+        )
+        logits = []
+        batch = len(boxes) if boxes is not None else len(point_coords)
+        for b in range(batch):
+            if boxes is not None:
+                x0, y0, x1, y1 = boxes[b]
+                r = self.radius
+                inside = (xx >= x0 - r) & (xx <= x1 + r) & (yy >= y0 - r) & (yy <= y1 + r)
+                logits.append(torch.where(inside & (image > 0), 1.0, -1.0))
+                continue
+            distance = torch.full(yy.shape, float("inf"))
+            for (x, y), label in zip(point_coords[b], point_labels[b]):
+                if label == 1:
+                    distance = torch.minimum(distance, torch.sqrt((yy - y) ** 2 + (xx - x) ** 2))
+            logits.append(self.radius - distance)
+        logits = torch.stack(logits)[:, None]
+        masks = logits if return_logits else logits > self.model.mask_threshold
+        return masks, torch.ones(batch, 1), torch.zeros(batch, 1, 256, 256)
+
+
+@pytest.fixture
+def fake_predictor():
+    return FakePredictor()
+
+
+@pytest.fixture(autouse=True)
+def _recent_stores(tmp_path, monkeypatch):
+    """Keep the list of journaled stores out of the user's cache directory."""
+    path = str(tmp_path / "journaled_stores.json")
+    monkeypatch.setattr(annotation_journal, "RECENT_STORES_PATH", path)
+    return path
@@ -0,0 +1,143 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+import zarr
+from napari.components import ViewerModel
+from napari.layers import Labels
+from qtpy.QtWidgets import QMessageBox
+
+from napari_segment_annotation.annotation_journal import (
+    AnnotationJournal,
+    journal_path,
+    pending_edits,
+    remember_store,
+    replay_journal,
+    stores_with_pending_edits,
+)
+from napari_segment_annotation.autosave_widget import AnnotationAutosave
+
+
+def _crash_copy(store, target):
+    """复制存储和日志，模拟 napari 在此刻崩溃后留下的文件。"""
+    shutil.copytree(store, target)
+    shutil.copy(journal_path(store), journal_path(target))
+    return target
+
+
+def test_journal_replays_edits_after_crash(tmp_path):
+    layer = Labels(np.zeros((3, 64, 64), dtype=np.uint16))
+    store = str(tmp_path / "labels.zarr")
+    journal = AnnotationJournal(layer, store, chunk_edge=32, compact_interval=1e9)
+
+    layer.paint((1, 40, 10), 5)
+    layer.paint((2, 5, 50), 6)
+    layer.paint((2, 5, 50), 7)
+    layer.undo()
+    layer.data_setitem((np.array([0, 0]), np.array([1, 60]), np.array([2, 33])), np.array([3, 8]))
+    journal.flush()
+
+    crashed = _crash_copy(store, str(tmp_path / "crashed.zarr"))
+    # 截断的最后一条记录被忽略
+    with open(journal_path(crashed), "ab") as file:
+        file.write(b"\x03\x10\x00")
+    assert pending_edits(crashed) == 6
+    assert not zarr.open_array(crashed, mode="r")[:].any()
+
+    assert replay_journal(crashed) == 6
+    np.testing.assert_array_equal(zarr.open_array(crashed, mode="r")[:], layer.data)
+    assert pending_edits(crashed) == 0
+
+    journal.close()
+    assert not os.path.exists(journal_path(store))
+    np.testing.assert_array_equal(zarr.open_array(store, mode="r")[:], layer.data)
+
+
+def test_journal_compaction_and_pending_guard(tmp_path):
+    layer = Labels(np.zeros((2, 32, 32), dtype=np.uint8))
+    store = str(tmp_path / "labels.zarr")
+    journal = AnnotationJournal(layer, store, chunk_edge=16, compact_interval=1e9)
+
+    layer.paint((0, 3, 3), 2)
+    journal.compact()
+    assert pending_edits(store) == 0
+    np.testing.assert_array_equal(zarr.open_array(store, mode="r")[:], layer.data)
+
+    layer.data = np.full((2, 32, 32), 4, dtype=np.uint8)  # 整体替换直接写入存储
+    journal.flush()
+    assert pending_edits(store) == 0
+    np.testing.assert_array_equal(zarr.open_array(store, mode="r")[:], layer.data)
+
+    layer.paint((1, 20, 20), 9)
+    journal.flush()
+    with pytest.raises(RuntimeError):
+        AnnotationJournal(Labels(np.zeros((2, 32, 32), dtype=np.uint8)), store)
+    journal.close()
+
+
+def test_widget_offers_recovery_on_startup(tmp_path, monkeypatch, qtbot):
+    layer = Labels(np.zeros((2, 32, 32), dtype=np.uint8))
+    store = str(tmp_path / "labels.zarr")
+    journal = AnnotationJournal(layer, store, chunk_edge=16, compact_interval=1e9)
+    layer.paint((1, 20, 20), 9)
+    journal.flush()
+
+    crashed = [_crash_copy(store, str(tmp_path / f"crashed{i}.zarr")) for i in range(2)]
+    for path in crashed:
+        remember_store(path)
+    journal.close()
+    # 正常关闭的存储不再检查
+    assert stores_with_pending_edits() == [(path, pending_edits(path)) for path in crashed]
+
+    asked = []
+
+    def answer(parent, title, text, buttons):
+        asked.append(text)
+        return QMessageBox.Yes
+
+    monkeypatch.setattr(QMessageBox, "question", answer)
+    viewer = ViewerModel()
+    widget = AnnotationAutosave(viewer)
+    qtbot.addWidget(widget)
+    widget.offer_recovery()
+
+    # 只恢复并自动保存第一个存储，其余的留到下次
+    assert len(asked) == 1 and crashed[0] in asked[0]
+    assert crashed[1] in widget.status_label.text()
+    recovered = viewer.layers["crashed0.zarr"]
+    assert isinstance(recovered.data, zarr.Array)  # 不把整卷读入内存
+    np.testing.assert_array_equal(recovered.data[:], layer.data)
+    assert widget.journal is not None and widget.journal.store_path == crashed[0]
+    assert [path for path, _ in stores_with_pending_edits()] == [crashed[1]]
+
+    recovered.paint((0, 3, 3), 4)
+    widget.stop_autosave()
+    assert zarr.open_array(crashed[0], mode="r")[0, 3, 3] == 4
+    assert [path for path, _ in stores_with_pending_edits()] == [crashed[1]]
+
+    widget.offer_recovery()
+    assert len(asked) == 2 and crashed[1] in asked[1]
+    assert widget.journal.store_path == crashed[1]
+    widget.stop_autosave()
+    assert stores_with_pending_edits() == []
+
+
+def test_declined_recovery_is_forgotten(tmp_path, monkeypatch, qtbot):
+    layer = Labels(np.zeros((2, 32, 32), dtype=np.uint8))
+    store = str(tmp_path / "labels.zarr")
+    journal = AnnotationJournal(layer, store, chunk_edge=16, compact_interval=1e9)
+    layer.paint((0, 3, 3), 2)
+    journal.flush()
+    crashed = _crash_copy(store, str(tmp_path / "crashed.zarr"))
+    remember_store(crashed)
+    journal.close()
+
+    monkeypatch.setattr(QMessageBox, "question", lambda *args: QMessageBox.No)
+    widget = AnnotationAutosave(ViewerModel())
+    qtbot.addWidget(widget)
+    widget.offer_recovery()
+
+    assert widget.journal is None
+    assert not os.path.exists(journal_path(crashed))
+    assert stores_with_pending_edits() == []
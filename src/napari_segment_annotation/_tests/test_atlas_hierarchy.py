@@ -0,0 +1,70 @@
+import dask.array as da
+import numpy as np
+import pytest
+
+from napari_segment_annotation.atlas_hierarchy import (
+    NO_PARENT,
+    AtlasHierarchy,
+    record_parent,
+)
+from napari_segment_annotation.atlas_registry import AtlasRegistry
+from napari_segment_annotation.label_remap import label_counts, remap_labels
+
+from .test_atlas_registry import FIXTURE_DIR
+
+
+@pytest.fixture
+def table():
+    return AtlasRegistry(cache_dir=None, url=FIXTURE_DIR).get("ccfv3")
+
+
+def _depth_of(hierarchy, structure_id):
+    return int(hierarchy.depth[hierarchy.rows([structure_id])[0]])
+
+
+def test_hierarchy_arrays(table):
+    hierarchy = table.hierarchy
+    assert table.parent_ids[table.ids.tolist().index(184)] == 315
+    assert _depth_of(hierarchy, 997) == 0 and _depth_of(hierarchy, 184) == 5
+    assert hierarchy.max_depth == 5
+    assert sorted(hierarchy.descendants(567).tolist()) == [184, 315, 500, 567, 623, 688]
+    assert sorted(hierarchy.descendants(315, include_self=False).tolist()) == [184, 500]
+    assert hierarchy.rows([12345, 8]).tolist() == [-1, 1]
+    with pytest.raises(ValueError):
+        hierarchy.descendants(12345)
+
+    # 只有 structure_id_path 时从路径取父结构
+    assert record_parent({"structure_id_path": "/997/8/567/"}) == 8
+    assert record_parent({"structure_id_path": "/997/"}) == NO_PARENT
+    with pytest.raises(ValueError):
+        AtlasHierarchy([1, 2, 3], [3, 1, 2])
+
+
+def test_hierarchy_remaps_volume(table):
+    hierarchy = table.hierarchy
+    volume = np.array([[[0, 184, 500], [623, 1129, 42]]], dtype=np.uint32)
+
+    selected, _ = remap_labels(volume, hierarchy.select_remap(315))
+    assert selected.tolist() == [[[0, 184, 500], [0, 0, 0]]]
+    binary, _ = remap_labels(da.from_array(volume, chunks=1), hierarchy.select_remap(567, value=1))
+    assert binary.compute().tolist() == [[[0, 1, 1], [1, 0, 0]]]
+
+    collapsed, _ = remap_labels(volume, hierarchy.collapse_remap(2))
+    # 深度 2 为 567 (Cerebrum) 和 343 (Brain stem)；不在结构表中的 42 保持不变
+    assert collapsed.tolist() == [[[0, 567, 567], [567, 343, 42]]]
+
+
+def test_rollup_counts(table):
+    hierarchy = table.hierarchy
+    volume = np.zeros((4, 8, 8), dtype=np.uint16)
+    volume[0] = 184
+    volume[1, :4] = 500
+    volume[2, :2] = 1129
+    volume[3, 0, 0] = 42
+    labels, counts = label_counts(volume, chunk_edge=4)
+    assert dict(zip(labels.tolist(), counts.tolist())) == {0: 32 + 48 + 63, 42: 1, 184: 64, 500: 32, 1129: 16}
+
+    totals = dict(zip(hierarchy.ids.tolist(), hierarchy.rollup_counts(labels, counts).tolist()))
+    assert totals[184] == 64 and totals[315] == 96 and totals[567] == 96
+    assert totals[343] == 16 and totals[8] == 112 and totals[997] == 112
+    assert totals[623] == 0
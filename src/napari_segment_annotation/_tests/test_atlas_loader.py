@@ -0,0 +1,146 @@
+import json
+import shutil
+import threading
+
+from napari.components import ViewerModel
+
+from napari_segment_annotation import atlas_loader
+from napari_segment_annotation.atlas_loader import AtlasLoader
+from napari_segment_annotation.atlas_registry import AtlasRegistry
+from napari_segment_annotation.lable_filter import LabelFilter
+from napari_segment_annotation.mask_lable import MaskLabelViewer
+
+from .test_atlas_registry import FIXTURE_DIR
+
+
+class GatedRegistry(AtlasRegistry):
+    """每个模板的加载都等到测试放行，模拟很慢的接口。"""
+
+    def __init__(self, url):
+        super().__init__(cache_dir=None, url=url)
+        self.gates = {}
+
+    def _fetch(self, template, table, meta):
+        self.gates.setdefault(template, threading.Event()).wait(5)
+        return super()._fetch(template, table, meta)
+
+    def release(self, template):
+        self.gates.setdefault(template, threading.Event()).set()
+
+
+def _registry(tmp_path, monkeypatch):
+    shutil.copy(f"{FIXTURE_DIR}/ccfv3.json", tmp_path / "ccfv3.json")
+    with open(tmp_path / "visor.json", "w") as f:
+        json.dump([{"id": "1", "safe_name": "visor root"}], f)
+    registry = GatedRegistry(str(tmp_path))
+    monkeypatch.setattr(atlas_loader, "get_atlas_registry", lambda: registry)
+    return registry
+
+
+def test_label_filter_loads_in_background(qtbot, tmp_path, monkeypatch):
+    registry = _registry(tmp_path, monkeypatch)
+    widget = LabelFilter(ViewerModel())
+    # 创建时不等待接口
+    assert widget.atlas_loader.loading
+    assert widget.full_data == {}
+    assert "Loading" in widget.label_display.text()
+
+    # 切换模板后，先返回的旧模板结果被丢弃
+    widget.template_selector.setCurrentText("visor")
+    registry.release("ccfv3")
+    qtbot.wait(100)
+    assert widget.full_data == {}
+    registry.release("visor")
+    qtbot.waitUntil(lambda: not widget.atlas_loader.loading, timeout=5000)
+    assert widget.full_data == {1: "visor root"}
+    assert widget.label_model.rowCount() == 1
+
+    # 已加载的模板再次切换回来时立即可用
+    widget.template_selector.setCurrentText("ccfv3")
+    qtbot.waitUntil(lambda: not widget.atlas_loader.loading, timeout=5000)
+    widget.template_selector.setCurrentText("visor")
+    assert not widget.atlas_loader.loading
+    assert widget.full_data == {1: "visor root"}
+
+
+def test_mask_label_viewer_reports_failure(qtbot, tmp_path, monkeypatch):
+    registry = _registry(tmp_path, monkeypatch)
+    widget = MaskLabelViewer(ViewerModel())
+    registry.release("ccfv3")
+    qtbot.waitUntil(lambda: bool(widget.ID_TO_SAFE_NAME), timeout=5000)
+    assert widget.ID_TO_SAFE_NAME[315] == "Isocortex"
+
+    # civm_rhesus 没有对应的文件
+    registry.release("civm_rhesus")
+    widget.template_selector.setCurrentText("civm_rhesus")
+    qtbot.waitUntil(lambda: not widget.atlas_loader.loading, timeout=5000)
+    assert widget.ID_TO_SAFE_NAME == {}
+    assert "Failed" in widget.label_display.text()
+
+
+def test_cached_table_is_prepared_in_background(qtbot, tmp_path, monkeypatch):
+    registry = _registry(tmp_path, monkeypatch)
+    registry.release("ccfv3")
+    table = registry.get("ccfv3")
+    prepared_in = []
+
+    def prepare(table):
+        prepared_in.append(threading.current_thread())
+        return table.search_index
+
+    loaded = []
+    loader = AtlasLoader(
+        lambda template, table: loaded.append(template),
+        prepare=prepare,
+        prepared=lambda table: table.built("search_index"),
+    )
+    # 缓存尚未准备，不在主线程构建索引
+    assert not loader.load("ccfv3")
+    assert loaded == [] and loader.loading
+    qtbot.waitUntil(lambda: loaded == ["ccfv3"], timeout=5000)
+    assert prepared_in and prepared_in[0] is not threading.main_thread()
+
+    # 准备好之后同步交付
+    loader.template = None
+    assert loader.load("ccfv3")
+    assert loaded == ["ccfv3", "ccfv3"] and loader.table is table
+
+
+def test_prepare_failure_reaches_on_failed(qtbot, tmp_path, monkeypatch):
+    registry = _registry(tmp_path, monkeypatch)
+    registry.release("ccfv3")
+
+    def prepare(table):
+        raise ValueError("结构 ID 不可重复")
+
+    failed = []
+    loader = AtlasLoader(
+        lambda template, table: None,
+        lambda template, message: failed.append((template, message)),
+        prepare=prepare,
+    )
+    loader.load("ccfv3")
+    qtbot.waitUntil(lambda: bool(failed), timeout=5000)
+    assert failed == [("ccfv3", "结构 ID 不可重复")]
+    assert not loader.loading
+
+
+def test_unexpected_prepare_error_reaches_on_failed(qtbot, tmp_path, monkeypatch):
+    registry = _registry(tmp_path, monkeypatch)
+    registry.release("ccfv3")
+
+    def prepare(table):
+        raise KeyError("id")
+
+    failed = []
+    loader = AtlasLoader(
+        lambda template, table: None,
+        lambda template, message: failed.append(template),
+        prepare=prepare,
+    )
+    # napari 同时把 worker 中的异常交给通知管理器
+    with qtbot.capture_exceptions():
+        loader.load("ccfv3")
+        qtbot.waitUntil(lambda: bool(failed), timeout=5000)
+    assert failed == ["ccfv3"]
+    assert not loader.loading
@@ -0,0 +1,85 @@
+import json
+import os
+
+import pytest
+
+from napari_segment_annotation.atlas_registry import (
+    AtlasRegistry,
+    parse_max_age,
+)
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "data", "atlas")
+
+
+def _records():
+    with open(os.path.join(FIXTURE_DIR, "ccfv3.json")) as f:
+        return json.load(f)
+
+
+class FakeResponse:
+    def __init__(self, status_code, records=None, headers=None):
+        self.status_code = status_code
+        self._records = records
+        self.headers = headers or {}
+
+    def json(self):
+        return self._records
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise OSError(f"HTTP {self.status_code}")
+
+
+class FakeSession:
+    """按 ETag 应答条件请求的假接口。"""
+
+    def __init__(self):
+        self.requests = []
+        self.online = True
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.requests.append(dict(headers or {}))
+        if not self.online:
+            raise OSError("network unreachable")
+        if (headers or {}).get("If-None-Match") == '"v1"':
+            return FakeResponse(304, headers={"Cache-Control": "max-age=60"})
+        return FakeResponse(200, _records(), {"ETag": '"v1"', "Cache-Control": "max-age=0"})
+
+
+def test_registry_reads_local_fixture():
+    registry = AtlasRegistry(cache_dir=None, url=FIXTURE_DIR)
+    table = registry.get("ccfv3")
+    assert len(table) == 10
+    assert table.names_by_id[315] == "Isocortex"
+    assert registry.get("ccfv3") is table
+
+
+def test_registry_revalidates_with_etag_and_works_offline(tmp_path):
+    session = FakeSession()
+    cache_dir = str(tmp_path / "atlas")
+    registry = AtlasRegistry(cache_dir=cache_dir, session=session)
+    table = registry.get("ccfv3")
+    assert session.requests == [{}]
+
+    # max-age=0：下次使用时带 ETag 重新验证，304 时沿用同一份表
+    assert registry.get("ccfv3") is table
+    assert session.requests[-1] == {"If-None-Match": '"v1"'}
+    # 304 给出 max-age=60，之后不再请求
+    registry.get("ccfv3")
+    assert len(session.requests) == 2
+
+    # 新进程：从磁盘加载，网络失败时使用缓存
+    session.online = False
+    restarted = AtlasRegistry(cache_dir=cache_dir, session=session)
+    assert restarted.get("ccfv3", refresh=True).names_by_id == table.names_by_id
+
+    offline = AtlasRegistry(cache_dir=cache_dir, offline=True, session=None)
+    assert offline.get("ccfv3").names_by_id == table.names_by_id
+    with pytest.raises(RuntimeError):
+        offline.get("visor")
+
+
+def test_parse_max_age():
+    assert parse_max_age("public, max-age=300") == 300
+    assert parse_max_age("no-cache") == 0
+    assert parse_max_age(None) is None
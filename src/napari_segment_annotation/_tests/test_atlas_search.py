@@ -0,0 +1,120 @@
+import json
+
+import numpy as np
+
+from napari_segment_annotation.atlas_search import LabelSearchIndex
+
+
+def _brute_force(ids, names, query):
+    query = query.lower()
+    return [row for row, (label_id, name) in enumerate(zip(ids, names)) if query in str(label_id) or query in name.lower()]
+
+
+def test_search_matches_substring_scan():
+    rng = np.random.default_rng(0)
+    words = ["Cortex", "Nucleus", "layer", "Thalamus", "dorsal", "Ventral", "area"]
+    ids = rng.choice(100000, size=500, replace=False)
+    names = [" ".join(rng.choice(words, size=3)) + f" {i}" for i in range(500)]
+    index = LabelSearchIndex(ids, names)
+
+    # 依次延长查询（缩小结果集）、退格和换成无关查询
+    for query in ["", "c", "co", "cor", "cort", "Cortex l", "cortex la", "cortex", "12", "9", "xyz", "area 4", "\n"]:
+        rows = index.search(query)
+        assert rows.tolist() == _brute_force(ids, names, query), query
+    # ID 和名称不会拼接成一个匹配
+    assert index.search(f"{ids[0]}{names[0][:2]}".lower()).tolist() == []
+
+
+def test_label_filter_search_is_debounced(qtbot, tmp_path, monkeypatch):
+    from napari.components import ViewerModel
+
+    from napari_segment_annotation.lable_filter import LabelFilter
+
+    from .test_atlas_loader import _registry
+
+    registry = _registry(tmp_path, monkeypatch)
+    registry.release("ccfv3")
+    widget = LabelFilter(ViewerModel())
+    qtbot.waitUntil(lambda: widget.table is not None, timeout=5000)
+    assert len(widget.filtered_rows) == 10
+
+    for text in ("c", "co", "cor", "cort"):
+        widget.search_input.setText(text)
+    assert len(widget.filtered_rows) == 10  # 还在等待防抖
+    qtbot.waitUntil(lambda: len(widget.filtered_rows) == 3, timeout=5000)
+    model = widget.label_model
+    names = [model.data(model.index(row, 1)) for row in range(model.rowCount())]
+    assert sorted(names) == ["Cerebral cortex", "Frontal pole cerebral cortex", "Isocortex"]
+
+
+def test_label_filter_hierarchy_actions(qtbot, tmp_path, monkeypatch):
+    from napari.components import ViewerModel
+
+    from napari_segment_annotation.lable_filter import LabelFilter
+
+    from .test_atlas_loader import _registry
+
+    _registry(tmp_path, monkeypatch).release("ccfv3")
+    viewer = ViewerModel()
+    viewer.add_labels(np.array([[0, 184, 500], [623, 1129, 1129]], dtype=np.uint32), name="registered")
+    widget = LabelFilter(viewer)
+    widget.update_layer_list()
+    qtbot.waitUntil(lambda: widget.table is not None, timeout=5000)
+
+    widget.search_input.setText("isocortex")
+    widget.apply_search()
+    widget.label_table.selectRow(0)
+    widget.select_descendants()
+    assert viewer.layers[-1].data.tolist() == [[0, 184, 500], [0, 0, 0]]
+
+    widget.depth_input.setValue(2)
+    widget.collapse_to_depth()
+    assert viewer.layers[-1].data.tolist() == [[0, 567, 567], [567, 343, 343]]
+
+    widget.layer_selector.setCurrentText("registered")
+    widget.roll_up_counts()
+    model = widget.label_model
+    assert model.columnCount() == 3
+    assert model.data(model.index(0, 2)) == "2"  # Isocortex: 184 + 500
+
+
+def test_label_filter_without_hierarchy(qtbot, tmp_path, monkeypatch):
+    from napari.components import ViewerModel
+
+    from napari_segment_annotation.lable_filter import LabelFilter
+
+    from .test_atlas_loader import _registry
+
+    registry = _registry(tmp_path, monkeypatch)
+    # 重复的 ID 使结构树无法构建
+    with open(tmp_path / "ccfv3.json", "w") as f:
+        json.dump([{"id": "1", "safe_name": "Root"}, {"id": "1", "safe_name": "Root copy"}], f)
+    registry.release("ccfv3")
+    registry.get("ccfv3")  # 已缓存但尚未准备
+
+    viewer = ViewerModel()
+    viewer.add_labels(np.array([[0, 1]], dtype=np.uint32), name="registered")
+    widget = LabelFilter(viewer)
+    widget.update_layer_list()
+    qtbot.waitUntil(lambda: widget.table is not None, timeout=5000)
+    assert widget.table.hierarchy is None
+    assert not widget.descendants_button.isEnabled()
+    assert not widget.collapse_button.isEnabled()
+    assert not widget.counts_button.isEnabled()
+
+    widget.search_input.setText("copy")
+    widget.apply_search()
+    assert widget.label_model.rowCount() == 1
+    widget.roll_up_counts()
+    assert "unavailable" in widget.label_display.text()
+    assert len(viewer.layers) == 1
+
+    # 已准备好的缓存同步交付
+    other = LabelFilter(viewer)
+    assert other.table is widget.table and not other.counts_button.isEnabled()
+
+    # 切换到结构树正常的模板后重新启用
+    registry.release("visor")
+    widget.template_selector.setCurrentText("visor")
+    qtbot.waitUntil(lambda: widget.table is not None, timeout=5000)
+    assert widget.descendants_button.isEnabled()
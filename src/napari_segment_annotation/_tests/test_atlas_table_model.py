@@ -0,0 +1,53 @@
+import numpy as np
+from qtpy.QtCore import Qt
+
+from napari_segment_annotation.atlas_registry import AtlasRegistry
+from napari_segment_annotation.atlas_table_model import (
+    COUNT_COLUMN,
+    ID_COLUMN,
+    NAME_COLUMN,
+    AtlasTableModel,
+)
+
+from .test_atlas_registry import FIXTURE_DIR
+
+
+def _column(model, column, role=Qt.DisplayRole):
+    return [model.data(model.index(row, column), role) for row in range(model.rowCount())]
+
+
+def test_model_shows_rows_lazily_and_sorts(qtbot):
+    table = AtlasRegistry(cache_dir=None, url=FIXTURE_DIR).get("ccfv3")
+    model = AtlasTableModel()
+    model.set_table(table)
+    assert model.rowCount() == len(table) == 10
+    assert model.columnCount() == 2
+    assert model.headerData(NAME_COLUMN, Qt.Horizontal) == "Safe Name"
+    assert _column(model, ID_COLUMN)[:3] == ["997", "8", "567"]
+    assert model.data(model.index(0, NAME_COLUMN), Qt.ToolTipRole) == "root"
+
+    model.sort(ID_COLUMN, Qt.AscendingOrder)
+    assert [int(v) for v in _column(model, ID_COLUMN)] == sorted(table.ids.tolist())
+
+    # 排序方式在更换显示的行后保持不变，名称排序不区分大小写
+    model.sort(NAME_COLUMN, Qt.DescendingOrder)
+    model.set_rows(table.search_index.search("c"))
+    names = _column(model, NAME_COLUMN)
+    assert names == sorted(names, key=str.lower, reverse=True)
+    assert model.label_id(0) == int(table.ids[model.rows[0]])
+
+    model.set_rows(np.empty(0, dtype=np.int32))
+    assert model.rowCount() == 0
+
+
+def test_descending_sort_keeps_ties_in_order(qtbot):
+    table = AtlasRegistry(cache_dir=None, url=FIXTURE_DIR).get("ccfv3")
+    model = AtlasTableModel()
+    model.set_table(table)
+    model.set_counts(np.array([5, 1, 5, 0, 1, 0, 0, 2, 0, 0], dtype=np.int64))
+    assert model.columnCount() == 3
+
+    model.sort(COUNT_COLUMN, Qt.DescendingOrder)
+    assert model.rows.tolist() == [0, 2, 7, 1, 4, 3, 5, 6, 8, 9]
+    model.sort(COUNT_COLUMN, Qt.AscendingOrder)
+    assert model.rows.tolist() == [3, 5, 6, 8, 9, 1, 4, 7, 0, 2]
@@ -0,0 +1,127 @@
+import dask.array as da
+import numpy as np
+import pytest
+import tifffile
+from napari.layers import Labels
+
+from napari_segment_annotation.adjust_mask import adjust_mask
+from napari_segment_annotation.label_remap import (
+    apply_remap,
+    build_remap,
+    drop_labels,
+    invert_labels,
+    keep_labels,
+    parent_labels,
+    parse_label_spec,
+    parse_mapping_spec,
+    remap_labels,
+    renumber_labels,
+)
+
+
+def _reference(block, mapping, keep):
+    out = block.copy() if keep else np.zeros_like(block)
+    for old, new in mapping.items():
+        out[block == old] = new
+    return out
+
+
+@pytest.mark.parametrize("dense_limit", [1 << 22, 0])
+@pytest.mark.parametrize("keep", [True, False])
+def test_dense_and_sparse_paths_agree(dense_limit, keep):
+    block = np.random.default_rng(0).integers(0, 50, (4, 16, 16)).astype(np.uint32)
+    block[0, 0, 0] = 4_000_000_000
+    mapping = {3: 1, 7: 0, 49: 300, 4_000_000_000: 2} if dense_limit == 0 else {3: 1, 7: 0, 49: 300}
+    remap = build_remap(mapping, keep=keep, dense_limit=dense_limit)
+    assert (remap.lut is None) == (dense_limit == 0)
+    np.testing.assert_array_equal(apply_remap(block, remap), _reference(block, mapping, keep))
+
+
+def test_selectors():
+    block = np.array([0, 1, 2, 3, 10, 11, 12])
+    np.testing.assert_array_equal(apply_remap(block, keep_labels([2, 11])), [0, 0, 2, 0, 0, 11, 0])
+    np.testing.assert_array_equal(apply_remap(block, drop_labels([2, 11])), [0, 1, 0, 3, 10, 0, 12])
+    parents = {11: 10, 12: 11, 10: 1}
+    np.testing.assert_array_equal(apply_remap(block, parent_labels(parents)), [0, 1, 2, 3, 1, 10, 11])
+    np.testing.assert_array_equal(apply_remap(block, parent_labels(parents, levels=None)), [0, 1, 2, 3, 1, 1, 1])
+    np.testing.assert_array_equal(apply_remap(block, renumber_labels([12, 3, 0, 10])), [0, 0, 0, 1, 2, 0, 3])
+    with pytest.raises(ValueError):
+        parent_labels({1: 2, 2: 1}, levels=None)
+    with pytest.raises(ValueError):
+        parent_labels({1: 2, 2: 3, 3: 2}, levels=None)  # 环不经过起点
+
+
+def test_parse_specs():
+    assert parse_label_spec("1, 3 5-7") == [1, 3, 5, 6, 7]
+    assert parse_mapping_spec("3:1, 4:1") == {3: 1, 4: 1}
+    with pytest.raises(ValueError):
+        parse_mapping_spec("3")
+
+
+def test_remap_labels_numpy_in_place_and_dask():
+    data = np.zeros((3, 40, 40), dtype=np.uint16)
+    data[1, :10, :10] = 5
+    data[2, 30:, 30:] = 6
+    expected = _reference(data, {5: 2}, keep=True)
+
+    lazy, changed = remap_labels(da.from_array(data, chunks=(1, 20, 20)), build_remap({5: 2}))
+    assert changed is None
+    np.testing.assert_array_equal(lazy.compute(), expected)
+
+    out, changed = remap_labels(data, build_remap({5: 2}), out=data, chunk_edge=20)
+    assert out is data and changed == [(slice(1, 2), slice(0, 20), slice(0, 20))]
+    np.testing.assert_array_equal(data, expected)
+
+    widened, _ = remap_labels(data, build_remap({6: 70000}))
+    assert widened.dtype == np.uint32 and widened.max() == 70000
+    with pytest.raises(ValueError):
+        remap_labels(data, build_remap({6: 70000}), out=data)
+
+
+def test_dask_remap_dtype_matches_blocks():
+    data = np.zeros((2, 8, 8), dtype=np.uint16)
+    data[0, :4, :4] = 3
+    data[1, 4:, 4:] = 200
+    lazy = da.from_array(data, chunks=(1, 8, 8))
+    # 稠密查找表、超出查找表时的保留分支、searchsorted 分支、只保留所列标签
+    for remap in (
+        build_remap({3: 1}),
+        build_remap({3: 1, 2: 0}, dense_limit=1 << 22),
+        build_remap({3: 1}, dense_limit=0),
+        keep_labels([3]),
+    ):
+        result, _ = remap_labels(lazy, remap)
+        computed = result.compute()
+        assert result.dtype == computed.dtype == np.uint16
+        np.testing.assert_array_equal(computed, apply_remap(data, remap))
+
+
+def test_adjust_mask_keep_labels():
+    data = np.arange(16, dtype=np.uint8).reshape(1, 4, 4)
+    layer = Labels(data)
+    adjust_mask()(layer, "keep labels", 0, "2, 4-5", None)
+    assert layer.data is data
+    assert set(np.unique(layer.data)) == {0, 2, 4, 5}
+
+
+def test_invert_labels_chunked():
+    data = np.random.default_rng(1).integers(0, 9, (3, 30, 30)).astype(np.uint8)
+    expected = data.max() - data
+    lazy, _ = invert_labels(da.from_array(data, chunks=(1, 15, 15)))
+    np.testing.assert_array_equal(lazy.compute(), expected)
+    out, changed = invert_labels(data, out=data, chunk_edge=15)
+    assert out is data and len(changed) == 12
+    np.testing.assert_array_equal(data, expected)
+
+
+def test_adjust_mask_invert_and_save_tiff(tmp_path):
+    data = np.zeros((2, 10, 10), dtype=np.int64)
+    data[0, :3, :3] = 4
+    expected = 4 - data
+    layer = Labels(data)
+    path = tmp_path / "mask.tif"
+    adjust_mask()(layer, "invert", 0, "", path)
+    assert layer.data is data
+    saved = tifffile.imread(str(path))
+    assert saved.dtype == np.uint16
+    np.testing.assert_array_equal(saved, expected)
@@ -0,0 +1,106 @@
+from collections.abc import MutableSequence
+
+import numpy as np
+import zarr
+from napari.layers import Labels
+
+from napari_segment_annotation import labels_store, napari_get_reader
+from napari_segment_annotation.labels_store import (
+    DirtyChunkWriter,
+    save_labels_incremental,
+)
+
+
+def _chunk_files(path):
+    return {key for key in zarr.open_array(path, mode="r").store if not key.startswith(".")}
+
+
+def test_dirty_chunk_writer_writes_only_changed_chunks(tmp_path):
+    layer = Labels(np.zeros((3, 64, 64), dtype=np.uint16))
+    path = str(tmp_path / "labels.zarr")
+    writer = DirtyChunkWriter(layer, path, chunk_edge=32)
+
+    assert writer.save() == 3 * 2 * 2
+    assert _chunk_files(path) == set()  # 全零块不落盘
+
+    layer.paint((1, 40, 10), 5)
+    assert writer.dirty_chunks == {(1, 1, 0)}
+    assert writer.save() == 1
+    assert writer.save() == 0
+    np.testing.assert_array_equal(zarr.open_array(path, mode="r")[:], layer.data)
+
+    layer.data_setitem((np.array([2, 2]), np.array([0, 63]), np.array([0, 63])), 9)
+    assert writer.dirty_chunks == {(2, 0, 0), (2, 0, 1), (2, 1, 0), (2, 1, 1)}
+    writer.save()
+
+    layer.undo()
+    assert writer.dirty_chunks == {(2, 0, 0), (2, 0, 1), (2, 1, 0), (2, 1, 1)}
+    writer.save()
+    layer.redo()
+    writer.save()
+    np.testing.assert_array_equal(zarr.open_array(path, mode="r")[:], layer.data)
+
+    layer.data = np.ones((3, 64, 64), dtype=np.uint16)
+    assert len(writer.dirty_chunks) == 12
+    writer.close()
+
+
+def test_save_labels_incremental_reads_back_as_labels(tmp_path):
+    data = np.zeros((2, 20, 20), dtype=np.uint32)
+    data[1, 5:10, 5:10] = 3
+    layer = Labels(data)
+    path = str(tmp_path / "mask.zarr")
+
+    assert save_labels_incremental(layer, path) > 0
+    layer.paint((0, 2, 2), 4)
+    assert save_labels_incremental(layer, path) == 1
+
+    [(read, _, layer_type)] = napari_get_reader(path)(path)
+    assert layer_type == "labels"
+    np.testing.assert_array_equal(np.asarray(read), layer.data)
+
+
+def test_undo_redo_tracking_across_writers(tmp_path):
+    layer = Labels(np.zeros((2, 64, 64), dtype=np.uint16))
+    first = DirtyChunkWriter(layer, str(tmp_path / "a.zarr"), chunk_edge=32)
+    second = DirtyChunkWriter(layer, str(tmp_path / "b.zarr"), chunk_edge=32)
+    first.save()
+    second.save()
+
+    # 撤销/重做依赖 napari 内部的历史栈；不满足时保存退化为标记全部块
+    for name in ("_undo_history", "_redo_history"):
+        assert isinstance(getattr(layer, name, None), MutableSequence), (
+            f"napari Labels.{name} changed, undo/redo no longer saves incrementally"
+        )
+
+    layer.paint((1, 40, 10), 5)
+    first.save()
+    second.save()
+    layer.undo()
+    assert first.dirty_chunks == second.dirty_chunks == {(1, 1, 0)}
+    first.save()
+    second.save()
+    layer.undo()  # 没有可撤销的记录
+    assert first.dirty_chunks == set()
+
+    first.close()
+    assert "undo" in layer.__dict__
+    layer.redo()
+    assert second.dirty_chunks == {(1, 1, 0)}
+    second.close()
+    # 没有写入器后图层上不再留有包装
+    assert "undo" not in layer.__dict__ and "redo" not in layer.__dict__
+
+
+def test_undo_without_napari_history_marks_everything(tmp_path, monkeypatch):
+    # 模拟 napari 改名了内部历史栈
+    monkeypatch.setattr(
+        labels_store, "_HISTORY_STACKS", (("undo", "_missing_undo", "_missing_redo"), ("redo", "_missing_redo", "_missing_undo"))
+    )
+    layer = Labels(np.zeros((2, 64, 64), dtype=np.uint16))
+    writer = DirtyChunkWriter(layer, str(tmp_path / "a.zarr"), chunk_edge=32)
+    layer.paint((1, 40, 10), 5)
+    writer.save()
+    layer.undo()
+    assert len(writer.dirty_chunks) == 2 * 2 * 2
+    writer.close()
@@ -0,0 +1,14 @@
+import numpy as np
+
+from napari_segment_annotation.lazy_volume import create_sparse_labels
+
+
+def test_sparse_labels_allocate_only_written_slices():
+    labels = create_sparse_labels((200, 64, 64))
+    assert labels.chunks == (1, 64, 64)
+    assert labels.nchunks_initialized == 0
+
+    labels[10] = np.ones((64, 64), dtype=np.uint8)
+    assert labels.nchunks_initialized == 1
+    assert labels[10].sum() == 64 * 64
+    assert labels[11].sum() == 0
@@ -0,0 +1,182 @@
+import dask.array as da
+import numpy as np
+import pytest
+import zarr
+from napari.components import ViewerModel
+from napari.layers import Labels
+from qtpy.QtCore import Qt
+
+from napari_segment_annotation.labels_store import (
+    DirtyChunkWriter,
+    mark_layer_region,
+)
+from napari_segment_annotation.mask_merge import (
+    FILL_BACKGROUND,
+    KEEP_BASE,
+    OVERWRITE,
+    MergeSource,
+    mapping_lut,
+    merge_labels,
+    merge_sources,
+)
+from napari_segment_annotation.merge_masks import refresh_regions
+from napari_segment_annotation.multi_mask_merge import (
+    LAYER_COLUMN,
+    LUT_COLUMN,
+    MultiMaskMerger,
+)
+
+
+def _masks():
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 4, (3, 40, 40)).astype(np.uint16)
+    overlay = np.zeros((3, 40, 40), dtype=np.uint16)
+    overlay[1, 5:20, 25:35] = 9
+    return base, overlay
+
+
+def _expected(base, overlay):
+    expected = base.copy()
+    np.copyto(expected, overlay, where=overlay != 0)
+    return expected
+
+
+def test_merge_numpy_in_place_reports_changed_chunks():
+    base, overlay = _masks()
+    expected = _expected(base, overlay)
+    merged, changed = merge_labels(base, overlay, chunk_edge=16, max_workers=4)
+    assert merged is base
+    np.testing.assert_array_equal(base, expected)
+    assert {(r[1].start, r[2].start) for r in changed} == {(0, 16), (0, 32), (16, 16), (16, 32)}
+    assert all(r[0] == slice(1, 2) for r in changed)
+
+
+def test_merge_zarr_base_with_dask_overlay(tmp_path):
+    base, overlay = _masks()
+    expected = _expected(base, overlay)
+    store = zarr.open_array(str(tmp_path / "base.zarr"), mode="w", shape=base.shape, chunks=(1, 20, 20), dtype=base.dtype)
+    store[:] = base
+    merged, changed = merge_labels(store, da.from_array(overlay.astype(np.int64), chunks=(1, 40, 40)))
+    assert merged is store and len(changed) == 1
+    np.testing.assert_array_equal(store[:], expected)
+
+
+def test_merge_dask_base_is_lazy():
+    base, overlay = _masks()
+    merged, changed = merge_labels(da.from_array(base, chunks=(1, 20, 20)), overlay)
+    assert isinstance(merged, da.Array) and changed is None
+    np.testing.assert_array_equal(merged.compute(), _expected(base, overlay))
+
+
+def test_merge_rejects_values_that_do_not_fit():
+    base = np.zeros((2, 8, 8), dtype=np.uint8)
+    overlay = np.zeros((2, 8, 8), dtype=np.uint16)
+    overlay[0, 0, 0] = 300
+    with pytest.raises(ValueError):
+        merge_labels(base, overlay)
+    assert not base.any()
+    with pytest.raises(ValueError):
+        merge_labels(base, overlay[:1])
+
+
+def test_mark_layer_region_reaches_writers(tmp_path):
+    base, overlay = _masks()
+    layer = Labels(base)
+    writer = DirtyChunkWriter(layer, str(tmp_path / "labels.zarr"), chunk_edge=20)
+    writer.save()
+    _, changed = merge_labels(layer.data, overlay, chunk_edge=20)
+    for region in changed:
+        mark_layer_region(layer, region)
+    assert writer.dirty_chunks == {(1, 0, 1)}
+    writer.save()
+    np.testing.assert_array_equal(writer.store[:], layer.data)
+
+
+def test_merge_sources_priority_modes_and_conflicts():
+    base = np.zeros((1, 4, 4), dtype=np.uint16)
+    base[0, 0, :2] = 1
+    a = np.zeros_like(base)
+    a[0, 0, :] = 2
+    b = np.zeros_like(base)
+    b[0, 0, 1:3] = 3
+    b[0, 1, 0] = 3
+    c = np.zeros_like(base)
+    c[0, 0, :] = 4
+
+    sources = [
+        MergeSource(a, mode=FILL_BACKGROUND, priority=0),
+        MergeSource(b, mode=OVERWRITE, priority=2),
+        MergeSource(c, mode=KEEP_BASE, priority=1),
+    ]
+    merged, changed, conflicts = merge_sources(base, sources)
+    # a 只填背景，c 覆盖 a 但不覆盖基础 mask，b 优先级最高最后覆盖
+    np.testing.assert_array_equal(merged[0, 0], [1, 3, 3, 4])
+    assert merged[0, 1, 0] == 3
+    assert conflicts == [2, 2, 2]
+    assert len(changed) == 1
+
+
+def test_merge_sources_offset_and_lut():
+    base = np.zeros((2, 6, 6), dtype=np.uint8)
+    a = np.zeros((2, 6, 6), dtype=np.int64)
+    a[0, :2, :2] = 1
+    a[1, 3:, 3:] = 2
+    lut = np.array([0, 5, 0])
+    merged, _, conflicts = merge_sources(base, [MergeSource(a, lut=lut, offset=10)])
+    assert set(np.unique(merged)) == {0, 15}
+    assert conflicts == [0]
+
+    with pytest.raises(ValueError):
+        merge_sources(base, [MergeSource(a, offset=300)])
+    with pytest.raises(ValueError):
+        merge_sources(base, [MergeSource(a, lut=np.array([0, 1]))])
+    with pytest.raises(ValueError):
+        merge_sources(base, [MergeSource(a, mode="replace")])
+
+
+def test_merge_sources_dask_base_matches_numpy():
+    base, overlay = _masks()
+    sources = [MergeSource(overlay, mode=FILL_BACKGROUND), MergeSource(overlay[::-1].copy(), offset=2, priority=1)]
+    lazy, _, _ = merge_sources(da.from_array(base, chunks=(1, 20, 20)), sources)
+    eager, _, _ = merge_sources(base.copy(), sources)
+    np.testing.assert_array_equal(lazy.compute(), eager)
+
+
+def test_multi_mask_merger_remap_column(qtbot):
+    base = np.zeros((2, 6, 6), dtype=np.uint16)
+    overlay = np.zeros((2, 6, 6), dtype=np.uint16)
+    overlay[0, :2, :2] = 3
+    overlay[1, 3:, 3:] = 4
+    np.testing.assert_array_equal(mapping_lut({3: 1}, 4), [0, 1, 2, 1, 4])
+
+    viewer = ViewerModel()
+    viewer.add_labels(base, name="base")
+    viewer.add_labels(overlay, name="overlay")
+    widget = MultiMaskMerger(viewer)
+    qtbot.addWidget(widget)
+    widget.base_selector.setCurrentText("base")
+    widget.layer_table.item(0, LAYER_COLUMN).setCheckState(Qt.Checked)
+    widget.layer_table.cellWidget(0, LUT_COLUMN).setText("3:1, 4:0")
+    widget.merge()
+
+    merged = viewer.layers["base"].data
+    assert merged[0, 0, 0] == 1 and not merged[1].any()
+
+    widget.layer_table.cellWidget(0, LUT_COLUMN).setText("3")
+    widget.merge()
+    assert widget.status_label.text().startswith("Error")
+
+
+def test_refresh_regions_without_napari_slice_point(monkeypatch):
+    layer = Labels(np.zeros((3, 8, 8), dtype=np.uint8))
+    refreshed = []
+    monkeypatch.setattr(layer, "refresh", lambda *args, **kwargs: refreshed.append(True))
+    refresh_regions(layer, [(slice(2, 3), slice(0, 8), slice(0, 8))])
+    assert refreshed == []  # 不在当前切片
+
+    def missing():
+        raise AttributeError("_get_pt_not_disp")
+
+    monkeypatch.setattr(layer, "_get_pt_not_disp", missing)
+    refresh_regions(layer, [(slice(2, 3), slice(0, 8), slice(0, 8))])
+    assert refreshed == [True]
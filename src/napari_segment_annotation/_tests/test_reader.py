@@ -1,4 +1,5 @@
 import numpy as np
+import tifffile
 
 from napari_segment_annotation import napari_get_reader
 
@@ -26,6 +27,67 @@ def test_reader(tmp_path):
     np.testing.assert_allclose(original_data, layer_data_tuple[0])
 
 
+def test_reader_is_lazy(tmp_path):
+    """Single files are memory-mapped, lists of files are stacked lazily."""
+    paths = [str(tmp_path / f"slice{i}.npy") for i in range(3)]
+    for i, path in enumerate(paths):
+        np.save(path, np.full((4, 5), i, dtype=np.uint16))
+
+    single = napari_get_reader(paths[0])(paths[0])[0][0]
+    assert isinstance(single, np.memmap)
+
+    stack = napari_get_reader(paths)(paths)[0][0]
+    assert not isinstance(stack, np.ndarray)
+    assert stack.shape == (3, 4, 5)
+    np.testing.assert_array_equal(np.asarray(stack[2]), 2)
+
+
+def test_tiff_stack_reader(tmp_path):
+    """A directory of per-slice TIFFs opens lazily in natural file order."""
+    for z in (0, 1, 2, 10):
+        tifffile.imwrite(tmp_path / f"slice_{z}.tif", np.full((6, 7), z, dtype=np.uint16))
+
+    reader = napari_get_reader(str(tmp_path))
+    assert callable(reader)
+    stack = reader(str(tmp_path))[0][0]
+    assert stack.shape == (4, 6, 7) and stack.chunksize == (1, 6, 7)
+    np.testing.assert_array_equal(np.asarray(stack[:, 0, 0]), [0, 1, 2, 10])
+
+    pattern = str(tmp_path / "slice_1*.tif")
+    assert napari_get_reader(pattern)(pattern)[0][0].shape == (2, 6, 7)
+    # a pattern that matches no TIFF is not a stack
+    assert napari_get_reader(str(tmp_path / "missing_*.tif")) is None
+
+
+def test_single_tiff_and_bracketed_names(tmp_path):
+    """Single TIFF files open lazily; '[' in a file name is not a glob."""
+    data = np.arange(3 * 5 * 4, dtype=np.uint16).reshape(3, 5, 4)
+    tif_path = str(tmp_path / "volume.tif")
+    tifffile.imwrite(tif_path, data)
+    reader = napari_get_reader(tif_path)
+    assert callable(reader)
+    layer_data = reader(tif_path)[0][0]
+    assert layer_data.shape == data.shape
+    np.testing.assert_array_equal(np.asarray(layer_data), data)
+
+    npy_path = str(tmp_path / "brain[1].npy")
+    np.save(npy_path, data)
+    np.testing.assert_array_equal(napari_get_reader(npy_path)(npy_path)[0][0], data)
+
+
+def test_write_tiff_pages_streams_slices(tmp_path):
+    import dask.array as da
+
+    from napari_segment_annotation.tiff_stack import write_tiff_pages
+
+    data = np.arange(4 * 8 * 6, dtype=np.uint32).reshape(4, 8, 6)
+    path = str(tmp_path / "labels.tif")
+    write_tiff_pages(path, da.from_array(data, chunks=(1, 8, 6)), dtype=np.uint16)
+    read = tifffile.imread(path)
+    assert read.dtype == np.uint16
+    np.testing.assert_array_equal(read, data)
+
+
 def test_get_reader_pass():
     reader = napari_get_reader("fake.file")
     assert reader is None
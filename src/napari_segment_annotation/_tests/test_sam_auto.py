@@ -0,0 +1,53 @@
+import numpy as np
+import torch
+
+from napari_segment_annotation.sam_auto import (
+    auto_segment_volume,
+    generate_masks,
+    mask_boxes,
+    match_labels,
+)
+from napari_segment_annotation.sam_embedding_cache import EmbeddingCache
+
+
+def test_mask_boxes_vectorized():
+    masks = torch.zeros(2, 8, 8, dtype=torch.bool)
+    masks[0, 2:5, 1:7] = True
+    boxes = mask_boxes(masks)
+    assert boxes.tolist() == [[1, 2, 6, 4], [0, 0, 0, 0]]
+
+
+def test_match_labels_carries_ids_across_slices():
+    previous = np.zeros((8, 8), dtype=np.uint32)
+    previous[:4, :4] = 5
+    previous[4:, 4:] = 9
+    current = np.zeros((8, 8), dtype=np.uint32)
+    current[1:4, :4] = 1  # overlaps 5
+    current[:2, 6:] = 2  # overlaps nothing
+
+    relabeled, next_id = match_labels(previous, current, next_id=10)
+
+    assert set(np.unique(relabeled)) == {0, 5, 10}
+    assert relabeled[2, 2] == 5 and relabeled[0, 7] == 10
+    assert next_id == 11
+
+
+def test_auto_segment_volume_grid_prompts(fake_predictor):
+    image = np.zeros((3, 32, 32), dtype=np.uint8)
+    options = {"points_per_side": 4, "points_per_batch": 5, "stability_thresh": 0.0, "pred_iou_thresh": 0.5}
+
+    fake_predictor.set_image(np.zeros((32, 32, 3), dtype=np.uint8))
+    masks, scores = generate_masks(fake_predictor, **options)
+    assert masks.shape == (16, 32, 32) and len(scores) == 16
+    assert fake_predictor.decoder_calls == 4  # 16 grid points in batches of 5
+
+    slices = list(
+        auto_segment_volume(
+            fake_predictor, image, EmbeddingCache(), ("vit_b",), "layer", **options
+        )
+    )
+    assert [z for z, _ in slices] == [0, 1, 2]
+    # the same objects on every slice keep their labels through the stack
+    for _, label_map in slices:
+        np.testing.assert_array_equal(label_map, slices[0][1])
+    assert len(np.unique(slices[0][1])) == 17
@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+import torch
+from segment_anything import SamPredictor
+from segment_anything.modeling import (
+    ImageEncoderViT,
+    MaskDecoder,
+    PromptEncoder,
+    Sam,
+    TwoWayTransformer,
+)
+
+from napari_segment_annotation.sam_backends import (
+    create_predictor,
+    quantize_encoder,
+)
+from napari_segment_annotation.sam_inference import predict_objects
+
+
+def _tiny_sam():
+    """A randomly initialised SAM small enough to export in a few seconds."""
+    torch.manual_seed(0)
+    dim = 32
+    sam = Sam(
+        image_encoder=ImageEncoderViT(
+            img_size=64,
+            patch_size=16,
+            embed_dim=dim,
+            depth=2,
+            num_heads=2,
+            mlp_ratio=2.0,
+            out_chans=dim,
+            qkv_bias=True,
+            use_rel_pos=True,
+            window_size=2,
+            global_attn_indexes=(1,),
+        ),
+        prompt_encoder=PromptEncoder(
+            embed_dim=dim,
+            image_embedding_size=(4, 4),
+            input_image_size=(64, 64),
+            mask_in_chans=16,
+        ),
+        mask_decoder=MaskDecoder(
+            num_multimask_outputs=3,
+            transformer=TwoWayTransformer(depth=2, embedding_dim=dim, mlp_dim=64, num_heads=2),
+            transformer_dim=dim,
+            iou_head_depth=2,
+            iou_head_hidden_dim=32,
+        ),
+        pixel_mean=[123.675, 116.28, 103.53],
+        pixel_std=[58.395, 57.12, 57.375],
+    )
+    return sam.eval()
+
+
+def _image():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 255, (40, 56, 3), dtype=np.uint8)
+
+
+_COORDS = np.array([[10.0, 12.0], [30.0, 25.0], [45.0, 8.0]])
+_LABELS = np.array([1, 0, 1])
+_OBJECTS = np.array([1, 1, 2])
+
+
+def _agreement(a, b):
+    return np.mean(a == b)
+
+
+def test_onnx_backend_matches_pytorch(tmp_path):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+    from napari_segment_annotation.sam_backends import OnnxSam, export_onnx
+
+    sam = _tiny_sam()
+    paths = [str(tmp_path / name) for name in ("enc.onnx", "dec.onnx", "meta.json")]
+    export_onnx(sam, *paths)
+
+    reference = SamPredictor(sam)
+    onnx = create_predictor(OnnxSam(*paths, intra_op_threads=1))
+    image = _image()
+    with torch.no_grad():
+        reference.set_image(image)
+    onnx.set_image(image)
+    np.testing.assert_allclose(onnx.features.numpy(), reference.features.numpy(), atol=1e-4)
+
+    coords = torch.as_tensor(
+        reference.transform.apply_coords(_COORDS[None], reference.original_size), dtype=torch.float
+    )
+    labels = torch.as_tensor(_LABELS[None])
+    with torch.no_grad():
+        expected = reference.predict_torch(coords, labels, multimask_output=True, return_logits=True)
+    actual = onnx.predict_torch(coords, labels, multimask_output=True, return_logits=True)
+    for a, b in zip(actual, expected):
+        assert a.shape == b.shape
+        np.testing.assert_allclose(a.numpy(), b.numpy(), atol=1e-3)
+
+    with torch.no_grad():
+        expected_map = predict_objects(reference, _COORDS, _LABELS, _OBJECTS)
+    assert _agreement(predict_objects(onnx, _COORDS, _LABELS, _OBJECTS), expected_map) > 0.999
+
+
+def test_onnx_int8_backend_close_to_pytorch(tmp_path):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+    from napari_segment_annotation.sam_backends import (
+        OnnxSam,
+        export_onnx,
+        quantize_onnx,
+    )
+
+    sam = _tiny_sam()
+    encoder, encoder_int8, decoder, meta = (
+        str(tmp_path / name) for name in ("enc.onnx", "enc_int8.onnx", "dec.onnx", "meta.json")
+    )
+    export_onnx(sam, encoder, decoder, meta)
+    quantize_onnx(encoder, encoder_int8)
+
+    reference = SamPredictor(sam)
+    quantized = create_predictor(OnnxSam(encoder_int8, decoder, meta))
+    image = _image()
+    with torch.no_grad():
+        reference.set_image(image)
+        expected = predict_objects(reference, _COORDS, _LABELS, _OBJECTS)
+    quantized.set_image(image)
+    assert _agreement(predict_objects(quantized, _COORDS, _LABELS, _OBJECTS), expected) > 0.95
+
+
+def test_pytorch_int8_backend_close_to_pytorch():
+    sam = _tiny_sam()
+    reference = SamPredictor(sam)
+    image = _image()
+    with torch.no_grad():
+        reference.set_image(image)
+        expected = predict_objects(reference, _COORDS, _LABELS, _OBJECTS)
+
+        quantized = create_predictor(quantize_encoder(_tiny_sam()))
+        quantized.set_image(image)
+        actual = predict_objects(quantized, _COORDS, _LABELS, _OBJECTS)
+
+    assert isinstance(quantized, SamPredictor)
+    assert _agreement(actual, expected) > 0.95
@@ -0,0 +1,43 @@
+import json
+
+import numpy as np
+import zarr
+
+from napari_segment_annotation import sam_batch
+
+
+def test_load_prompt_file_csv_and_json(tmp_path):
+    csv_path = tmp_path / "prompts.csv"
+    csv_path.write_text("z,y,x,label\n1,4,5,1\n3,8,9,0\n")
+    point_data, point_labels, object_ids = sam_batch.load_prompt_file(str(csv_path))
+    np.testing.assert_array_equal(point_data, [[1, 4, 5], [3, 8, 9]])
+    np.testing.assert_array_equal(point_labels, [1, 0])
+    np.testing.assert_array_equal(object_ids, [1, 1])
+
+    json_path = tmp_path / "prompts.json"
+    json_path.write_text(json.dumps({"points": [{"z": 2, "y": 1, "x": 1, "object_id": 7}]}))
+    _, point_labels, object_ids = sam_batch.load_prompt_file(str(json_path))
+    np.testing.assert_array_equal(point_labels, [1])
+    np.testing.assert_array_equal(object_ids, [7])
+
+
+def test_run_batch_writes_prompted_slices(tmp_path, monkeypatch, fake_predictor):
+    volume_path = str(tmp_path / "volume.npy")
+    np.save(volume_path, np.zeros((6, 16, 16), dtype=np.uint8))
+    prompts_path = tmp_path / "prompts.csv"
+    prompts_path.write_text("z,y,x,label,object_id\n1,4,4,1,2\n4,10,10,1,300\n")
+    monkeypatch.setattr(sam_batch, "resolve_checkpoint", lambda model_type, path: path)
+    monkeypatch.setattr(
+        sam_batch,
+        "load_predictor",
+        lambda *args, **kwargs: (fake_predictor, ("vit_b", "sam.pth", 0.0, "cpu", "pytorch")),
+    )
+
+    output_path = str(tmp_path / "labels.zarr")
+    sam_batch.run_batch(volume_path, str(prompts_path), output_path, checkpoint_path="sam.pth")
+
+    labels = zarr.open_array(output_path, mode="r")
+    assert labels.shape == (6, 16, 16) and labels.dtype == np.uint16
+    assert labels[1, 4, 4] == 2 and labels[4, 10, 10] == 300
+    assert not labels[0].any() and not labels[1, 10, 10]
+    assert fake_predictor.encoder_calls == 2
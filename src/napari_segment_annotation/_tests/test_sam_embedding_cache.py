@@ -0,0 +1,50 @@
+import numpy as np
+
+from napari_segment_annotation.sam_embedding_cache import (
+    EmbeddingCache,
+    apply_embedding,
+    slice_to_rgb,
+)
+
+
+def test_embedding_cache_reuses_encoder_output(tmp_path, fake_predictor):
+    predictor = fake_predictor
+    model_key = ("vit_b", str(tmp_path / "sam.pth"), 0.0, "cpu")
+    image = np.arange(32, dtype=np.uint8).reshape(2, 4, 4)
+    cache = EmbeddingCache(cache_dir=str(tmp_path / "embeddings"))
+
+    key = cache.make_key(model_key, "layer", 1, image[1])
+    first = cache.get_or_compute(key, predictor, slice_to_rgb(image[1]))
+    second = cache.get_or_compute(key, predictor, slice_to_rgb(image[1]))
+    assert predictor.encoder_calls == 1
+    assert second is first
+    # computing an embedding must not touch the predictor's own image
+    assert not predictor.is_image_set
+
+    apply_embedding(predictor, first)
+    assert predictor.is_image_set
+    assert predictor.original_size == (4, 4)
+
+    # a changed slice gets a new key
+    image[1, 0, 0] = 255
+    assert cache.make_key(model_key, "layer", 1, image[1]) != key
+
+    # the disk tier survives a new cache instance (e.g. a new session)
+    reloaded = EmbeddingCache(cache_dir=str(tmp_path / "embeddings"))
+    hit = reloaded.get(
+        reloaded.make_key(model_key, "other-layer", 1, np.arange(16, 32, dtype=np.uint8).reshape(4, 4))
+    )
+    assert hit is not None
+    np.testing.assert_array_equal(hit.features, first.features)
+    assert hit.input_size == (8, 8)
+
+
+def test_embedding_cache_memory_limit(fake_predictor):
+    cache = EmbeddingCache(max_memory_bytes=100)
+    for z in range(3):
+        image = np.full((4, 4, 3), z, dtype=np.uint8)
+        key = ("model", "layer", z, str(z))
+        cache.get_or_compute(key, fake_predictor, image)
+    # every embedding is 64 bytes, so only the most recent one fits
+    assert len(cache) == 1
+    assert cache.memory_bytes == 64
@@ -0,0 +1,89 @@
+import numpy as np
+from napari.components import ViewerModel
+
+from napari_segment_annotation import sam_live
+from napari_segment_annotation.sam_embedding_cache import EmbeddingCache
+
+
+def test_live_segmentation_coalesces_clicks(qtbot, monkeypatch, fake_predictor):
+    monkeypatch.setattr(
+        sam_live, "load_predictor", lambda *args, **kwargs: (fake_predictor, ("fake",))
+    )
+    monkeypatch.setattr(sam_live, "get_embedding_cache", lambda cache_dir: EmbeddingCache())
+
+    viewer = ViewerModel()
+    image_layer = viewer.add_image(np.zeros((3, 16, 16), dtype=np.uint8))
+    points_layer = viewer.add_points(
+        np.empty((0, 3)), properties={"label": np.empty(0, dtype=int)}
+    )
+    viewer.dims.set_current_step(0, 1)
+
+    session = sam_live.LiveSegmentation(
+        viewer, image_layer, points_layer, debounce_ms=50
+    )
+    points_layer.feature_defaults = {"label": 1}
+    for yx in (2, 7, 12):
+        points_layer.add([[1, yx, yx]])
+
+    output = session.output_layer.data
+    qtbot.waitUntil(lambda: output[1, 12, 12] == 1, timeout=5000)
+    qtbot.wait(100)
+
+    # three rapid clicks are coalesced into a single decoder run
+    assert fake_predictor.decoder_calls == 1
+    # the embedding was computed once, by the prefetch or the click
+    assert fake_predictor.encoder_calls == 1
+    assert output[1, 2, 2] == 1 and output[1, 7, 7] == 1
+    assert not output[0].any() and not output[2].any()
+    session.close()
+
+
+def test_live_segmentation_coalesces_prefetch(qtbot, monkeypatch, fake_predictor):
+    monkeypatch.setattr(
+        sam_live, "load_predictor", lambda *args, **kwargs: (fake_predictor, ("fake",))
+    )
+    monkeypatch.setattr(sam_live, "get_embedding_cache", lambda cache_dir: EmbeddingCache())
+
+    viewer = ViewerModel()
+    image_layer = viewer.add_image(np.zeros((20, 16, 16), dtype=np.uint8))
+    points_layer = viewer.add_points(
+        np.empty((0, 3)), properties={"label": np.empty(0, dtype=int)}
+    )
+    session = sam_live.LiveSegmentation(viewer, image_layer, points_layer, prefetch_ms=50)
+
+    # scrolling through every slice encodes only the slice the user stops on
+    for z in range(20):
+        viewer.dims.set_current_step(0, z)
+    qtbot.waitUntil(lambda: fake_predictor.encoder_calls == 1, timeout=5000)
+    qtbot.wait(200)
+    assert fake_predictor.encoder_calls == 1
+    session.close()
+
+
+def test_live_segmentation_hashes_slice_once_per_click(qtbot, monkeypatch, fake_predictor):
+    cache = EmbeddingCache()
+    monkeypatch.setattr(
+        sam_live, "load_predictor", lambda *args, **kwargs: (fake_predictor, ("fake",))
+    )
+    monkeypatch.setattr(sam_live, "get_embedding_cache", lambda cache_dir: cache)
+
+    viewer = ViewerModel()
+    image_layer = viewer.add_image(np.zeros((3, 16, 16), dtype=np.uint8))
+    points_layer = viewer.add_points(
+        np.empty((0, 3)), properties={"label": np.empty(0, dtype=int)}
+    )
+    session = sam_live.LiveSegmentation(
+        viewer, image_layer, points_layer, debounce_ms=10, prefetch_ms=10
+    )
+    viewer.dims.set_current_step(0, 1)
+    qtbot.waitUntil(lambda: fake_predictor.encoder_calls == 1, timeout=5000)
+
+    keys = []
+    make_key = cache.make_key
+    monkeypatch.setattr(cache, "make_key", lambda *args: keys.append(args) or make_key(*args))
+    points_layer.feature_defaults = {"label": 1}
+    points_layer.add([[1, 5, 5]])
+    output = session.output_layer.data
+    qtbot.waitUntil(lambda: output[1, 5, 5] == 1, timeout=5000)
+    assert len(keys) == 1
+    session.close()
@@ -0,0 +1,95 @@
+import os
+
+import torch
+
+from napari_segment_annotation.sam_model_cache import SamModelCache
+
+
+def _fake_loader(calls):
+    def loader(model_type, checkpoint_path, device, backend="pytorch", **kwargs):
+        calls.append((model_type, checkpoint_path))
+        return torch.nn.Linear(16, 16)  # 16*16*4 + 16*4 = 1088 bytes
+
+    return loader
+
+
+def _checkpoint(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b"ckpt")
+    return str(path)
+
+
+def test_model_cache_hit_and_lru_eviction(tmp_path):
+    calls = []
+    cache = SamModelCache(max_models=2, loader=_fake_loader(calls))
+    a = _checkpoint(tmp_path, "a.pth")
+    b = _checkpoint(tmp_path, "b.pth")
+    c = _checkpoint(tmp_path, "c.pth")
+
+    model_a = cache.get_model("vit_b", a, "cpu")
+    assert cache.get_model("vit_b", a, "cpu") is model_a
+    assert len(calls) == 1
+
+    cache.get_model("vit_b", b, "cpu")
+    cache.get_model("vit_b", a, "cpu")  # a becomes most recently used
+    cache.get_model("vit_b", c, "cpu")  # evicts b
+    keys = cache.keys()
+    assert [key[1] for key in keys] == [a, c]
+
+
+def test_model_cache_reloads_changed_checkpoint(tmp_path):
+    calls = []
+    cache = SamModelCache(loader=_fake_loader(calls))
+    path = _checkpoint(tmp_path, "a.pth")
+    first = cache.get_model("vit_b", path, "cpu")
+
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    second = cache.get_model("vit_b", path, "cpu")
+
+    assert second is not first
+    assert len(cache) == 1
+
+
+def test_model_cache_memory_limit_and_unload(tmp_path):
+    cache = SamModelCache(
+        max_models=10, max_memory_bytes=1500, loader=_fake_loader([])
+    )
+    cache.get_model("vit_b", _checkpoint(tmp_path, "a.pth"), "cpu")
+    cache.get_model("vit_l", _checkpoint(tmp_path, "b.pth"), "cpu")
+    assert len(cache) == 1
+    assert cache.memory_bytes == 1088
+
+    assert cache.unload("vit_b") == 0
+    assert cache.unload() == 1
+    assert len(cache) == 0
+
+
+def test_model_cache_separates_backends(tmp_path):
+    calls = []
+    cache = SamModelCache(max_models=4, loader=_fake_loader(calls))
+    path = _checkpoint(tmp_path, "a.pth")
+
+    fp32 = cache.get_model("vit_b", path, "cpu")
+    int8 = cache.get_model("vit_b", path, "cpu", backend="pytorch-int8")
+    onnx = cache.get_model("vit_b", path, "cpu", backend="onnx")
+    assert len({id(fp32), id(int8), id(onnx)}) == 3
+    assert cache.get_model("vit_b", path, "cpu", backend="onnx") is onnx
+    assert len(calls) == 3
+
+    # new ONNX Runtime thread settings drop only the ONNX sessions
+    cache.configure(intra_op_threads=2)
+    keys = cache.keys()
+    assert sorted(key[4] for key in keys) == ["pytorch", "pytorch-int8"]
+
+
+def test_configure_keeps_unspecified_limits():
+    cache = SamModelCache(max_models=3, max_memory_bytes=4096)
+    cache.configure(intra_op_threads=2)
+    assert cache.max_memory_bytes == 4096
+    assert cache.max_models == 3
+    assert cache.intra_op_threads == 2
+
+    # None explicitly removes the memory limit
+    cache.configure(max_memory_bytes=None)
+    assert cache.max_memory_bytes is None
@@ -0,0 +1,51 @@
+import numpy as np
+
+from napari_segment_annotation.sam_embedding_cache import EmbeddingCache
+from napari_segment_annotation.sam_propagation import (
+    mask_prompts,
+    propagate_from_seeds,
+    propagation_ranges,
+)
+
+
+def _sphere_volume(depth=20, size=32, center=10, radius=6):
+    zz, yy, xx = np.mgrid[:depth, :size, :size]
+    inside = (zz - center) ** 2 + (yy - 16) ** 2 + (xx - 16) ** 2 <= radius**2
+    return (inside * 200).astype(np.uint8)
+
+
+def test_mask_prompts_box_and_interior_point():
+    label_map = np.zeros((10, 10), dtype=np.uint16)
+    label_map[2:5, 3:8] = 4
+    boxes, points = mask_prompts(label_map, np.array([4]))
+    np.testing.assert_array_equal(boxes, [[3, 2, 7, 4]])
+    x, y = points[0, 0]
+    assert label_map[int(y), int(x)] == 4
+
+
+def test_propagation_ranges_split_gaps_between_seeds():
+    assert propagation_ranges([3, 9], 12) == [
+        (3, -1, -1), (3, 1, 7), (9, -1, 6), (9, 1, 12),
+    ]
+
+
+def test_propagate_from_seeds_follows_object_until_it_vanishes(fake_predictor):
+    image = _sphere_volume()
+    seed = np.where(image[10] > 0, 7, 0).astype(np.uint16)
+
+    results = dict(
+        propagate_from_seeds(
+            fake_predictor, image, {10: seed}, EmbeddingCache(),
+            ("vit_b",), "layer", min_area_ratio=0.2, min_iou=0.2,
+        )
+    )
+
+    # the sphere spans z = 4..16; propagation stays inside it
+    assert set(results) <= set(range(4, 17)) - {10}
+    assert {8, 9, 11, 12} <= set(results)
+    for z, label_map in results.items():
+        assert set(np.unique(label_map)) <= {0, 7}
+        np.testing.assert_array_equal(label_map > 0, image[z] > 0)
+    # per direction, only the slice that stops propagation and at most
+    # `prefetch` slices beyond it are encoded without being used
+    assert fake_predictor.encoder_calls <= len(results) + 2 * (1 + 2)
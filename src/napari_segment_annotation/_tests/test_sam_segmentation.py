@@ -0,0 +1,84 @@
+import numpy as np
+
+from napari_segment_annotation.sam_embedding_cache import EmbeddingCache
+from napari_segment_annotation.sam_inference import (
+    predict_objects,
+    segment_prompted_slices,
+    stack_object_prompts,
+)
+
+
+def test_segment_prompted_slices_yields_per_slice(fake_predictor):
+    image = np.zeros((5, 16, 16), dtype=np.uint8)
+    point_data = np.array([[1, 4, 4], [3, 8, 8], [3, 12, 12]], dtype=float)
+    point_labels = np.array([1, 1, 0])
+    cache = EmbeddingCache()
+
+    def run():
+        return list(
+            segment_prompted_slices(
+                fake_predictor, image, point_data, point_labels,
+                np.ones(3, dtype=int), cache, ("vit_b",), "layer",
+            )
+        )
+
+    results = run()
+    assert [z for z, _ in results] == [1, 3]
+    assert results[0][1][4, 4] and not results[0][1][8, 8]
+    assert results[1][1][8, 8] and not results[1][1][12, 12]
+
+    # re-running with the same slices only runs the decoder
+    run()
+    assert fake_predictor.encoder_calls == 2
+    assert fake_predictor.decoder_calls == 4
+
+
+def test_segment_prompted_slices_reads_only_prompted_slices(fake_predictor):
+    import dask.array as da
+
+    computed = []
+
+    def make_slice(block, block_info=None):
+        computed.append(block_info[None]["chunk-location"][0])
+        return np.zeros(block.shape, dtype=np.uint8)
+
+    image = da.zeros((50, 16, 16), dtype=np.uint8, chunks=(1, 16, 16))
+    image = image.map_blocks(make_slice, dtype=np.uint8)
+    point_data = np.array([[7, 4, 4], [30, 8, 8]], dtype=float)
+
+    results = list(
+        segment_prompted_slices(
+            fake_predictor, image, point_data, np.array([1, 1]),
+            np.array([1, 1]), EmbeddingCache(), ("vit_b",), "layer",
+        )
+    )
+
+    assert [z for z, _ in results] == [7, 30]
+    assert sorted(set(computed)) == [7, 30]
+
+
+def test_stack_object_prompts_pads_with_ignored_points():
+    coords = np.array([[1, 1], [2, 2], [3, 3], [4, 4]], dtype=float)
+    labels = np.array([1, 0, 1, 0])
+    object_ids = np.array([5, 5, 9, 7])  # object 7 has no foreground point
+
+    ids, batch_coords, batch_labels = stack_object_prompts(coords, labels, object_ids)
+
+    np.testing.assert_array_equal(ids, [5, 9])
+    assert batch_coords.shape == (2, 2, 2)
+    np.testing.assert_array_equal(batch_labels, [[1, 0], [1, -1]])
+
+
+def test_predict_objects_single_batched_decoder_pass(fake_predictor):
+    fake_predictor.set_image(np.zeros((32, 32, 3), dtype=np.uint8))
+    coords = np.array([[5, 5], [20, 20], [28, 5]], dtype=float)  # (X, Y)
+    labels = np.array([1, 1, 1])
+    object_ids = np.array([3, 300, 3])
+
+    label_map = predict_objects(fake_predictor, coords, labels, object_ids)
+
+    assert fake_predictor.decoder_calls == 1
+    assert label_map.dtype == np.uint16
+    assert label_map[5, 5] == 3 and label_map[5, 28] == 3
+    assert label_map[20, 20] == 300
+    assert label_map[12, 12] == 0
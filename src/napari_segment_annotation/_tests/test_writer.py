@@ -1,7 +1,62 @@
-# from napari_segment_annotation import write_single_image, write_multiple
+import numpy as np
 
-# add your tests here...
+from napari_segment_annotation import (
+    napari_get_reader,
+    write_multiple,
+    write_single_image,
+)
+from napari_segment_annotation.zarr_io import (
+    downsample_mean,
+    downsample_mode,
+    write_ome_zarr,
+)
 
 
 def test_something():
     pass
+
+
+def test_downsample_mode_and_mean():
+    labels = np.array([[1, 1, 2], [3, 1, 2], [4, 4, 0]], dtype=np.uint16)
+    np.testing.assert_array_equal(downsample_mode(labels, (0, 1)), [[1, 2], [4, 0]])
+
+    image = np.array([[0, 2, 7], [4, 6, 9]], dtype=np.uint8)
+    np.testing.assert_array_equal(downsample_mean(image, (0, 1)), [[3, 8]])
+
+
+def test_ome_zarr_roundtrip_multiscale(tmp_path):
+    image = np.random.default_rng(0).integers(0, 255, (3, 100, 70), dtype=np.uint8)
+    labels = np.zeros((3, 100, 70), dtype=np.uint32)
+    labels[:, 10:60, 5:40] = 7
+    path = str(tmp_path / "volume.zarr")
+    write_ome_zarr(
+        path,
+        [(image, {"name": "raw", "scale": (2.0, 1.0, 1.0)}, "image"), (labels, {"name": "seg"}, "labels")],
+        min_size=30,
+    )
+
+    reader = napari_get_reader(path)
+    layers = {meta["name"]: (data, meta, layer_type) for data, meta, layer_type in reader(path)}
+
+    data, meta, layer_type = layers["raw"]
+    assert layer_type == "image" and meta["multiscale"]
+    assert [level.shape for level in data] == [(3, 100, 70), (3, 50, 35), (3, 25, 18)]
+    assert meta["scale"] == [2.0, 1.0, 1.0]
+    np.testing.assert_array_equal(np.asarray(data[0]), image)
+
+    data, meta, layer_type = layers["seg"]
+    assert layer_type == "labels"
+    np.testing.assert_array_equal(np.asarray(data[0]), labels)
+    assert set(np.unique(np.asarray(data[-1]))) == {0, 7}
+
+
+def test_writers_write_files(tmp_path):
+    image = np.arange(24, dtype=np.float32).reshape(2, 3, 4)
+    npy_path = str(tmp_path / "image.npy")
+    assert write_single_image(npy_path, image, {}) == [npy_path]
+    np.testing.assert_array_equal(np.load(npy_path), image)
+
+    zarr_path = str(tmp_path / "layers.zarr")
+    write_multiple(zarr_path, [(image, {"name": "a"}, "image"), (image.astype(np.uint8), {"name": "b"}, "labels")])
+    names = [meta["name"] for _, meta, _ in napari_get_reader(zarr_path)(zarr_path)]
+    assert names == ["a", "b"]
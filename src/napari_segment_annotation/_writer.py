@@ -1,15 +1,19 @@
 """
-This module is an example of a barebones writer plugin for napari.
+Writer contributions for napari.
 
+Images can be saved as ``.npy`` or as chunked, compressed OME-Zarr with a
+multiscale pyramid; labels and multi-layer saves always use OME-Zarr.
 It implements the Writer specification.
 see: https://napari.org/stable/plugins/guides.html?#writers
-
-Replace code below according to your needs.
 """
 from __future__ import annotations
 
 from typing import TYPE_CHECKING, Any, List, Sequence, Tuple, Union
 
+import numpy as np
+
+from .zarr_io import write_ome_zarr
+
 if TYPE_CHECKING:
     DataType = Union[Any, Sequence[Any]]
     FullLayerData = Tuple[DataType, dict, str]
@@ -32,13 +36,32 @@ def write_single_image(path: str, data: Any, meta: dict) -> List[str]:
     -------
     [path] : A list containing the string path to the saved file.
     """
+    if _is_zarr(path):
+        return write_ome_zarr(path, [(data, meta, "image")])
 
-    # implement your writer logic here ...
-
-    # return path to any file(s) that were successfully written
+    np.save(path, np.asarray(data[0] if isinstance(data, list) else data))
     return [path]
 
 
+def write_labels(path: str, data: Any, meta: dict) -> List[str]:
+    """Writes a single labels layer as OME-Zarr with a mode-downsampled pyramid.
+
+    Parameters
+    ----------
+    path : str
+        A string path ending in ``.zarr``.
+    data : The layer data
+        The `.data` attribute from the napari layer.
+    meta : dict
+        A dictionary containing all other attributes from the napari layer.
+
+    Returns
+    -------
+    [path] : A list containing the string path to the saved store.
+    """
+    return write_ome_zarr(path, [(data, meta, "labels")])
+
+
 def write_multiple(path: str, data: List[FullLayerData]) -> List[str]:
     """Writes multiple layers of different types.
     
@@ -57,8 +80,10 @@ def write_multiple(path: str, data: List[FullLayerData]) -> List[str]:
     -------
     [path] : A list containing (potentially multiple) string paths to the saved file(s).
     """
+    # the first image goes to the root group, other images to sub-groups and
+    # labels to ``labels/<name>``, following the OME-Zarr layout
+    return write_ome_zarr(path, data)
 
-    # implement your writer logic here ...
 
-    # return path to any file(s) that were successfully written
-    return [path]
+def _is_zarr(path: str) -> bool:
+    return str(path).rstrip("/\\").endswith(".zarr")
@@ -1,53 +1,117 @@
+from functools import partial
+
 import numpy as np
+import zarr
 from napari.types import LabelsData
-from skimage.io import imread, imsave
+from skimage.io import imread
 from magicgui import magic_factory
 from napari_plugin_engine import napari_hook_implementation
 from pathlib import Path
 
+from .label_remap import (
+    build_remap, drop_labels, invert_labels, keep_labels, parse_label_spec, parse_mapping_spec, remap_dtype,
+    remap_labels
+)
+from .labels_store import mark_layer_region, save_labels_incremental
+from .mask_merge import iter_chunk_regions, merge_grid, value_range
+from .merge_masks import refresh_regions
+from .tiff_stack import is_tiff_stack_path, read_tiff_stack, write_tiff_pages
+
 @magic_factory(call_button="Load Mask")
 def load_mask(mask_path: Path) -> LabelsData:
-    """读取mask文件并返回Labels层数据。"""
+    """读取mask文件并返回Labels层数据。
+
+    逐切片 TIFF 的目录或 glob 模式按切片延迟读取，不整体读入内存。
+    """
+    if is_tiff_stack_path(str(mask_path)):
+        return read_tiff_stack(str(mask_path))
     mask = imread(str(mask_path))
     return mask
 
+def apply_chunked(mask_layer, transform, in_place=True):
+    """按块变换标签层的数据，``transform(data, out=None)`` 返回 (结果, 有变化的块范围)。
+
+    NumPy 或 Zarr 数据在 ``in_place`` 时按块原地修改，只通知和刷新有变化的部分，
+    额外内存只有几个块；其他情况（Dask 数据、结果类型改变）替换为新的数据。
+    """
+    data = mask_layer.data
+    if in_place and isinstance(data, (np.ndarray, zarr.Array)):
+        _, changed = transform(data, out=data)
+        for region in changed:
+            mark_layer_region(mask_layer, region)
+        refresh_regions(mask_layer, changed)
+    else:
+        mask_layer.data, _ = transform(data)
+        mask_layer.refresh()
+
+
+def apply_label_remap(mask_layer, remap):
+    """对标签层做重映射，结果类型不变时原地修改。"""
+    data = mask_layer.data
+    apply_chunked(mask_layer, partial(remap_labels, remap=remap), remap_dtype(data.dtype, remap) == data.dtype)
+
+
+def tiff_dtype(data):
+    """保存 TIFF 的类型：取值都能表示时用 uint16，否则保持原类型，避免截断标签。"""
+    if np.can_cast(data.dtype, np.uint16, casting="safe"):
+        return np.dtype(np.uint16)
+    found = value_range(data, list(iter_chunk_regions(data.shape, merge_grid(data))))
+    if found is None or (found[0] >= 0 and found[1] <= np.iinfo(np.uint16).max):
+        return np.dtype(np.uint16)
+    return np.dtype(data.dtype)
+
 @magic_factory(
     call_button="Adjust and Save Mask",
-    operation={"choices": ["invert", "threshold", "none"]},
+    operation={"choices": ["invert", "threshold", "keep labels", "drop labels", "remap labels", "none"]},
     threshold_value={"label": "Threshold Value", "min": 0, "max": 65535, "step": 1},
-    save_path={"label": "Save Adjusted Mask As", "mode": "w", "filter": "*.tif;*.tiff"}
+    labels={"label": "Labels (e.g. 1,3,5-9 or 3:1,4:1)"},
+    save_path={"label": "Save Adjusted Mask As", "mode": "w", "filter": "*.tif;*.tiff;*.zarr"}
 )
 def adjust_mask(
     mask_layer: 'napari.layers.Labels',
     operation: str = 'none',
     threshold_value: float = 0,  # 阈值
+    labels: str = "",  # 保留/删除的标签列表，或 旧标签:新标签 的映射
     save_path: Path = None
 ) -> None:
-    """根据选择的操作调整mask，并保存到文件。"""
+    """根据选择的操作调整mask，并保存到文件。
+
+    所有操作按块进行，NumPy 和 Zarr 数据原地修改，峰值内存只增加几个块的大小；
+    保留、删除和重映射标签都通过查找表一次遍历完成。保存为 ``.zarr`` 时按块增量写入，
+    同一图层再次保存到同一路径时只重写修改过的块；保存为 TIFF 时逐切片流式写出。
+    """
     if mask_layer is None:
         print("Please select a mask layer.")
         return
 
     # 根据选择的操作进行调整
     if operation == 'invert':
-        adjusted_mask = np.max(mask_layer.data) - mask_layer.data  # 反转mask
-    elif operation == 'threshold':
-        # 只保留等于阈值的部分，其他设为 0
-        adjusted_mask = np.copy(mask_layer.data)
-        adjusted_mask[adjusted_mask != threshold_value] = 0  # 仅保留等于阈值的部分
-    else:
-        adjusted_mask = mask_layer.data  # 不做任何操作
-
-    mask_layer.data = adjusted_mask
-
-    # 强制刷新显示
-    mask_layer.refresh()  # 强制刷新显示以更新图层
+        apply_chunked(mask_layer, invert_labels)  # 反转mask：最大值减去原值
+    elif operation in ('threshold', 'keep labels', 'drop labels', 'remap labels'):
+        try:
+            if operation == 'threshold':
+                remap = keep_labels([int(threshold_value)])  # 仅保留等于阈值的部分
+            elif operation == 'keep labels':
+                remap = keep_labels(parse_label_spec(labels))
+            elif operation == 'drop labels':
+                remap = drop_labels(parse_label_spec(labels))
+            else:
+                remap = build_remap(parse_mapping_spec(labels), keep=True)
+        except ValueError as e:
+            print(f"Error parsing labels: {e}")
+            return
+        apply_label_remap(mask_layer, remap)
 
     # 如果指定了保存路径，则将调整后的mask保存到文件
     if save_path is not None:
         try:
-            imsave(str(save_path), adjusted_mask.astype(np.uint16))
-            print(f"Adjusted mask saved to {save_path}")
+            if str(save_path).endswith(".zarr"):
+                written = save_labels_incremental(mask_layer, str(save_path))
+                print(f"Adjusted mask saved to {save_path} ({written} chunks written)")
+            else:
+                dtype = tiff_dtype(mask_layer.data)
+                write_tiff_pages(str(save_path), mask_layer.data, dtype=dtype)
+                print(f"Adjusted mask saved to {save_path} as {dtype}")
         except Exception as e:
             print(f"Error saving mask: {e}")
 
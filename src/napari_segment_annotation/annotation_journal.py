@@ -0,0 +1,338 @@
+"""
+标签编辑的崩溃安全日志与自动保存。
+
+`AnnotationJournal` 在每次绘制、填充、撤销/重做后，把被修改块的新内容复制出来，由后台线程
+压缩后追加写入日志文件（``<store>.journal``）并 fsync，主线程只做块大小的内存复制。
+日志超过一定大小或间隔一段时间后被压实：每个块只取最后一条记录写入分块 Zarr 标签存储，
+然后清空日志。
+
+napari 崩溃后，`replay_journal` 把日志中的记录写回存储即可恢复，耗时与上次压实以来的
+修改量成正比。记录的是块修改后的完整内容，重放是幂等的；日志末尾写到一半的记录
+通过长度和 CRC 校验识别并丢弃。开启过日志的存储路径记录在 `RECENT_STORES_PATH` 中，
+下次启动时用 `stores_with_pending_edits` 找出需要恢复的存储，不需要用户记得路径。
+"""
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+import zarr
+from numcodecs import Blosc
+
+from .labels_store import DirtyChunkWriter, atom_region, chunk_region
+from .zarr_io import DEFAULT_CHUNK_EDGE
+
+JOURNAL_SUFFIX = ".journal"
+# 日志超过该大小时压实
+DEFAULT_COMPACT_BYTES = 64 * 1024 * 1024
+# 距上次压实超过该秒数且日志非空时压实
+DEFAULT_COMPACT_INTERVAL = 300.0
+
+_MAGIC = b"NSAJRNL1"
+# 记录头：维数、块内容压缩后的长度、索引和内容的 CRC32；之后是各维块索引（uint64）和内容
+_RECORD = struct.Struct("<BII")
+_INDEX_ITEM = struct.Struct("<Q")
+# 日志追求写入速度，压缩级别低于存储
+_CODEC = Blosc(cname="zstd", clevel=1, shuffle=Blosc.BITSHUFFLE)
+
+_STOP = object()
+
+# 开启过日志的存储路径列表（JSON），启动时据此检查未恢复的修改
+RECENT_STORES_PATH = os.path.expanduser("~/.cache/napari-segment-annotation/journaled_stores.json")
+_RECENT_LOCK = threading.Lock()
+
+
+def journal_path(store_path):
+    return os.path.abspath(str(store_path)) + JOURNAL_SUFFIX
+
+
+def encode_record(index, block):
+    """把块索引和块内容编码为一条日志记录。"""
+    payload = _CODEC.encode(np.ascontiguousarray(block))
+    index_bytes = b"".join(_INDEX_ITEM.pack(i) for i in index)
+    crc = zlib.crc32(payload, zlib.crc32(index_bytes))
+    return _RECORD.pack(len(index), len(payload), crc) + index_bytes + payload
+
+
+def read_journal(path):
+    """依次产出日志中的 (块索引, 压缩的块内容)，遇到不完整或损坏的记录时停止。"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as file:
+        if file.read(len(_MAGIC)) != _MAGIC:
+            return
+        while True:
+            header = file.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            ndim, length, crc = _RECORD.unpack(header)
+            index_bytes = file.read(ndim * _INDEX_ITEM.size)
+            payload = file.read(length)
+            if len(index_bytes) < ndim * _INDEX_ITEM.size or len(payload) < length:
+                return
+            if zlib.crc32(payload, zlib.crc32(index_bytes)) != crc:
+                return
+            index = tuple(
+                _INDEX_ITEM.unpack_from(index_bytes, axis * _INDEX_ITEM.size)[0]
+                for axis in range(ndim)
+            )
+            yield index, payload
+
+
+def apply_atom(block, block_region, atom, shape):
+    """把一条 napari 编辑记录中落在块 ``block_region`` 内的部分应用到 ``block`` 上。
+
+    ``shape`` 为整个数组的形状。
+    """
+    if getattr(atom, "slice_key", None) is not None:
+        region = atom_region(atom, shape)
+        overlap = tuple(
+            slice(max(r.start, b.start), min(r.stop, b.stop)) for r, b in zip(region, block_region)
+        )
+        if any(o.stop <= o.start for o in overlap):
+            return
+        local = tuple(slice(o.start - b.start, o.stop - b.start) for o, b in zip(overlap, block_region))
+        if atom.mask is None:
+            block[local] = atom.new_value
+            return
+        mask = atom.mask[tuple(slice(o.start - r.start, o.stop - r.start) for o, r in zip(overlap, region))]
+        block[local][mask] = atom.new_value
+        return
+    indices, _, values = atom
+    indices = [np.asarray(axis_indices) for axis_indices in indices]
+    inside = np.ones(indices[0].shape, dtype=bool)
+    for axis_indices, b in zip(indices, block_region):
+        inside &= (axis_indices >= b.start) & (axis_indices < b.stop)
+    if not inside.any():
+        return
+    local = tuple(axis_indices[inside] - b.start for axis_indices, b in zip(indices, block_region))
+    block[local] = values[inside] if np.ndim(values) else values
+
+
+def pending_edits(store_path):
+    """``store_path`` 的日志中尚未压实的块数（同一块的多条记录只计一次）。"""
+    return len({index for index, _ in read_journal(journal_path(store_path))})
+
+
+def _reset_journal(path):
+    """清空日志，只保留文件头。"""
+    with open(path, "wb") as file:
+        file.write(_MAGIC)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def replay_journal(store_path):
+    """把日志中每个块的最后一条记录写入存储并清空日志，返回写入的块数。
+
+    先写存储再清空日志，两步之间崩溃时重放同样的记录，结果不变。
+    """
+    path = journal_path(store_path)
+    latest = {}
+    for index, payload in read_journal(path):
+        latest[index] = payload
+    if latest:
+        store = zarr.open_array(str(store_path), mode="r+", write_empty_chunks=False)
+        for index, payload in latest.items():
+            region = chunk_region(index, store.chunks, store.shape)
+            shape = tuple(s.stop - s.start for s in region)
+            store[region] = np.frombuffer(_CODEC.decode(payload), dtype=store.dtype).reshape(shape)
+    if os.path.exists(path):
+        _reset_journal(path)
+    return len(latest)
+
+
+def discard_journal(store_path):
+    """丢弃尚未压实的日志。"""
+    path = journal_path(store_path)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _read_recent_stores():
+    try:
+        with open(RECENT_STORES_PATH) as file:
+            stores = json.load(file)
+    except (OSError, ValueError):
+        return []
+    return [str(path) for path in stores] if isinstance(stores, list) else []
+
+
+def _write_recent_stores(stores):
+    os.makedirs(os.path.dirname(RECENT_STORES_PATH), exist_ok=True)
+    # 先写临时文件再替换，避免中断时留下不完整的列表
+    temp = f"{RECENT_STORES_PATH}.{os.getpid()}.tmp"
+    with open(temp, "w") as file:
+        json.dump(stores, file)
+    os.replace(temp, RECENT_STORES_PATH)
+
+
+def remember_store(store_path):
+    """记录开启了日志的存储，下次启动时检查。"""
+    store_path = os.path.abspath(str(store_path))
+    with _RECENT_LOCK:
+        stores = _read_recent_stores()
+        if store_path not in stores:
+            _write_recent_stores(stores + [store_path])
+
+
+def forget_store(store_path):
+    """不再检查 ``store_path``（日志已正常关闭、重放或丢弃）。"""
+    store_path = os.path.abspath(str(store_path))
+    with _RECENT_LOCK:
+        stores = _read_recent_stores()
+        if store_path in stores:
+            _write_recent_stores([path for path in stores if path != store_path])
+
+
+def stores_with_pending_edits():
+    """之前开启过日志、且日志中有未恢复修改的存储，返回 [(存储路径, 块数)]。
+
+    日志文件已不存在的存储从列表中移除。
+    """
+    found = []
+    for store_path in _read_recent_stores():
+        if not os.path.exists(journal_path(store_path)):
+            forget_store(store_path)
+            continue
+        count = pending_edits(store_path)
+        if count:
+            found.append((store_path, count))
+    return found
+
+
+class AnnotationJournal:
+    """为标签层记录崩溃安全的编辑日志，并定期压实到分块 Zarr 存储。
+
+    Parameters
+    ----------
+    layer : napari.layers.Labels
+        要跟踪的标签层。
+    store_path : str
+        Zarr 标签存储目录，日志位于 ``store_path + ".journal"``。
+    synced : bool
+        存储已与图层数据一致（例如图层刚由 `replay_journal` 恢复）。否则启动时
+        先把整个图层写入存储作为基准。
+    compact_bytes, compact_interval :
+        日志大小（字节）或距上次压实的时间（秒）超过该值时压实。
+
+    Raises
+    ------
+    RuntimeError
+        存储已有未压实的日志。应先用 `replay_journal` 恢复或用 `discard_journal` 丢弃，
+        避免覆盖上次会话的修改。
+    """
+
+    def __init__(
+        self,
+        layer,
+        store_path,
+        chunk_edge=DEFAULT_CHUNK_EDGE,
+        synced=False,
+        compact_bytes=DEFAULT_COMPACT_BYTES,
+        compact_interval=DEFAULT_COMPACT_INTERVAL,
+    ):
+        self.store_path = os.path.abspath(str(store_path))
+        self.path = journal_path(self.store_path)
+        if pending_edits(self.store_path):
+            raise RuntimeError(f"{self.path} 中有未恢复的修改，请先重放或丢弃。")
+        self.layer = layer
+        self.compact_bytes = compact_bytes
+        self.compact_interval = compact_interval
+
+        self._io_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self.writer = DirtyChunkWriter(layer, self.store_path, chunk_edge=chunk_edge, synced=synced)
+        self.writer.save()
+        self._store = self.writer.store
+        _reset_journal(self.path)
+        remember_store(self.store_path)
+        self._last_compaction = time.monotonic()
+        self.writer.on_change = self._on_change
+
+        self._thread = threading.Thread(target=self._run, name="annotation-journal", daemon=True)
+        self._thread.start()
+
+    def _on_change(self, atoms):
+        if atoms is None or self.writer.store is not self._store:
+            # 整个数据被替换时直接保存到存储，不把整卷复制进日志
+            self.flush()
+            with self._io_lock:
+                self._store = self.writer.store
+                self.writer.save()
+                self._truncate()
+            return
+        data = self.layer.data
+        for index in self.writer.take_dirty():
+            # 在主线程复制块内容，后台线程只做压缩和写入。绘制事件可能先于数据写入，
+            # 再把本次的记录应用到副本上；数据已写入时重复应用结果不变
+            region = self.writer.chunk_region(index)
+            block = np.array(data[region])
+            for atom in atoms:
+                apply_atom(block, region, atom, data.shape)
+            self._queue.put((index, block))
+
+    def _run(self):
+        # 追加模式、无缓冲：压实和清空日志时文件被原地截断，之后的记录仍写在文件末尾
+        with open(self.path, "ab", buffering=0) as file:
+            unsynced = False
+            while True:
+                try:
+                    item = self._queue.get(timeout=1.0)
+                except queue.Empty:
+                    item = None
+                try:
+                    if item is _STOP:
+                        return
+                    with self._io_lock:
+                        if item is not None:
+                            file.write(encode_record(*item))
+                            unsynced = True
+                        if unsynced and self._queue.empty():
+                            # 一批记录写完后再 fsync，连续绘制时不逐条等待磁盘
+                            os.fsync(file.fileno())
+                            unsynced = False
+                        self._maybe_compact(os.fstat(file.fileno()).st_size)
+                finally:
+                    if item is not None:
+                        self._queue.task_done()
+
+    def _maybe_compact(self, size):
+        if size <= len(_MAGIC):
+            self._last_compaction = time.monotonic()
+            return
+        if size >= self.compact_bytes or time.monotonic() - self._last_compaction >= self.compact_interval:
+            self._compact()
+
+    def _compact(self):
+        replay_journal(self.store_path)
+        self._last_compaction = time.monotonic()
+
+    def _truncate(self):
+        _reset_journal(self.path)
+        self._last_compaction = time.monotonic()
+
+    def flush(self):
+        """等待已排队的修改写入日志。"""
+        self._queue.join()
+
+    def compact(self):
+        """立即把日志压实到存储。"""
+        self.flush()
+        with self._io_lock:
+            self._compact()
+
+    def close(self):
+        """停止记录，压实日志，存储与图层一致后删除日志文件。"""
+        self.writer.on_change = None
+        self.writer.close()
+        self._queue.put(_STOP)
+        self._thread.join()
+        with self._io_lock:
+            self._compact()
+        os.remove(self.path)
+        forget_store(self.store_path)
@@ -0,0 +1,137 @@
+"""
+图谱结构的层级关系。
+
+结构树保存为紧凑的数组：每个结构的父结构行号 ``parent_index``、深度 ``depth``，以及祖先表
+``ancestors``（``ancestors[i, d]`` 为结构 ``i`` 在深度 ``d`` 上的祖先行号，超出自身深度处为 -1）。
+"某结构的所有后代"、"合并到深度 N"、"体素数汇总到各级父结构" 都是对这些数组的一次向量化
+运算，作用到标签层时编译为 `LabelRemap`，对体数据只做一次查表。
+"""
+import numpy as np
+
+from .label_remap import build_remap
+
+NO_PARENT = -1
+
+
+def record_parent(record):
+    """接口记录中的父结构 ID：优先 ``parent_structure_id``，否则取 ``structure_id_path``
+    （如 ``"/997/8/567/"``）的倒数第二段，没有父结构时返回 `NO_PARENT`。
+    """
+    parent = record.get("parent_structure_id")
+    if parent is not None and str(parent).isdigit():
+        return int(parent)
+    path = [part for part in str(record.get("structure_id_path") or "").split("/") if part]
+    if len(path) >= 2 and path[-2].isdigit():
+        return int(path[-2])
+    return NO_PARENT
+
+
+class AtlasHierarchy:
+    """结构树，行号与 ``ids`` 一一对应。
+
+    Parameters
+    ----------
+    ids : array-like of int
+        结构 ID，不可重复。
+    parent_ids : array-like of int
+        父结构 ID，`NO_PARENT` 或不在 ``ids`` 中的 ID 视为根。
+
+    Raises
+    ------
+    ValueError
+        ID 重复或父结构存在环。
+    """
+
+    def __init__(self, ids, parent_ids):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        n = len(self.ids)
+        self._order = np.argsort(self.ids, kind="stable")
+        self._sorted_ids = self.ids[self._order]
+        if n and np.any(self._sorted_ids[1:] == self._sorted_ids[:-1]):
+            raise ValueError("结构 ID 不可重复")
+        self.parent_index = self.rows(parent_ids)
+
+        # 逐级向上跳，up[:, k] 为第 k 级祖先的行号，每一步对所有结构同时进行
+        up = [np.arange(n, dtype=np.int32)]
+        current = up[0]
+        while True:
+            current = np.where(current >= 0, self.parent_index[np.maximum(current, 0)], NO_PARENT)
+            if not np.any(current >= 0):
+                break
+            if len(up) > n:
+                raise ValueError("结构的父结构存在环")
+            up.append(current.astype(np.int32))
+        up = np.stack(up, axis=1) if n else np.empty((0, 1), dtype=np.int32)
+
+        self.depth = (np.count_nonzero(up >= 0, axis=1) - 1).astype(np.int32)
+        # 改为按深度索引：ancestors[i, d] = up[i, depth[i] - d]
+        steps = self.depth[:, None] - np.arange(up.shape[1])[None, :]
+        inside = steps >= 0
+        self.ancestors = np.full(up.shape, NO_PARENT, dtype=np.int32)
+        self.ancestors[inside] = up[np.nonzero(inside)[0], steps[inside]]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def max_depth(self):
+        return int(self.depth.max()) if len(self.depth) else 0
+
+    def rows(self, label_ids):
+        """``label_ids`` 对应的行号数组，不在结构表中的 ID 为 -1。"""
+        label_ids = np.asarray(label_ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.full(label_ids.shape, NO_PARENT, dtype=np.int32)
+        position = np.minimum(np.searchsorted(self._sorted_ids, label_ids), len(self.ids) - 1)
+        found = self._sorted_ids[position] == label_ids
+        return np.where(found, self._order[position], NO_PARENT).astype(np.int32)
+
+    def _row(self, structure_id):
+        row = int(self.rows([structure_id])[0])
+        if row < 0:
+            raise ValueError(f"结构表中没有结构 {structure_id}")
+        return row
+
+    def descendant_rows(self, structure_id, include_self=True):
+        """``structure_id`` 的所有后代的行号（按行号升序）。"""
+        row = self._row(structure_id)
+        rows = np.flatnonzero(self.ancestors[:, self.depth[row]] == row)
+        return rows if include_self else rows[rows != row]
+
+    def descendants(self, structure_id, include_self=True):
+        """``structure_id`` 的所有后代的结构 ID。"""
+        return self.ids[self.descendant_rows(structure_id, include_self)]
+
+    def ancestor_at(self, rows, level):
+        """各行在深度 ``level`` 上的祖先行号，自身深度不足 ``level`` 时为自身。"""
+        rows = np.asarray(rows)
+        return self.ancestors[rows, np.minimum(self.depth[rows], level)]
+
+    def select_remap(self, structure_id, value=None):
+        """只保留 ``structure_id`` 子树中标签的重映射；``value`` 不为 None 时子树统一设为该值。"""
+        ids = self.descendants(structure_id)
+        values = ids if value is None else np.full(len(ids), value, dtype=np.int64)
+        return build_remap(dict(zip(ids.tolist(), values.tolist())), keep=False)
+
+    def collapse_remap(self, level):
+        """把每个结构替换为其在深度 ``level`` 上的祖先的重映射（根的深度为 0），不在结构表中的标签保持不变。"""
+        rows = np.arange(len(self.ids))
+        targets = self.ids[self.ancestor_at(rows, level)]
+        changed = targets != self.ids
+        return build_remap(dict(zip(self.ids[changed].tolist(), targets[changed].tolist())), keep=True)
+
+    def rollup_counts(self, label_ids, counts):
+        """把各标签的体素数累加到自身及所有祖先，返回按行排列的总数（含所有后代）。
+
+        不在结构表中的标签（包括背景 0）被忽略。只按深度循环，每层一次 ``np.add.at``。
+        """
+        rows = self.rows(label_ids)
+        counts = np.asarray(counts, dtype=np.int64)
+        known = rows >= 0
+        rows, counts = rows[known], counts[known]
+        totals = np.zeros(len(self.ids), dtype=np.int64)
+        for level in range(self.ancestors.shape[1]):
+            ancestor = self.ancestors[rows, level]
+            inside = ancestor >= 0
+            np.add.at(totals, ancestor[inside], counts[inside])
+        return totals
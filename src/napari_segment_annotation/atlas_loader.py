@@ -0,0 +1,112 @@
+"""
+在后台线程加载图谱结构表。
+
+小部件创建时和切换模板时只发起请求，网络请求和 JSON 解析在 `thread_worker` 中进行，
+结果通过 worker 的 Qt 信号回到主线程交给回调。每次新请求使之前的请求作废：
+已发出的 HTTP 请求无法中途打断，但其结果返回后直接丢弃，不会覆盖新模板的结构表。
+内存中已有且已准备好的结构表立即交付，过期时再在后台重新验证；尚未准备的结构表
+（如还没有搜索索引）也在后台准备，不阻塞主线程。
+"""
+from functools import partial
+
+from napari.qt.threading import thread_worker
+
+from .atlas_registry import get_atlas_registry
+
+
+@thread_worker
+def _load_table(registry, template, generation, prepare):
+    try:
+        table = registry.get(template)
+        if prepare is not None:
+            prepare(table)
+    except (RuntimeError, ValueError) as e:
+        return generation, template, None, str(e)
+    return generation, template, table, None
+
+
+class AtlasLoader:
+    """按模板异步加载结构表。
+
+    Parameters
+    ----------
+    on_loaded : callable
+        ``on_loaded(template, table)``，在主线程调用，``table`` 为 `AtlasTable`。
+    on_failed : callable, optional
+        ``on_failed(template, message)``，没有可用结构表时在主线程调用。
+    registry : AtlasRegistry, optional
+        默认使用进程级共享的注册表。
+    prepare : callable, optional
+        ``prepare(table)``，在后台线程对加载的结构表做额外准备（如构建搜索索引）。
+        抛出的 RuntimeError / ValueError 交给 ``on_failed``；其他异常同样交给 ``on_failed``，
+        并由 napari 显示 traceback。
+    prepared : callable, optional
+        ``prepared(table)``，结构表是否已经准备好。有 ``prepare`` 时，只有准备好的缓存
+        才同步交付；未给出时缓存总是在后台准备。
+    """
+
+    def __init__(self, on_loaded, on_failed=None, registry=None, prepare=None, prepared=None):
+        self.on_loaded = on_loaded
+        self.on_failed = on_failed
+        self.prepare = prepare
+        self.prepared = prepared
+        self.registry = registry or get_atlas_registry()
+        self.template = None
+        self.table = None
+        self._generation = 0  # 每次新请求递增，用于丢弃过期结果
+        self._worker = None
+
+    @property
+    def loading(self):
+        """当前模板的请求是否仍在进行。"""
+        return self._worker is not None
+
+    def load(self, template):
+        """请求 ``template`` 的结构表，之前未返回的请求作废。
+
+        内存中有已准备好的缓存时立即（同步）调用 ``on_loaded`` 并返回 True；
+        缓存已过期时再在后台重新验证。没有缓存或缓存尚未准备时在后台加载，返回 False。
+        """
+        self._generation += 1
+        if template != self.template:
+            self.template, self.table = template, None
+        self._worker = None
+        cached = self.registry.cached(template)
+        ready = cached is not None and (
+            self.prepare is None or (self.prepared is not None and self.prepared(cached))
+        )
+        if ready:
+            self._deliver(template, cached)
+            if self.registry.is_fresh(template):
+                return True
+        worker = _load_table(self.registry, template, self._generation, self.prepare)
+        worker.returned.connect(self._on_returned)
+        worker.errored.connect(partial(self._on_errored, self._generation, template))
+        self._worker = worker
+        worker.start()
+        return ready
+
+    def cancel(self):
+        """丢弃尚未返回的请求。"""
+        self._generation += 1
+        self._worker = None
+
+    def _deliver(self, template, table):
+        if table is self.table:
+            return  # 重新验证后结构表未变化
+        self.table = table
+        self.on_loaded(template, table)
+
+    def _on_returned(self, result):
+        generation, template, table, error = result
+        if generation != self._generation:
+            return  # 之后又切换了模板，结果已过期
+        self._worker = None
+        if table is not None:
+            self._deliver(template, table)
+        elif self.table is None and self.on_failed is not None:
+            self.on_failed(template, error)
+
+    def _on_errored(self, generation, template, error):
+        # 意外的异常，napari 另行显示其 traceback
+        self._on_returned((generation, template, None, str(error)))
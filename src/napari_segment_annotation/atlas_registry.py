@@ -0,0 +1,273 @@
+"""
+图谱结构表的共享注册表。
+
+所有小部件通过 `get_atlas_registry` 取得同一份各模板的结构表：内存中每个模板只保留一份，
+磁盘上缓存接口返回的原始 JSON 及其 ETag / Last-Modified / max-age。缓存未过期时直接使用，
+过期后带条件请求重新验证（304 时只更新过期时间）；离线模式或网络失败时使用磁盘上的
+缓存（即使已过期），因此有缓存后可以完全离线工作。
+
+``url`` 也可以是本地目录，从 ``<目录>/<模板>.json`` 读取，测试中可以用 JSON 文件代替接口。
+"""
+import json
+import os
+import re
+import threading
+import time
+from functools import cached_property
+
+import numpy as np
+import requests
+
+from .atlas_hierarchy import AtlasHierarchy, record_parent
+from .atlas_search import LabelSearchIndex
+
+ATLAS_API_URL = "https://smart.siat.ac.cn/api/v1/atlas-structures/"
+TEMPLATES = ("ccfv3", "civm_rhesus", "visor")
+DEFAULT_CACHE_DIR = os.path.expanduser("~/.cache/napari-segment-annotation/atlas")
+# 接口未给出 Cache-Control: max-age 时缓存的有效期（秒）
+DEFAULT_MAX_AGE = 24 * 3600
+DEFAULT_TIMEOUT = 10.0
+# 设为 1 时不访问网络，只使用磁盘缓存
+OFFLINE_ENV = "NAPARI_SEGMENT_ANNOTATION_ATLAS_OFFLINE"
+
+
+class AtlasTable:
+    """一个模板的结构表。
+
+    ``ids``、``names`` 和 ``parent_ids`` 按接口返回的顺序排列，只包含 ID 为数字的结构；
+    ``records`` 为接口返回的原始记录。结构树无法构建时（ID 重复或父结构成环）
+    ``hierarchy`` 为 None，原因记录在 ``hierarchy_error`` 中，不影响搜索。
+    """
+
+    def __init__(self, template, records):
+        self.template = template
+        self.records = records
+        valid = [item for item in records if str(item.get("id", "")).isdigit()]
+        self.ids = np.array([int(item["id"]) for item in valid], dtype=np.int64)
+        self.names = [item.get("safe_name", "") for item in valid]
+        self.parent_ids = np.array([record_parent(item) for item in valid], dtype=np.int64)
+        self.hierarchy_error = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def built(self, name):
+        """按需构建的属性 ``name``（如 ``"search_index"``）是否已经构建。"""
+        return name in self.__dict__
+
+    @cached_property
+    def names_by_id(self):
+        """{结构 ID: safe_name}。"""
+        return dict(zip(self.ids.tolist(), self.names))
+
+    @cached_property
+    def search_index(self):
+        """按 ID 和名称搜索的 `LabelSearchIndex`，第一次使用时构建。"""
+        return LabelSearchIndex(self.ids, self.names)
+
+    @cached_property
+    def hierarchy(self):
+        """结构树 `AtlasHierarchy`，第一次使用时构建，无法构建时为 None。"""
+        try:
+            return AtlasHierarchy(self.ids, self.parent_ids)
+        except ValueError as e:
+            self.hierarchy_error = str(e)
+            return None
+
+
+def parse_max_age(cache_control):
+    """从 Cache-Control 头中取出 max-age（秒），没有时返回 None；no-cache 视为 0。"""
+    if not cache_control:
+        return None
+    if re.search(r"\bno-(cache|store)\b", cache_control):
+        return 0
+    match = re.search(r"\bmax-age=(\d+)", cache_control)
+    return int(match.group(1)) if match else None
+
+
+class AtlasRegistry:
+    """按模板缓存图谱结构表，内存和磁盘两级。
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        磁盘缓存目录，为 None 时只在内存中缓存。
+    url : str
+        结构表接口地址，或包含 ``<模板>.json`` 的本地目录。
+    offline : bool
+        不访问网络，只使用磁盘缓存。
+    max_age : float
+        接口未给出 max-age 时缓存的有效期（秒）。
+    timeout : float
+        请求超时（秒）。
+    session : requests.Session, optional
+        发送请求的会话，默认使用 `requests`。
+    """
+
+    def __init__(
+        self,
+        cache_dir=DEFAULT_CACHE_DIR,
+        url=ATLAS_API_URL,
+        offline=False,
+        max_age=DEFAULT_MAX_AGE,
+        timeout=DEFAULT_TIMEOUT,
+        session=None,
+    ):
+        self.cache_dir = cache_dir
+        self.url = url
+        self.offline = offline
+        self.max_age = max_age
+        self.timeout = timeout
+        self.session = session or requests
+        self._tables = {}
+        self._meta = {}
+        self._lock = threading.Lock()
+        self._template_locks = {}
+
+    def cached(self, template):
+        """内存中已有的结构表，没有时返回 None，不读磁盘也不访问网络。"""
+        return self._tables.get(template)
+
+    def is_fresh(self, template):
+        """内存中的结构表是否仍在有效期内（离线模式下有缓存即视为有效）。"""
+        if template not in self._tables:
+            return False
+        meta = self._meta.get(template, {})
+        return self.offline or time.time() < meta.get("fetched_at", 0) + meta.get("max_age", 0)
+
+    def get(self, template, refresh=False):
+        """返回 ``template`` 的结构表，必要时从磁盘或网络加载。
+
+        同一模板的并发调用只加载一次。``refresh`` 为 True 时忽略有效期重新验证。
+
+        Raises
+        ------
+        RuntimeError
+            没有可用的缓存，且离线或网络请求失败。
+        """
+        with self._lock:
+            template_lock = self._template_locks.setdefault(template, threading.Lock())
+        with template_lock:
+            if template not in self._tables:
+                self._load_from_disk(template)
+            table, meta = self._tables.get(template), self._meta.get(template, {})
+            if table is not None and (self.offline or (self.is_fresh(template) and not refresh)):
+                return table
+            if self.offline:
+                raise RuntimeError(f"离线模式下没有模板 {template} 的缓存")
+            try:
+                return self._fetch(template, table, meta)
+            except (requests.RequestException, OSError, ValueError) as e:
+                if table is None:
+                    raise RuntimeError(f"无法获取模板 {template} 的结构表：{e}") from e
+                print(f"更新模板 {template} 的结构表失败，使用缓存：{e}")
+                return table
+
+    def clear(self, disk=False):
+        """清空内存缓存，``disk`` 为 True 时同时删除磁盘缓存。"""
+        with self._lock:
+            self._tables.clear()
+            self._meta.clear()
+        if disk and self.cache_dir is not None and os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def _fetch(self, template, table, meta):
+        if os.path.isdir(self.url):
+            with open(os.path.join(self.url, f"{template}.json")) as f:
+                records = json.load(f)
+            return self._store(template, records, {"max_age": self.max_age})
+
+        headers = {}
+        if table is not None and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if table is not None and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        response = self.session.get(
+            self.url,
+            params={"format": "json", "template": template},
+            headers=headers,
+            timeout=self.timeout,
+        )
+        max_age = parse_max_age(response.headers.get("Cache-Control"))
+        max_age = self.max_age if max_age is None else max_age
+        if response.status_code == 304 and table is not None:
+            meta = dict(meta, fetched_at=time.time(), max_age=max_age)
+            self._meta[template] = meta
+            self._write_meta(template, meta)
+            return table
+        response.raise_for_status()
+        return self._store(
+            template,
+            response.json(),
+            {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "max_age": max_age,
+            },
+        )
+
+    def _store(self, template, records, meta):
+        meta = dict(meta, fetched_at=time.time())
+        table = AtlasTable(template, records)
+        self._tables[template] = table
+        self._meta[template] = meta
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._write_json(self._data_path(template), records)
+            self._write_meta(template, meta)
+        return table
+
+    def _data_path(self, template):
+        return os.path.join(self.cache_dir, f"{template}.json")
+
+    def _meta_path(self, template):
+        return os.path.join(self.cache_dir, f"{template}.meta.json")
+
+    def _write_json(self, path, value):
+        # 先写临时文件再替换，避免中断时留下不完整的缓存
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, "w") as f:
+            json.dump(value, f)
+        os.replace(temp, path)
+
+    def _write_meta(self, template, meta):
+        if self.cache_dir is not None:
+            self._write_json(self._meta_path(template), meta)
+
+    def _load_from_disk(self, template):
+        if self.cache_dir is None:
+            return
+        path, meta_path = self._data_path(template), self._meta_path(template)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                records = json.load(f)
+            meta = {}
+            if os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    meta = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取图谱缓存失败 {path}: {e}")
+            return
+        self._tables[template] = AtlasTable(template, records)
+        self._meta[template] = meta
+
+
+_ATLAS_REGISTRY = AtlasRegistry(offline=os.environ.get(OFFLINE_ENV, "") not in ("", "0"))
+
+
+def get_atlas_registry():
+    """返回进程级共享的图谱结构表注册表。"""
+    return _ATLAS_REGISTRY
+
+
+def fetch_label_data(template="ccfv3"):
+    """``template`` 的 {结构 ID: safe_name}，获取失败时返回空字典。"""
+    try:
+        return get_atlas_registry().get(template).names_by_id
+    except RuntimeError as e:
+        print(f"Failed to fetch label data: {e}")
+        return {}
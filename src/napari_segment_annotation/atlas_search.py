@@ -0,0 +1,80 @@
+"""
+结构表的增量搜索索引。
+
+每行的搜索文本为 ``"<ID>\\n<小写名称>"``（查询中不含换行，因此不会跨 ID 和名称匹配），
+与逐行 ``query in str(id) or query in name.lower()`` 的结果相同。建索引时记录每个长度不超过
+``NGRAM`` 的子串出现在哪些行：不超过该长度的查询直接查表，更长的查询取各 n-gram 行集合的
+交集作为候选，再只对候选行做子串检查。查询延长了上一次的查询时，结果一定在上一次的结果中，
+候选集取两者中较小的一个。结果为按原顺序排列的行号数组。
+"""
+from collections import defaultdict
+
+import numpy as np
+
+# 索引的最长子串
+NGRAM = 3
+
+
+class LabelSearchIndex:
+    """按子串搜索结构 ID 和名称（不区分大小写）。
+
+    Parameters
+    ----------
+    ids : sequence of int
+    names : sequence of str
+        与 ``ids`` 一一对应。
+    """
+
+    def __init__(self, ids, names):
+        self.id_text = np.array([str(label_id) for label_id in ids], dtype=str)
+        self.names_lower = np.array([name.lower() for name in names], dtype=str)
+        self.texts = np.char.add(np.char.add(self.id_text, "\n"), self.names_lower)
+        self.all_rows = np.arange(len(self.texts), dtype=np.int32)
+
+        postings = defaultdict(list)
+        for row, text in enumerate(self.texts.tolist()):
+            grams = set()
+            for size in range(1, NGRAM + 1):
+                grams.update(text[i:i + size] for i in range(len(text) - size + 1))
+            for gram in grams:
+                postings[gram].append(row)
+        self.postings = {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()}
+
+        self._last_query = ""
+        self._last_rows = self.all_rows
+
+    def __len__(self):
+        return len(self.texts)
+
+    def candidates(self, query):
+        """可能包含 ``query`` 的行；``query`` 不超过 `NGRAM` 个字符时即为精确结果。"""
+        empty = np.empty(0, dtype=np.int32)
+        if len(query) <= NGRAM:
+            return self.postings.get(query, empty)
+        grams = sorted(
+            (self.postings.get(query[i:i + NGRAM], empty) for i in range(len(query) - NGRAM + 1)),
+            key=len,
+        )
+        rows = grams[0]
+        for other in grams[1:]:
+            if not len(rows):
+                break
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        return rows
+
+    def search(self, query):
+        """返回搜索文本包含 ``query``（不区分大小写）的行号，按原顺序排列。"""
+        query = query.lower()
+        if not query:
+            rows = self.all_rows
+        elif "\n" in query:
+            rows = np.empty(0, dtype=np.int32)  # 换行只用作 ID 和名称的分隔
+        else:
+            rows = self.candidates(query)
+            exact = len(query) <= NGRAM
+            if self._last_query and self._last_query in query and len(self._last_rows) < len(rows):
+                rows, exact = self._last_rows, False
+            if not exact and len(rows):
+                rows = rows[np.char.find(self.texts[rows], query) >= 0]
+        self._last_query, self._last_rows = query, rows
+        return rows
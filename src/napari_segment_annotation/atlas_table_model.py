@@ -0,0 +1,110 @@
+"""
+结构表的虚拟化 Qt 模型。
+
+模型只持有 `AtlasTable` 的列数组和当前显示的行号数组，视图滚动时才按需在 ``data()`` 中
+生成可见单元格的文本，不为每行创建 Python 对象，因此不需要分页也能流畅浏览整个结构表。
+排序按预先计算好的各列名次对行号数组做一次 ``argsort``。设置体素数后增加一列汇总体素数。
+"""
+import numpy as np
+from qtpy.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+ID_COLUMN, NAME_COLUMN, COUNT_COLUMN = range(3)
+HEADERS = ("Label ID", "Safe Name", "Voxels")
+_ROOT = QModelIndex()
+
+
+def column_ranks(table):
+    """``table`` 各列的名次数组（行号 -> 按该列排序后的位置），按名称排序时不区分大小写。"""
+    ranks = []
+    for keys in (table.ids, table.search_index.names_lower):
+        order = np.argsort(keys, kind="stable")
+        rank = np.empty(len(order), dtype=np.int32)
+        rank[order] = np.arange(len(order), dtype=np.int32)
+        ranks.append(rank)
+    return ranks
+
+
+class AtlasTableModel(QAbstractTableModel):
+    """显示结构表中一组行（如搜索结果）的只读表格模型。"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.table = None
+        self.rows = np.empty(0, dtype=np.int32)  # 当前显示的行号，按显示顺序
+        self._source_rows = self.rows  # 排序前的行号
+        self._ranks = None
+        self._sort = None  # (列, 顺序)
+        self.counts = None  # 按行排列的体素数，为 None 时不显示该列
+
+    def set_table(self, table, rows=None):
+        """切换结构表，``rows`` 默认为全部行。"""
+        self.table = table
+        self._ranks = None
+        self.counts = None
+        if rows is None:
+            rows = np.arange(len(table) if table is not None else 0, dtype=np.int32)
+        self.set_rows(rows)
+
+    def set_rows(self, rows):
+        """显示 ``rows``（结构表的行号数组），保持当前的排序方式。"""
+        self.beginResetModel()
+        self._source_rows = rows
+        self.rows = self._sorted(rows)
+        self.endResetModel()
+
+    def set_counts(self, counts):
+        """显示按行排列的体素数 ``counts``（与结构表的行一一对应），None 时隐藏该列。"""
+        self.beginResetModel()
+        self.counts = counts
+        self.rows = self._sorted(self._source_rows)
+        self.endResetModel()
+
+    def label_id(self, row):
+        """第 ``row`` 个显示行的结构 ID。"""
+        return int(self.table.ids[self.rows[row]])
+
+    def _sorted(self, rows):
+        if self._sort is None or self.table is None or not len(rows):
+            return rows
+        column, order = self._sort
+        if column == COUNT_COLUMN:
+            if self.counts is None:
+                return rows
+            keys = self.counts[rows]
+        else:
+            if self._ranks is None:
+                self._ranks = column_ranks(self.table)
+            keys = self._ranks[column][rows]
+        # 降序时对取负的键做稳定排序，相同键的行保持原顺序
+        if order == Qt.DescendingOrder:
+            keys = -keys.astype(np.int64)
+        return rows[np.argsort(keys, kind="stable")]
+
+    def rowCount(self, parent=_ROOT):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=_ROOT):
+        if parent.isValid():
+            return 0
+        return len(HEADERS) if self.counts is not None else COUNT_COLUMN
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        row = self.rows[index.row()]
+        if index.column() == ID_COLUMN:
+            return None if role == Qt.ToolTipRole else str(self.table.ids[row])
+        if index.column() == COUNT_COLUMN:
+            return None if role == Qt.ToolTipRole else str(self.counts[row])
+        return self.table.names[row]
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return HEADERS[section]
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        self._sort = (column, order)
+        self.rows = self._sorted(self._source_rows)
+        self.layoutChanged.emit()
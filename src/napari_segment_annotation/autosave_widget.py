@@ -0,0 +1,188 @@
+import os
+
+import napari
+import zarr
+from napari.layers import Labels
+from napari_plugin_engine import napari_hook_implementation
+from qtpy.QtCore import QTimer
+from qtpy.QtWidgets import (
+    QComboBox,
+    QFileDialog,
+    QHBoxLayout,
+    QLabel,
+    QLineEdit,
+    QMessageBox,
+    QPushButton,
+    QVBoxLayout,
+    QWidget,
+)
+
+from .annotation_journal import (
+    AnnotationJournal,
+    discard_journal,
+    forget_store,
+    pending_edits,
+    replay_journal,
+    stores_with_pending_edits,
+)
+
+
+class AnnotationAutosave(QWidget):
+    """为标签层开启崩溃安全的自动保存。
+
+    打开小部件时检查之前开启过日志的存储，发现上次未恢复的修改会询问是否重放。
+    """
+
+    def __init__(self, viewer: napari.Viewer):
+        super().__init__()
+        self.viewer = viewer
+        self.journal = None
+
+        self.status_label = QLabel("Select a labels layer and a .zarr store to autosave into")
+
+        # 图层选择器
+        self.layer_selector = QComboBox()
+        self.update_layer_list()
+
+        # 存储路径
+        self.path_edit = QLineEdit()
+        self.path_edit.setPlaceholderText("labels.zarr")
+        self.browse_button = QPushButton("Browse...")
+        self.browse_button.clicked.connect(self.browse_path)
+        path_layout = QHBoxLayout()
+        path_layout.addWidget(self.path_edit)
+        path_layout.addWidget(self.browse_button)
+
+        self.start_button = QPushButton("Start Autosave")
+        self.start_button.clicked.connect(self.start_autosave)
+        self.stop_button = QPushButton("Stop Autosave")
+        self.stop_button.clicked.connect(self.stop_autosave)
+        self.stop_button.setEnabled(False)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.status_label)
+        layout.addWidget(self.layer_selector)
+        layout.addWidget(QLabel("Autosave Store:"))
+        layout.addLayout(path_layout)
+        layout.addWidget(self.start_button)
+        layout.addWidget(self.stop_button)
+        self.setLayout(layout)
+
+        # 自动更新图层列表
+        self.viewer.layers.events.inserted.connect(self.update_layer_list)
+        self.viewer.layers.events.removed.connect(self.update_layer_list)
+
+        # 小部件显示后再询问，不在构造时弹出对话框
+        QTimer.singleShot(0, self.offer_recovery)
+
+    def update_layer_list(self):
+        """更新图层列表，确保仅显示 Labels 图层。"""
+        current = self.layer_selector.currentText()
+        self.layer_selector.clear()
+        for layer in self.viewer.layers:
+            if isinstance(layer, Labels):
+                self.layer_selector.addItem(layer.name)
+        if current:
+            self.layer_selector.setCurrentText(current)
+
+    def browse_path(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Autosave labels as", filter="Zarr (*.zarr)")
+        if path:
+            self.path_edit.setText(path)
+
+    def offer_recovery(self):
+        """询问是否恢复之前会话中崩溃前未保存的修改，恢复后继续自动保存到原存储。
+
+        小部件一次只自动保存一个图层，因此恢复一个存储后不再询问其余的存储，
+        它们留到下次打开小部件或对其开启自动保存时再恢复。
+        """
+        if self.journal is not None:
+            return
+        pending = stores_with_pending_edits()
+        for index, (path, count) in enumerate(pending):
+            layer = self.ask_recovery(path, count)
+            if layer is None:
+                continue
+            self.path_edit.setText(path)
+            self.start_journal(layer, path, synced=True)
+            remaining = [other for other, _ in pending[index + 1:]]
+            if remaining:
+                self.status_label.setText(
+                    f"{self.status_label.text()}\n{len(remaining)} more stores have unsaved edits: "
+                    + ", ".join(remaining)
+                )
+            return
+
+    def ask_recovery(self, path, count):
+        """询问是否重放 ``path`` 的日志；重放时返回打开的恢复图层，否则丢弃日志并返回 None。"""
+        answer = QMessageBox.question(
+            self,
+            "Recover annotations",
+            f"Found {count} unsaved edited chunks in {path} from a previous session.\n"
+            "Replay them and open the recovered labels?",
+            QMessageBox.Yes | QMessageBox.No,
+        )
+        if answer != QMessageBox.Yes:
+            discard_journal(path)
+            forget_store(path)
+            return None
+        replay_journal(path)
+        # 直接以存储作为图层数据，按需读取显示的块，不把整卷读入内存
+        data = zarr.open_array(path, mode="r+", write_empty_chunks=False)
+        return self.viewer.add_labels(data, name=os.path.basename(os.path.normpath(path)))
+
+    def start_autosave(self):
+        path = self.path_edit.text().strip()
+        if not path:
+            self.status_label.setText("Please choose a .zarr store.")
+            return
+        if not path.endswith(".zarr"):
+            path += ".zarr"
+            self.path_edit.setText(path)
+
+        layer = None
+        count = pending_edits(path)
+        if count:
+            layer = self.ask_recovery(path, count)
+
+        synced = layer is not None
+        if layer is None:
+            layer_name = self.layer_selector.currentText()
+            if not layer_name:
+                self.status_label.setText("No labels layer selected.")
+                return
+            layer = self.viewer.layers[layer_name]
+        self.start_journal(layer, path, synced)
+
+    def start_journal(self, layer, path, synced=False):
+        """开始把 ``layer`` 的修改记录到 ``path``，``synced`` 表示存储已与图层一致。"""
+        self.stop_autosave()
+        try:
+            self.journal = AnnotationJournal(layer, path, synced=synced)
+        except (RuntimeError, OSError, ValueError) as e:
+            self.status_label.setText(f"Error: {str(e)}")
+            print(f"Error starting autosave: {e}")
+            return
+        self.status_label.setText(f"Autosaving '{layer.name}' to {path}")
+        self.start_button.setEnabled(False)
+        self.stop_button.setEnabled(True)
+
+    def stop_autosave(self):
+        """停止自动保存，日志压实到存储后删除。"""
+        if self.journal is None:
+            return
+        self.journal.close()
+        self.status_label.setText(f"Autosave stopped, labels saved to {self.journal.store_path}")
+        self.journal = None
+        self.start_button.setEnabled(True)
+        self.stop_button.setEnabled(False)
+
+    def closeEvent(self, event):
+        self.stop_autosave()
+        super().closeEvent(event)
+
+
+# 提供插件小部件
+@napari_hook_implementation
+def napari_experimental_provide_dock_widget(viewer: napari.Viewer) -> QWidget:
+    return AnnotationAutosave(viewer)
@@ -0,0 +1,234 @@
+"""
+基于查找表的向量化标签重映射。
+
+任意重映射（保留一组标签、删除一组标签、把子结构合并到父结构、重新编号）都表示为
+``{旧标签: 新标签}`` 和未列出标签的默认处理（保留原值或置零），每个体素只查一次表。
+标签范围较小时用稠密查找表 ``lut[mask]``；标签 ID 很大且稀疏时用排好序的键和
+``np.searchsorted`` 查找，内存只与映射条目数有关。体数据按块在线程池中处理，一次遍历完成。
+"""
+import re
+from functools import partial
+from typing import NamedTuple, Optional
+
+import dask.array as da
+import numpy as np
+
+from .mask_merge import iter_chunk_regions, map_regions, merge_grid, read_block
+from .zarr_io import DEFAULT_CHUNK_EDGE
+
+# 最大键不超过该值时用稠密查找表
+DENSE_LUT_LIMIT = 1 << 22
+
+
+class LabelRemap(NamedTuple):
+    """编译后的重映射：排好序的键及对应的新值，``keep`` 表示未列出的标签保留原值（否则置零）。
+
+    ``lut`` 为稠密查找表，键范围过大时为 None，改用 ``searchsorted``。
+    """
+
+    keys: np.ndarray
+    values: np.ndarray
+    keep: bool
+    lut: Optional[np.ndarray]
+
+
+def build_remap(mapping, keep=True, dense_limit=DENSE_LUT_LIMIT):
+    """由 ``{旧标签: 新标签}`` 构建 `LabelRemap`。
+
+    Parameters
+    ----------
+    mapping : dict
+        列出的标签按映射取新值。
+    keep : bool
+        未列出的标签保留原值；为 False 时置零。
+    dense_limit : int
+        最大键小于该值且键非负时构建稠密查找表。
+    """
+    keys = np.fromiter(mapping.keys(), dtype=np.int64, count=len(mapping))
+    values = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+    order = np.argsort(keys, kind="stable")
+    keys, values = keys[order], values[order]
+    values = values.astype(np.min_scalar_type(values.max()) if len(values) and values.min() >= 0 else np.int64)
+
+    lut = None
+    if len(keys) == 0 or (keys[0] >= 0 and keys[-1] < dense_limit):
+        size = int(keys[-1]) + 1 if len(keys) else 1
+        dtype = np.result_type(values.dtype, np.min_scalar_type(size - 1)) if keep else values.dtype
+        lut = np.arange(size, dtype=dtype) if keep else np.zeros(size, dtype=dtype)
+        lut[keys] = values
+    return LabelRemap(keys, values, keep, lut)
+
+
+def keep_labels(labels):
+    """只保留 ``labels``，其余置零。"""
+    return build_remap({int(label): int(label) for label in labels}, keep=False)
+
+
+def drop_labels(labels):
+    """把 ``labels`` 置零，其余保留。"""
+    return build_remap({int(label): 0 for label in labels}, keep=True)
+
+
+def parent_labels(parents, levels=1):
+    """把子结构标签替换为其父结构（``parents`` 为 {子: 父}）。
+
+    ``levels`` 为向上合并的层数，None 表示一直合并到没有父结构的根。
+    """
+    mapping = {}
+    for child in parents:
+        target, depth = child, 0
+        visited = {child}
+        while target in parents and (levels is None or depth < levels):
+            target, depth = parents[target], depth + 1
+            if target in visited:
+                raise ValueError(f"标签 {child} 的父结构存在环")
+            visited.add(target)
+        mapping[int(child)] = int(target)
+    return build_remap(mapping, keep=True)
+
+
+def renumber_labels(labels):
+    """把 ``labels``（不含 0）按升序重新编号为 1..N，其余置零。"""
+    labels = np.unique(np.asarray(list(labels), dtype=np.int64))
+    labels = labels[labels != 0]
+    return build_remap({int(label): i + 1 for i, label in enumerate(labels)}, keep=False)
+
+
+def parse_label_spec(text):
+    """解析标签列表文本，如 ``"1, 3, 5-9"``，返回整数列表。"""
+    labels = []
+    for part in re.split(r"[,\s]+", text.strip()):
+        if not part:
+            continue
+        match = re.fullmatch(r"(-?\d+)-(-?\d+)", part)
+        if match:
+            start, stop = int(match.group(1)), int(match.group(2))
+            labels.extend(range(start, stop + 1))
+        else:
+            labels.append(int(part))
+    return labels
+
+
+def parse_mapping_spec(text):
+    """解析映射文本，如 ``"3:1, 4:1"``，返回 {旧标签: 新标签}。"""
+    mapping = {}
+    for part in re.split(r"[,\s]+", text.strip()):
+        if not part:
+            continue
+        old, _, new = part.partition(":")
+        if not new:
+            raise ValueError(f"无法解析映射 {part!r}，应为 旧标签:新标签")
+        mapping[int(old)] = int(new)
+    return mapping
+
+
+def apply_remap(block, remap):
+    """对一块标签做重映射，返回新数组，类型为 `remap_dtype`。"""
+    block = np.asarray(block)
+    return _lookup(block, remap).astype(remap_dtype(block.dtype, remap), copy=False)
+
+
+def _lookup(block, remap):
+    if remap.lut is not None and block.size:
+        low, high = block.min(), block.max()
+        if low >= 0 and high < len(remap.lut):
+            return remap.lut[block]
+        inside = (block >= 0) & (block < len(remap.lut))
+        out = block.astype(np.result_type(block.dtype, remap.lut.dtype)) if remap.keep else np.zeros(
+            block.shape, dtype=remap.lut.dtype
+        )
+        out[inside] = remap.lut[block[inside]]
+        return out
+
+    dtype = np.result_type(block.dtype, remap.values.dtype) if remap.keep else remap.values.dtype
+    if len(remap.keys) == 0:
+        return block.astype(dtype) if remap.keep else np.zeros(block.shape, dtype=dtype)
+    index = np.searchsorted(remap.keys, block)
+    np.minimum(index, len(remap.keys) - 1, out=index)
+    found = remap.keys[index] == block
+    fallback = block if remap.keep else 0
+    return np.where(found, remap.values[index], fallback).astype(dtype, copy=False)
+
+
+def remap_dtype(dtype, remap):
+    """重映射结果的类型：新值都能用原类型表示时保持原类型。"""
+    values = remap.values
+    if len(values) == 0 or (
+        np.issubdtype(dtype, np.integer)
+        and np.iinfo(dtype).min <= values.min()
+        and values.max() <= np.iinfo(dtype).max
+    ):
+        return np.dtype(dtype)
+    return np.result_type(dtype, values.dtype)
+
+
+def map_label_chunks(data, function, dtype, out=None, chunk_edge=DEFAULT_CHUNK_EDGE, max_workers=None):
+    """按块对体数据应用 ``function``（块 -> 同形状的块），返回 (结果, 有变化的块范围列表)。
+
+    ``out`` 可以就是 ``data``（原地修改，只写回有变化的块）；默认对 Dask 输入返回延迟数组
+    （变化范围为 None），否则新建 NumPy 数组。额外内存只有线程数个块的临时数组。
+    """
+    if out is None and isinstance(data, da.Array):
+        return data.map_blocks(function, dtype=dtype), None
+    if out is None:
+        out = np.empty(data.shape, dtype=dtype)
+    elif out.shape != data.shape:
+        raise ValueError(f"输出形状 {out.shape} 与输入 {data.shape} 不一致")
+    in_place = out is data
+
+    def map_region(region):
+        block = read_block(data, region)
+        result = function(block)
+        if in_place and np.array_equal(result, block):
+            return None
+        out[region] = result
+        return region
+
+    regions = list(iter_chunk_regions(data.shape, merge_grid(out, data, chunk_edge=chunk_edge)))
+    changed = [region for region in map_regions(map_region, regions, max_workers) if region is not None]
+    return out, changed
+
+
+def remap_labels(data, remap, out=None, chunk_edge=DEFAULT_CHUNK_EDGE, max_workers=None):
+    """按块并行地重映射整个体数据，返回 (结果, 有变化的块范围列表)。
+
+    Parameters
+    ----------
+    data : array-like
+        整数 NumPy、Dask 或 Zarr 数组。
+    remap : LabelRemap
+    out : array-like, optional
+        写入结果的 NumPy 或 Zarr 数组，可以就是 ``data``，见 `map_label_chunks`。
+    """
+    if out is not None and remap_dtype(out.dtype, remap) != out.dtype:
+        raise ValueError(f"重映射后的标签超出输出类型 {out.dtype} 的范围")
+    return map_label_chunks(
+        data, partial(apply_remap, remap=remap), remap_dtype(data.dtype, remap), out, chunk_edge, max_workers
+    )
+
+
+def label_max(data, chunk_edge=DEFAULT_CHUNK_EDGE, max_workers=None):
+    """分块求体数据的最大值，不分配整卷的临时数组。"""
+    regions = list(iter_chunk_regions(data.shape, merge_grid(data, chunk_edge=chunk_edge)))
+    return max(map_regions(lambda region: read_block(data, region).max(), regions, max_workers))
+
+
+def label_counts(data, chunk_edge=DEFAULT_CHUNK_EDGE, max_workers=None):
+    """分块统计各标签的体素数，返回按标签升序排列的 (标签数组, 体素数数组)。"""
+    regions = list(iter_chunk_regions(data.shape, merge_grid(data, chunk_edge=chunk_edge)))
+    parts = map_regions(lambda region: np.unique(read_block(data, region), return_counts=True), regions, max_workers)
+    labels, inverse = np.unique(np.concatenate([part[0] for part in parts]), return_inverse=True)
+    counts = np.zeros(len(labels), dtype=np.int64)
+    np.add.at(counts, inverse, np.concatenate([part[1] for part in parts]))
+    return labels, counts
+
+
+def invert_labels(data, out=None, chunk_edge=DEFAULT_CHUNK_EDGE, max_workers=None):
+    """按块计算 ``data.max() - data``，返回 (结果, 有变化的块范围列表)，``out`` 见 `map_label_chunks`。"""
+    peak = label_max(data, chunk_edge, max_workers)
+    dtype = data.dtype
+
+    def invert(block):
+        return np.subtract(peak, block, dtype=dtype)
+
+    return map_label_chunks(data, invert, dtype, out, chunk_edge, max_workers)
@@ -0,0 +1,287 @@
+"""
+标签层的增量保存。
+
+`DirtyChunkWriter` 监听标签层的绘制事件（画笔、填充、多边形和 ``data_setitem``），
+以及撤销/重做，记录自上次保存以来被修改的块；保存时只把这些块写入磁盘上的分块
+Zarr 数组。保存耗时和 I/O 与修改量成正比，而不是与体数据大小成正比，
+因此可以频繁地自动保存。整个替换 ``layer.data`` 时所有块都会被标记；
+绕过 napari 直接写入 ``layer.data`` 的代码用 `mark_layer_region` 通知修改范围。
+"""
+import itertools
+import os
+import threading
+import weakref
+from collections.abc import MutableSequence
+
+import numpy as np
+import zarr
+
+from .zarr_io import DEFAULT_CHUNK_EDGE, DEFAULT_COMPRESSOR
+
+
+def labels_chunks(shape, chunk_edge=DEFAULT_CHUNK_EDGE):
+    """标签存储的块形状：最后两维按 ``chunk_edge`` 分块，其余维度每块一个切片。"""
+    return tuple(
+        min(size, chunk_edge) if axis >= len(shape) - 2 else 1
+        for axis, size in enumerate(shape)
+    )
+
+
+def chunk_region(index, chunks, shape):
+    """块索引 ``index`` 在数组中对应的范围，边缘块截断到数组边界。"""
+    return tuple(
+        slice(i * chunk, min((i + 1) * chunk, size))
+        for i, chunk, size in zip(index, chunks, shape)
+    )
+
+
+def atom_region(atom, shape):
+    """一条 napari 标签编辑记录影响的范围，返回每个轴上的 slice。
+
+    记录可以是带 ``slice_key`` 的掩码绘制记录，也可以是
+    ``(indices, old_values, new_values)`` 形式的花式索引记录。
+    """
+    slice_key = getattr(atom, "slice_key", None)
+    if slice_key is not None:
+        return tuple(
+            slice(*s.indices(size)[:2]) for s, size in zip(slice_key, shape)
+        )
+    indices = atom[0]
+    region = []
+    for axis_indices, size in zip(indices, shape):
+        if isinstance(axis_indices, slice):
+            region.append(slice(*axis_indices.indices(size)[:2]))
+            continue
+        axis_indices = np.asarray(axis_indices)
+        if axis_indices.size == 0:
+            return None
+        region.append(slice(int(axis_indices.min()), int(axis_indices.max()) + 1))
+    return tuple(region)
+
+
+class DirtyChunkWriter:
+    """把标签层增量保存到分块 Zarr 数组。
+
+    Parameters
+    ----------
+    layer : napari.layers.Labels
+        要保存的标签层（非多尺度）。
+    path : str
+        Zarr 数组目录。第一次保存写入全部块，之后只写入修改过的块。
+    chunk_edge : int
+        平面内的块边长，块越小，单次修改需要重写的数据越少。
+    synced : bool
+        已确认 ``path`` 处的存储与图层数据一致（例如图层刚从该存储恢复），
+        第一次保存时不重写全部块。
+    on_change : callable, optional
+        每次处理完修改后调用，参数为本次的编辑记录列表；撤销/重做后为空列表（无法确定
+        重放了哪些记录时为 None），
+        整个数据被替换时为 None。napari 对单次编辑先发出绘制事件再写入数据，
+        回调时图层中的数据可能尚未包含这些记录。
+    """
+
+    def __init__(
+        self,
+        layer,
+        path,
+        chunk_edge=DEFAULT_CHUNK_EDGE,
+        compressor=DEFAULT_COMPRESSOR,
+        synced=False,
+        on_change=None,
+    ):
+        self.layer = layer
+        self.path = path
+        self.chunk_edge = chunk_edge
+        self.compressor = compressor
+        self.on_change = on_change
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._open_store()
+        if synced:
+            self.take_dirty()
+
+        layer.events.paint.connect(self._on_paint)
+        layer.events.data.connect(self._on_data)
+        _LAYER_WRITERS.setdefault(layer, weakref.WeakSet()).add(self)
+        _install_history_hooks(layer)
+        # 写入器未 close 就被回收时，同样在没有写入器后移除图层上的包装
+        weakref.finalize(self, _release_history_hooks, weakref.ref(layer))
+
+    def _open_store(self):
+        """打开或新建与图层形状、类型一致的存储，并把所有块标记为待写入。
+
+        沿用已有存储时，与图层相同的块也会被重写一次：无法确认磁盘上的内容与图层一致。
+        全零块不落盘，已有的全零块文件会被删除。
+        """
+        data = self.layer.data
+        store = None
+        if os.path.exists(self.path):
+            store = zarr.open_array(self.path, mode="r+", write_empty_chunks=False)
+            if store.shape != data.shape or store.dtype != data.dtype:
+                store = None
+        if store is None:
+            store = zarr.open_array(
+                self.path,
+                mode="w",
+                shape=data.shape,
+                chunks=labels_chunks(data.shape, self.chunk_edge),
+                dtype=data.dtype,
+                compressor=self.compressor,
+                fill_value=0,
+                write_empty_chunks=False,
+            )
+            store.attrs["image-label"] = {"version": "0.4"}
+        self.store = store
+        self.chunks = store.chunks
+        with self._lock:
+            self._dirty = set()
+        self.mark_all()
+
+    @property
+    def dirty_chunks(self):
+        with self._lock:
+            return set(self._dirty)
+
+    def mark_region(self, region):
+        """把 ``region``（每个轴一个 slice）覆盖的块标记为已修改。"""
+        ranges = []
+        for s, size, chunk in zip(region, self.store.shape, self.chunks):
+            start, stop, _ = s.indices(size)
+            if stop <= start:
+                return
+            ranges.append(range(start // chunk, (stop - 1) // chunk + 1))
+        with self._lock:
+            self._dirty.update(itertools.product(*ranges))
+
+    def mark_all(self):
+        self.mark_region(tuple(slice(None) for _ in self.store.shape))
+
+    def chunk_region(self, index):
+        return chunk_region(index, self.chunks, self.store.shape)
+
+    def take_dirty(self):
+        """取出并清空已修改的块索引，按索引排序。"""
+        with self._lock:
+            dirty, self._dirty = sorted(self._dirty), set()
+        return dirty
+
+    def save(self):
+        """把已修改的块写入磁盘，返回写入的块数。"""
+        dirty = self.take_dirty()
+        data = self.layer.data
+        for index in dirty:
+            region = self.chunk_region(index)
+            self.store[region] = np.asarray(data[region])
+        return len(dirty)
+
+    def close(self):
+        """停止跟踪修改。"""
+        self.layer.events.paint.disconnect(self._on_paint)
+        self.layer.events.data.disconnect(self._on_data)
+        _LAYER_WRITERS.get(self.layer, set()).discard(self)
+        _release_history_hooks(weakref.ref(self.layer))
+
+    def _on_paint(self, event):
+        for atom in event.value:
+            region = atom_region(atom, self.store.shape)
+            if region is not None:
+                self.mark_region(region)
+        self._notify(list(event.value))
+
+    def _on_data(self, event=None):
+        if self.layer.data.shape != self.store.shape or self.layer.data.dtype != self.store.dtype:
+            self._open_store()
+        else:
+            self.mark_all()
+        self._notify(None)
+
+    def _notify(self, atoms):
+        if self.on_change is not None:
+            self.on_change(atoms)
+
+    def _on_history(self, atoms):
+        """撤销/重做后调用，``atoms`` 为被重放的记录，未知时为 None（标记全部块）。"""
+        if atoms is None:
+            self.mark_all()
+            self._notify(None)
+            return
+        for atom in atoms:
+            region = atom_region(atom, self.store.shape)
+            if region is not None:
+                self.mark_region(region)
+        self._notify([])
+
+
+# 每个图层上正在跟踪修改的所有写入器
+_LAYER_WRITERS = weakref.WeakKeyDictionary()
+
+# undo/redo 重放的记录所在的 napari 内部历史栈：(方法, 调用前取出记录的栈, 调用后记录所在的栈)
+_HISTORY_STACKS = (("undo", "_undo_history", "_redo_history"), ("redo", "_redo_history", "_undo_history"))
+
+
+def _install_history_hooks(layer):
+    """napari 的撤销/重做不发出绘制事件，这里在图层实例上包装公开的 ``undo``/``redo``，
+    调用后通知该图层的所有写入器。每个图层只包装一次。
+
+    被重放的记录从 napari 内部的历史栈中读取；历史栈不存在（napari 改变了内部实现）
+    或无法确定重放了哪条记录时，写入器标记全部块，保存仍然正确，只是不再是增量的。
+    """
+    if "undo" in layer.__dict__:
+        return
+    layer_ref = weakref.ref(layer)
+
+    def hook(name, source, target):
+        method = getattr(type(layer), name)
+
+        def replay():
+            owner = layer_ref()
+            source_stack = getattr(owner, source, None)
+            before = len(source_stack) if isinstance(source_stack, MutableSequence) else None
+            method(owner)
+            target_stack = getattr(owner, target, None)
+            atoms = None
+            if before is not None and isinstance(target_stack, MutableSequence):
+                if len(source_stack) == before:
+                    return  # 没有可撤销/重做的记录
+                atoms = target_stack[-1]
+            for writer in list(_LAYER_WRITERS.get(owner, ())):
+                writer._on_history(atoms)
+
+        layer.__dict__[name] = replay
+
+    for name, source, target in _HISTORY_STACKS:
+        hook(name, source, target)
+
+
+def _release_history_hooks(layer_ref):
+    """图层上没有写入器后移除 `_install_history_hooks` 的包装。"""
+    layer = layer_ref()
+    if layer is not None and not _LAYER_WRITERS.get(layer):
+        for name, _, _ in _HISTORY_STACKS:
+            layer.__dict__.pop(name, None)
+
+
+# save_labels_incremental 为每个图层创建的写入器
+_WRITERS = weakref.WeakKeyDictionary()
+
+
+def mark_layer_region(layer, region):
+    """通知跟踪 ``layer`` 的写入器：``region`` 内的数据已被直接修改（数据已写入）。"""
+    for writer in list(_LAYER_WRITERS.get(layer, ())):
+        writer.mark_region(region)
+        writer._notify([])
+
+
+def save_labels_incremental(layer, path):
+    """增量保存标签层到 ``path``，返回写入的块数。
+
+    第一次对某个图层调用时开始跟踪修改并写入全部数据，之后只写入修改过的块。
+    """
+    path = os.path.abspath(path)
+    writer = _WRITERS.get(layer)
+    if writer is None or writer.path != path:
+        if writer is not None:
+            writer.close()
+        writer = DirtyChunkWriter(layer, path)
+        _WRITERS[layer] = writer
+    return writer.save()
@@ -1,4 +1,5 @@
 import napari
+import numpy as np
 from napari_plugin_engine import napari_hook_implementation
 from qtpy.QtWidgets import (
     QVBoxLayout,
@@ -6,16 +7,23 @@ from qtpy.QtWidgets import (
     QLabel,
     QComboBox,
     QPushButton,
-    QTableWidget,
-    QTableWidgetItem,
-    QLineEdit,
+    QSpinBox,
     QHBoxLayout,
-    QToolTip,
+    QTableView,
+    QHeaderView,
+    QLineEdit,
 )
-import requests
-from PyQt5.QtCore import Qt
+from qtpy.QtCore import Qt, QTimer
 from napari.layers import Labels
 
+from .atlas_loader import AtlasLoader
+from .atlas_registry import TEMPLATES
+from .atlas_table_model import ID_COLUMN, AtlasTableModel
+from .label_remap import label_counts, remap_labels
+
+# 最后一次输入后等待多久再搜索（毫秒）
+SEARCH_DEBOUNCE_MS = 150
+
 
 class LabelFilter(QWidget):
     def __init__(self, viewer: napari.Viewer):
@@ -23,15 +31,27 @@ class LabelFilter(QWidget):
         self.viewer = viewer
 
         # 数据相关变量
+        self.table = None  # 当前模板的结构表 (AtlasTable)
         self.full_data = {}  # 全量数据 (id -> safe_name)
-        self.filtered_data = {}  # 过滤后的数据
-        self.page_size = 20  # 每页显示多少条数据
-        self.current_page = 1  # 当前页
+        self.filtered_rows = np.empty(0, dtype=np.int32)  # 过滤后的行号
+        # 在后台线程加载结构表并构建搜索索引和结构树，切换模板时之前的请求作废
+        self.atlas_loader = AtlasLoader(
+            self.on_atlas_loaded,
+            self.on_atlas_failed,
+            prepare=lambda table: (table.search_index, table.hierarchy),
+            prepared=lambda table: table.built("search_index") and table.built("hierarchy"),
+        )
+
+        # 搜索防抖：停止输入一段时间后再搜索
+        self.search_timer = QTimer()
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.apply_search)
 
         # 初始化 UI 组件
         self.label_display = QLabel("Select a template and search for labels:")
         self.template_selector = QComboBox()
-        self.template_selector.addItems(["ccfv3", "civm_rhesus", "visor"])
+        self.template_selector.addItems(TEMPLATES)
         self.template_selector.currentIndexChanged.connect(self.update_template)
 
         self.layer_selector = QComboBox()
@@ -39,28 +59,33 @@ class LabelFilter(QWidget):
 
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("Search Label ID or Safe Name")
-        self.search_input.textChanged.connect(self.apply_search)
-
-        # 分页控件
-        self.page_info = QLabel(f"Page {self.current_page}")
-        self.previous_button = QPushButton("Previous")
-        self.previous_button.clicked.connect(self.go_to_previous_page)
-        self.next_button = QPushButton("Next")
-        self.next_button.clicked.connect(self.go_to_next_page)
-
-        # Label 数据表格
-        self.label_table = QTableWidget()
-        self.label_table.setColumnCount(2)
-        self.label_table.setHorizontalHeaderLabels(["Label ID", "Safe Name"])
-        self.label_table.setEditTriggers(QTableWidget.NoEditTriggers)
-        self.label_table.setMouseTracking(True)  # 启用鼠标跟踪
-        self.label_table.cellEntered.connect(self.show_tooltip)  # 连接鼠标悬停事件
-
-        # 布局
-        pagination_layout = QHBoxLayout()
-        pagination_layout.addWidget(self.previous_button)
-        pagination_layout.addWidget(self.page_info)
-        pagination_layout.addWidget(self.next_button)
+        self.search_input.textChanged.connect(self.search_timer.start)
+
+        # Label 数据表格：虚拟化模型，只为可见行生成文本，悬停时显示完整名称
+        self.label_model = AtlasTableModel(self)
+        self.label_table = QTableView()
+        self.label_table.setModel(self.label_model)
+        self.label_table.setEditTriggers(QTableView.NoEditTriggers)
+        self.label_table.setSelectionBehavior(QTableView.SelectRows)
+        self.label_table.setSortingEnabled(True)
+        self.label_table.sortByColumn(ID_COLUMN, Qt.AscendingOrder)
+        self.label_table.verticalHeader().setVisible(False)
+        # 固定行高，滚动时不需要逐行计算尺寸
+        self.label_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.label_table.horizontalHeader().setStretchLastSection(True)
+
+        # 按结构层级处理所选图层：选择后代、合并到指定深度、体素数汇总到各级父结构
+        self.descendants_button = QPushButton("Select Descendants")
+        self.descendants_button.clicked.connect(self.select_descendants)
+        self.depth_input = QSpinBox()
+        self.depth_input.setPrefix("Depth ")
+        self.collapse_button = QPushButton("Collapse to Depth")
+        self.collapse_button.clicked.connect(self.collapse_to_depth)
+        self.counts_button = QPushButton("Roll Up Voxel Counts")
+        self.counts_button.clicked.connect(self.roll_up_counts)
+        depth_layout = QHBoxLayout()
+        depth_layout.addWidget(self.depth_input)
+        depth_layout.addWidget(self.collapse_button)
 
         layout = QVBoxLayout()
         layout.addWidget(self.label_display)
@@ -71,34 +96,48 @@ class LabelFilter(QWidget):
         layout.addWidget(QLabel("Search:"))  # 添加搜索标签
         layout.addWidget(self.search_input)  # 添加搜索输入框
         layout.addWidget(self.label_table)
-        layout.addLayout(pagination_layout)
+        layout.addWidget(self.descendants_button)
+        layout.addLayout(depth_layout)
+        layout.addWidget(self.counts_button)
         self.setLayout(layout)
 
         # 初始加载数据
         self.update_template()
 
-    def fetch_label_data(self, template="ccfv3"):
-        """从接口获取所有 Label 数据"""
-        url = f"https://smart.siat.ac.cn/api/v1/atlas-structures/?format=json&template={template}"
-        try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                data = response.json()
-                return {int(item["id"]): item["safe_name"] for item in data if item["id"].isdigit()}
-            else:
-                print(f"Failed to fetch label data, status code: {response.status_code}")
-                return {}
-        except Exception as e:
-            print(f"Error fetching label data: {str(e)}")
-            return {}
-
     def update_template(self):
-        """更新模板数据"""
+        """切换模板，结构表加载完成前显示为空"""
         self.template = self.template_selector.currentText()
-        self.full_data = self.fetch_label_data(self.template)
-        self.filtered_data = self.full_data
-        self.current_page = 1
-        self.update_pagination()
+        self.table = None
+        self.full_data = {}
+        self.filtered_rows = np.empty(0, dtype=np.int32)
+        self.label_model.set_table(None)
+        if not self.atlas_loader.load(self.template):
+            self.label_display.setText(f"Loading {self.template} labels...")
+
+    def on_atlas_loaded(self, template, table):
+        """结构表加载完成（主线程）"""
+        self.table = table
+        self.full_data = table.names_by_id
+        self.label_model.set_table(table)
+        # 结构树无法构建时只停用层级操作，搜索和表格照常使用
+        hierarchy = table.hierarchy
+        self.set_hierarchy_enabled(hierarchy is not None)
+        if hierarchy is None:
+            print(f"Structure hierarchy of {template} is unavailable: {table.hierarchy_error}")
+        else:
+            self.depth_input.setRange(0, hierarchy.max_depth)
+        self.label_display.setText(f"{template}: {len(table)} labels")
+        self.apply_search()
+
+    def set_hierarchy_enabled(self, enabled):
+        """启用或停用依赖结构树的按钮"""
+        for widget in (self.descendants_button, self.depth_input, self.collapse_button, self.counts_button):
+            widget.setEnabled(enabled)
+            widget.setToolTip("" if enabled else "The structure hierarchy of this template is unavailable.")
+
+    def on_atlas_failed(self, template, message):
+        self.label_display.setText(f"Failed to load {template} labels")
+        print(f"Failed to fetch label data: {message}")
 
     def update_layer_list(self):
         """更新图层列表，仅显示 Labels 图层"""
@@ -108,64 +147,78 @@ class LabelFilter(QWidget):
                 self.layer_selector.addItem(layer.name)
 
     def apply_search(self):
-        """根据搜索关键词更新数据"""
-        query = self.search_input.text().lower()
-        if query:
-            self.filtered_data = {
-                label_id: name
-                for label_id, name in self.full_data.items()
-                if query in str(label_id) or query in name.lower()
-            }
+        """根据搜索关键词更新数据，使用结构表的搜索索引"""
+        self.search_timer.stop()
+        if self.table is None:
+            return
+        self.filtered_rows = self.table.search_index.search(self.search_input.text())
+        self.label_model.set_rows(self.filtered_rows)
+        if self.search_input.text():
+            self.label_display.setText(f"{self.template}: {len(self.filtered_rows)} of {len(self.table)} labels")
         else:
-            self.filtered_data = self.full_data
-        self.current_page = 1
-        self.update_pagination()
-
-    def update_pagination(self):
-        """更新分页显示"""
-        # 计算分页数据
-        start_index = (self.current_page - 1) * self.page_size
-        end_index = start_index + self.page_size
-        items = list(self.filtered_data.items())
-        current_page_data = dict(items[start_index:end_index])
-
-        # 更新表格显示
-        self.label_table.setRowCount(len(current_page_data))
-        for row, (label_id, safe_name) in enumerate(current_page_data.items()):
-            self.label_table.setItem(row, 0, QTableWidgetItem(str(label_id)))
-            self.label_table.setItem(row, 1, QTableWidgetItem(safe_name))
-
-        # 更新分页信息
-        total_pages = (len(self.filtered_data) + self.page_size - 1) // self.page_size
-        self.page_info.setText(f"Page {self.current_page} of {total_pages}")
-
-        # 控制按钮可用性
-        self.previous_button.setEnabled(self.current_page > 1)
-        self.next_button.setEnabled(self.current_page < total_pages)
-
-    def go_to_previous_page(self):
-        """跳转到上一页"""
-        if self.current_page > 1:
-            self.current_page -= 1
-            self.update_pagination()
-
-    def go_to_next_page(self):
-        """跳转到下一页"""
-        total_pages = (len(self.filtered_data) + self.page_size - 1) // self.page_size
-        if self.current_page < total_pages:
-            self.current_page += 1
-            self.update_pagination()
-
-    def show_tooltip(self, row, column):
-        """鼠标悬停时显示完整文本"""
-        if column == 1:  # 仅对第二列 (Safe Name) 显示 Tooltip
-            item = self.label_table.item(row, column)
-            if item:
-                QToolTip.showText(
-                    self.label_table.viewport().mapToGlobal(self.label_table.visualItemRect(item).topLeft()),
-                    item.text(),
-                    self.label_table,
-                )
+            self.label_display.setText(f"{self.template}: {len(self.table)} labels")
+
+    def selected_layer(self):
+        """所选的 Labels 图层，没有或为多尺度图层时返回 None 并提示"""
+        layer_name = self.layer_selector.currentText()
+        if self.table is None or not layer_name:
+            self.label_display.setText("Select a labels layer after the template has loaded.")
+            return None
+        if self.table.hierarchy is None:
+            self.label_display.setText(f"The structure hierarchy of {self.template} is unavailable.")
+            return None
+        layer = self.viewer.layers[layer_name]
+        if layer.multiscale:
+            self.label_display.setText("Multiscale masks are not supported.")
+            return None
+        return layer
+
+    def add_remapped_layer(self, layer, remap, name):
+        """把重映射后的标签作为新图层加入，不修改原图层"""
+        try:
+            data, _ = remap_labels(layer.data, remap)
+        except ValueError as e:
+            self.label_display.setText(f"Error: {str(e)}")
+            print(f"Error remapping labels: {e}")
+            return
+        self.viewer.add_labels(data, name=name, scale=layer.scale, translate=layer.translate)
+
+    def select_descendants(self):
+        """只保留表格中所选结构及其所有后代的标签"""
+        layer = self.selected_layer()
+        if layer is None:
+            return
+        rows = self.label_table.selectionModel().selectedRows()
+        if not rows:
+            self.label_display.setText("Select a structure in the table first.")
+            return
+        structure_id = self.label_model.label_id(rows[0].row())
+        remap = self.table.hierarchy.select_remap(structure_id)
+        name = self.full_data.get(structure_id, structure_id)
+        self.add_remapped_layer(layer, remap, f"{layer.name} [{name}]")
+        self.label_display.setText(f"{name}: {len(remap.keys)} structures selected")
+
+    def collapse_to_depth(self):
+        """把每个标签替换为其在指定深度上的祖先结构"""
+        layer = self.selected_layer()
+        if layer is None:
+            return
+        level = self.depth_input.value()
+        self.add_remapped_layer(layer, self.table.hierarchy.collapse_remap(level), f"{layer.name} depth {level}")
+
+    def roll_up_counts(self):
+        """统计所选图层各标签的体素数并汇总到各级父结构，显示在表格中"""
+        layer = self.selected_layer()
+        if layer is None:
+            return
+        labels, counts = label_counts(layer.data)
+        totals = self.table.hierarchy.rollup_counts(labels, counts)
+        self.label_model.set_counts(totals)
+        labelled = labels != 0
+        unknown = int(counts[labelled & (self.table.hierarchy.rows(labels) < 0)].sum())
+        self.label_display.setText(
+            f"{layer.name}: {int(counts[labelled].sum())} labelled voxels, {unknown} outside {self.template}"
+        )
 
 
 # 提供插件小部件
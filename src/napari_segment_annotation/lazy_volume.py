@@ -0,0 +1,57 @@
+"""
+按切片、按块访问大体数据的工具函数。
+
+图像层可能是 NumPy、Dask 或 Zarr 数组，这里的函数只读取需要的切片，
+输出标签使用按需分配块的 Zarr 数组，峰值内存与单个切片而不是整个体数据成正比。
+"""
+import os
+
+import numpy as np
+import zarr
+
+from .tiff_stack import is_tiff_stack_path, read_tiff_stack
+
+# 单个输出块在 Y/X 方向上的最大边长，超大切片再按平面分块
+MAX_CHUNK_EDGE = 4096
+
+
+def read_slice(data, z):
+    """读取第 z 个切片为 NumPy 数组，Dask/Zarr 数据只计算这一切片。"""
+    return np.asarray(data[z])
+
+
+def slice_chunks(shape):
+    """每个 Z 切片一个块（超大切片再按平面分块）。"""
+    return (1,) + tuple(min(size, MAX_CHUNK_EDGE) for size in shape[1:])
+
+
+def create_sparse_labels(shape, dtype=np.uint8, chunks=None):
+    """创建全零的块状标签数组，只有写入非零数据的块才会分配内存。"""
+    return zarr.zeros(
+        shape=tuple(shape),
+        chunks=chunks or slice_chunks(shape),
+        dtype=dtype,
+    )
+
+
+def read_tile(data, z, region):
+    """读取第 z 个切片中 ``region`` = (slice_y, slice_x) 范围内的数据。"""
+    return np.asarray(data[(z,) + tuple(region)])
+
+
+def open_volume(path):
+    """以延迟读取的方式打开磁盘上的体数据。
+
+    ``.npy`` 使用内存映射，``.zarr`` 目录直接打开 Zarr 数组，TIFF 目录或 glob 模式
+    按切片延迟读取，其他格式由 ``skimage.io.imread`` 整体读入。
+    """
+    path = os.fspath(path)
+    if is_tiff_stack_path(path):
+        return read_tiff_stack(path)
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    if path.rstrip("/\\").endswith(".zarr"):
+        return zarr.open(path, mode="r")
+    from skimage.io import imread
+
+    return imread(path)
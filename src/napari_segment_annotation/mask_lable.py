@@ -1,34 +1,28 @@
 import napari
-import requests
 import numpy as np
 from napari.layers import Labels
 from napari_plugin_engine import napari_hook_implementation
 from qtpy.QtWidgets import QLabel, QVBoxLayout, QWidget, QComboBox, QPushButton
 
-# Fetch label data from API and create id -> safe_name mapping
-def fetch_label_data(template="ccfv3"):
-    url = f"https://smart.siat.ac.cn/api/v1/atlas-structures/?format=json&template={template}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        # Check if 'id' is a digit string and ignore empty or invalid 'id'
-        return {int(item["id"]): item["safe_name"] for item in data if item["id"].isdigit()}
-    else:
-        print("Failed to fetch label data")
-        return {}
+# Label tables come from the shared atlas registry (memory + on-disk cache),
+# loaded in a background thread so the widget opens without waiting for the API
+from .atlas_loader import AtlasLoader
+from .atlas_registry import TEMPLATES
+
 
 class MaskLabelViewer(QWidget):
     def __init__(self, viewer: napari.Viewer):
         super().__init__()
         self.viewer = viewer
         self.template = "ccfv3"  # Default template
-        self.ID_TO_SAFE_NAME = fetch_label_data(self.template)  # Initial label data
+        self.ID_TO_SAFE_NAME = {}  # Filled in once the label data has loaded
+        self.atlas_loader = AtlasLoader(self.on_atlas_loaded, self.on_atlas_failed)
 
         self.label_display = QLabel("Click 'Activate' and select a mask area to view label name")
 
         # Template selector
         self.template_selector = QComboBox()
-        self.template_selector.addItems(["ccfv3", "civm_rhesus", "visor"])
+        self.template_selector.addItems(TEMPLATES)
         self.template_selector.currentIndexChanged.connect(self.update_template)
 
         # Layer selector
@@ -52,11 +46,27 @@ class MaskLabelViewer(QWidget):
         self.selected_layer = None
         self.is_active = False
 
+        # Initial label data
+        self.load_template()
+
     # Update template
     def update_template(self):
         self.template = self.template_selector.currentText()
-        self.ID_TO_SAFE_NAME = fetch_label_data(self.template)  # Update label data
-        self.label_display.setText(f"Template switched to {self.template}")
+        self.load_template()
+
+    # Request the label data of the current template, stale requests are dropped
+    def load_template(self):
+        self.ID_TO_SAFE_NAME = {}
+        if not self.atlas_loader.load(self.template):
+            self.label_display.setText(f"Loading {self.template} label names...")
+
+    def on_atlas_loaded(self, template, table):
+        self.ID_TO_SAFE_NAME = table.names_by_id
+        self.label_display.setText(f"Template switched to {template} ({len(table)} labels)")
+
+    def on_atlas_failed(self, template, message):
+        self.label_display.setText(f"Failed to load {template} label names")
+        print(f"Failed to fetch label data: {message}")
 
     # Update layer list
     def update_layer_list(self):
@@ -87,7 +97,10 @@ class MaskLabelViewer(QWidget):
             mask_value = layer.data[position[:layer.ndim]]
                 
             # Get the label name
-            label_name = self.ID_TO_SAFE_NAME.get(mask_value, "Unknown label")
+            if self.atlas_loader.loading and not self.ID_TO_SAFE_NAME:
+                label_name = "Label names still loading"
+            else:
+                label_name = self.ID_TO_SAFE_NAME.get(int(mask_value), "Unknown label")
             self.label_display.setText(f"Mask value: {mask_value}, Label name: {label_name}")
             print(f"Picked mask value: {mask_value}, mapped to label name: {label_name}")
             self.is_active = False  # Deactivate after clicking
@@ -0,0 +1,248 @@
+"""
+分块并行的 mask 合并。
+
+按与基础 mask 存储对齐的块遍历体数据，每块读入所有来源后按各自的优先级、合并方式和
+标签重映射依次合并（基本语义为 ``np.copyto(base, overlay, where=overlay != 0)``），
+块在线程池中并行处理，N 个来源只需遍历一次，峰值内存与块数量无关。NumPy 和 Zarr 的
+基础 mask 原地写入（只写回有变化的块），Dask 的基础 mask 不可写，返回延迟计算的合并结果。
+"""
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+import dask.array as da
+import numpy as np
+import zarr
+
+from .labels_store import chunk_region, labels_chunks
+from .zarr_io import DEFAULT_CHUNK_EDGE
+
+
+def array_chunks(data, chunk_edge=DEFAULT_CHUNK_EDGE):
+    """数据自身的块形状；NumPy 数组按每切片、平面内 ``chunk_edge`` 分块。"""
+    if isinstance(data, da.Array):
+        return data.chunksize
+    if isinstance(data, zarr.Array):
+        return data.chunks
+    return labels_chunks(data.shape, chunk_edge)
+
+
+def iter_chunk_regions(shape, chunks):
+    """按 C 顺序产出覆盖整个数组的各块范围。"""
+    counts = [-(-size // chunk) for size, chunk in zip(shape, chunks)]
+    for index in itertools.product(*(range(count) for count in counts)):
+        yield chunk_region(index, chunks, shape)
+
+
+def read_block(data, region):
+    """读取一块为 NumPy 数组；Dask 数组在当前线程同步计算，避免与线程池嵌套。"""
+    if isinstance(data, da.Array):
+        return data[region].compute(scheduler="synchronous")
+    return np.asarray(data[region])
+
+
+def merge_grid(base, *sources, chunk_edge=DEFAULT_CHUNK_EDGE):
+    """合并时遍历的块形状：优先对齐基础 mask 的存储块，保证并行写入不落在同一块上。"""
+    for data in (base,) + sources:
+        if isinstance(data, (da.Array, zarr.Array)):
+            return array_chunks(data)
+    return labels_chunks(base.shape, chunk_edge)
+
+
+def map_regions(function, regions, max_workers):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(function, regions))
+
+
+def value_range(data, regions, max_workers=None):
+    """分块统计 ``data`` 中非零值的 (最小值, 最大值)，全为零时返回 None。"""
+
+    def block_range(region):
+        block = read_block(data, region)
+        block = block[block != 0]
+        return (int(block.min()), int(block.max())) if block.size else None
+
+    ranges = [r for r in map_regions(block_range, regions, max_workers) if r is not None]
+    if not ranges:
+        return None
+    return min(r[0] for r in ranges), max(r[1] for r in ranges)
+
+
+def _check_integer(data):
+    if not np.issubdtype(data.dtype, np.integer):
+        raise ValueError(f"mask 必须是整数类型，得到 {data.dtype}")
+
+
+def _check_range(low, high, dtype, what):
+    info = np.iinfo(dtype)
+    if low < info.min or high > info.max:
+        raise ValueError(
+            f"{what}的取值范围 [{low}, {high}] 超出基础 mask 类型 {dtype} 的范围，"
+            "请先转换基础 mask 的类型"
+        )
+
+
+OVERWRITE = "overwrite"
+FILL_BACKGROUND = "fill-only-background"
+KEEP_BASE = "keep-base-on-conflict"
+MERGE_MODES = (OVERWRITE, FILL_BACKGROUND, KEEP_BASE)
+
+
+class MergeSource(NamedTuple):
+    """参与合并的一个 mask。
+
+    ``mode`` 决定非零体素何时写入：``overwrite`` 总是覆盖；``fill-only-background``
+    只写入当前结果（基础 mask 及之前合并的来源）为背景的体素；``keep-base-on-conflict``
+    只在基础 mask 为背景处写入，但可以覆盖之前合并的来源。
+
+    写入前先重映射标签：有 ``lut`` 时非零标签 ``v`` 变为 ``lut[v]``，再给非零结果加上
+    ``offset``，用于避免不同来源之间的标签冲突。背景 0 始终保持为 0。
+    """
+
+    data: object
+    mode: str = OVERWRITE
+    priority: int = 0
+    offset: int = 0
+    lut: Optional[np.ndarray] = None
+
+
+def remap_block(block, source):
+    """按 ``source`` 的查找表和偏移量重映射一块标签。"""
+    if source.lut is None and not source.offset:
+        return block
+    mapped = np.asarray(source.lut)[block] if source.lut is not None else block
+    mapped = mapped.astype(np.int64)
+    return np.where((block != 0) & (mapped != 0), mapped + source.offset, 0)
+
+
+def mapping_lut(mapping, high):
+    """由 ``{旧标签: 新标签}`` 构建覆盖标签 ``0..high`` 的查找表，未列出的标签保持不变。"""
+    if any(old < 0 for old in mapping):
+        raise ValueError("查找表只能映射非负标签")
+    lut = np.arange(high + 1, dtype=np.int64)
+    for old, new in mapping.items():
+        if old <= high:
+            lut[old] = new
+    return lut
+
+
+def check_source(base, source, regions=None, max_workers=None):
+    """检查一个来源重映射后的值能否无损写入 ``base`` 的类型，不能时抛出 ValueError。"""
+    _check_integer(base)
+    _check_integer(source.data)
+    if source.mode not in MERGE_MODES:
+        raise ValueError(f"未知的合并方式 {source.mode!r}，可选 {MERGE_MODES}")
+    data = source.data
+    if source.lut is None and not source.offset and np.can_cast(data.dtype, base.dtype, casting="safe"):
+        return
+    if regions is None:
+        regions = list(iter_chunk_regions(data.shape, merge_grid(base, data)))
+    found = value_range(data, regions, max_workers)
+    if found is None:
+        return
+    low, high = found
+    if source.lut is not None:
+        lut = np.asarray(source.lut)
+        if low < 0 or high >= len(lut):
+            raise ValueError(f"查找表长度 {len(lut)} 不覆盖标签范围 [{low}, {high}]")
+        mapped = lut[low:high + 1]
+        mapped = mapped[mapped != 0]
+        if not mapped.size:
+            return
+        low, high = int(mapped.min()), int(mapped.max())
+    _check_range(low + source.offset, high + source.offset, base.dtype, "合并来源")
+
+
+def check_merge_dtypes(base, overlay, regions=None, max_workers=None):
+    """检查叠加 mask 的值能否无损写入基础 mask 的类型，不能时抛出 ValueError。
+
+    类型可以安全转换时不读数据；否则（如 int64 叠加到 uint16）分块统计叠加 mask 的
+    取值范围，实际取值都能表示时允许合并。
+    """
+    check_source(base, MergeSource(overlay), regions, max_workers)
+
+
+def merge_block(base_block, source_blocks, sources, order):
+    """合并一块，返回 (合并结果, 各来源的冲突体素数)。
+
+    冲突体素指来源的非零体素处已有不同的非零标签，无论最终保留哪一个。
+    ``order`` 为来源的处理顺序。
+    """
+    result = base_block.copy()
+    conflicts = np.zeros(len(sources), dtype=np.int64)
+    for i in order:
+        source = remap_block(source_blocks[i], sources[i])
+        present = source != 0
+        if not present.any():
+            continue
+        reference = base_block if sources[i].mode == KEEP_BASE else result
+        occupied = present & (reference != 0)
+        conflicts[i] = np.count_nonzero(occupied & (reference != source))
+        write = present if sources[i].mode == OVERWRITE else present & ~occupied
+        np.copyto(result, source, where=write, casting="unsafe")
+    return result, conflicts
+
+
+def merge_sources(base, sources, chunk_edge=DEFAULT_CHUNK_EDGE, max_workers=None):
+    """一次遍历把多个 mask 合并到 ``base``，返回 (合并结果, 有变化的块范围列表, 冲突数)。
+
+    Parameters
+    ----------
+    base : array-like
+        整数 NumPy、Dask 或 Zarr 数组。
+    sources : sequence of MergeSource
+        按 ``priority`` 从低到高依次合并（相同优先级保持给定顺序），优先级高的
+        ``overwrite`` 来源覆盖优先级低的来源。
+    max_workers : int, optional
+        并行处理的线程数，默认由 `ThreadPoolExecutor` 决定。
+
+    Returns
+    -------
+    merged : array-like
+        NumPy 和 Zarr 的 ``base`` 被原地修改并原样返回；Dask 的 ``base`` 返回新的
+        延迟数组，此时变化范围和冲突数未知，均为 None。
+    changed : list of tuple of slice or None
+    conflicts : list of int or None
+        与 ``sources`` 一一对应的冲突体素数，见 `merge_block`。
+    """
+    sources = [s if isinstance(s, MergeSource) else MergeSource(s) for s in sources]
+    for source in sources:
+        if source.data.shape != base.shape:
+            raise ValueError(f"mask 形状不一致：{base.shape} 与 {source.data.shape}")
+    regions = list(iter_chunk_regions(base.shape, merge_grid(base, *(s.data for s in sources), chunk_edge=chunk_edge)))
+    for source in sources:
+        check_source(base, source, regions, max_workers)
+    order = sorted(range(len(sources)), key=lambda i: sources[i].priority)
+
+    if isinstance(base, da.Array):
+        blocks = [da.asarray(s.data).rechunk(base.chunks) for s in sources]
+        merged = da.map_blocks(
+            lambda base_block, *source_blocks: merge_block(base_block, source_blocks, sources, order)[0],
+            base,
+            *blocks,
+            dtype=base.dtype,
+        )
+        return merged, None, None
+
+    def merge_region(region):
+        base_block = np.asarray(base[region])
+        result, conflicts = merge_block(base_block, [read_block(s.data, region) for s in sources], sources, order)
+        if np.array_equal(result, base_block):
+            return None, conflicts
+        base[region] = result
+        return region, conflicts
+
+    outcomes = map_regions(merge_region, regions, max_workers)
+    changed = [region for region, _ in outcomes if region is not None]
+    conflicts = np.sum([c for _, c in outcomes], axis=0) if outcomes else np.zeros(len(sources), np.int64)
+    return base, changed, [int(c) for c in conflicts]
+
+
+def merge_labels(base, overlay, chunk_edge=DEFAULT_CHUNK_EDGE, max_workers=None):
+    """把 ``overlay`` 的非零体素合并到 ``base``，返回 (合并结果, 有变化的块范围列表)。
+
+    即单个 ``overwrite`` 来源的 `merge_sources`；NumPy 和 Zarr 的 ``base`` 被原地修改，
+    Dask 的 ``base`` 返回延迟数组，变化范围为 None。
+    """
+    merged, changed, _ = merge_sources(base, [MergeSource(overlay)], chunk_edge, max_workers)
+    return merged, changed
@@ -6,30 +6,57 @@ from napari.layers import Labels
 from pathlib import Path
 from skimage.io import imread
 
+from .labels_store import mark_layer_region
+from .mask_merge import merge_labels
+
+
+def refresh_regions(layer, regions):
+    """只在修改范围与当前显示的切片相交时重新切片显示。
+
+    当前切片位置来自 napari 的内部方法，该方法不存在时（napari 改变了内部实现）总是刷新。
+    """
+    try:
+        point = layer._get_pt_not_disp()
+    except AttributeError:
+        layer.refresh()
+        return
+    for region in regions:
+        if all(region[axis].start <= index < region[axis].stop for axis, index in point.items()):
+            layer.refresh()
+            return
+
 @magic_factory(call_button="Merge Masks", viewer={'bind': 'viewer'})  # 绑定 viewer 参数
 def merge_masks(viewer, base_mask_layer: Labels, overlay_mask_layer: Labels) -> None:
-    """将叠加mask中的非零区域覆盖到基础mask中。"""
+    """将叠加mask中的非零区域覆盖到基础mask中。
+
+    按块并行合并，支持 NumPy、Dask 和 Zarr 数据，只写回和刷新有变化的块。
+    """
     if base_mask_layer is None or overlay_mask_layer is None:
         print("Please select both base mask and overlay mask layers.")
         return
+    if base_mask_layer.multiscale or overlay_mask_layer.multiscale:
+        print("Multiscale masks are not supported.")
+        return
 
-    # 获取两个 mask 的数据
     base_mask_data = base_mask_layer.data
-    overlay_mask_data = overlay_mask_layer.data
 
-    # 确保两个 mask 的形状一致
-    if base_mask_data.shape != overlay_mask_data.shape:
-        print("Masks have different shapes!")
+    # 合并两个 mask：非零区域覆盖，形状或类型不兼容时不做修改
+    try:
+        merged, changed = merge_labels(base_mask_data, overlay_mask_layer.data)
+    except ValueError as e:
+        print(f"Error merging masks: {e}")
         return
 
-    # 合并两个 mask：非零区域覆盖
-    base_mask_data[overlay_mask_data != 0] = overlay_mask_data[overlay_mask_data != 0]
-
-    # 将合并后的数据赋回基础mask图层
-    base_mask_layer.data = base_mask_data
+    if merged is not base_mask_data:
+        # Dask 数据不可原地修改，替换为延迟计算的合并结果
+        base_mask_layer.data = merged
+        return
 
-    # 强制刷新显示
-    base_mask_layer.refresh()  # 强制刷新显示以更新图层
+    # 通知增量保存和编辑日志，并只在当前切片受影响时刷新显示
+    for region in changed:
+        mark_layer_region(base_mask_layer, region)
+    refresh_regions(base_mask_layer, changed)
+    print(f"Merged masks, {len(changed)} chunks changed")
 
 # 注册插件面板，返回插件而非按钮
 @napari_hook_implementation
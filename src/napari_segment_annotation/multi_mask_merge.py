@@ -0,0 +1,224 @@
+import napari
+from napari.layers import Labels
+from napari_plugin_engine import napari_hook_implementation
+from qtpy.QtCore import Qt
+from qtpy.QtWidgets import (
+    QComboBox,
+    QLabel,
+    QLineEdit,
+    QPushButton,
+    QSpinBox,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+
+from .label_remap import parse_mapping_spec
+from .labels_store import mark_layer_region
+from .mask_merge import (
+    MERGE_MODES,
+    MergeSource,
+    iter_chunk_regions,
+    mapping_lut,
+    merge_grid,
+    merge_sources,
+    value_range,
+)
+from .merge_masks import refresh_regions
+
+# 表格列
+LAYER_COLUMN, MODE_COLUMN, PRIORITY_COLUMN, OFFSET_COLUMN, LUT_COLUMN = range(5)
+
+
+class MultiMaskMerger(QWidget):
+    """一次遍历把多个标签层合并到基础层，每层可设置合并方式、优先级、标签偏移和标签映射。"""
+
+    def __init__(self, viewer: napari.Viewer):
+        super().__init__()
+        self.viewer = viewer
+
+        self.status_label = QLabel("Select a base layer and the layers to merge into it")
+
+        # 基础图层选择器
+        self.base_selector = QComboBox()
+        self.base_selector.currentTextChanged.connect(self.update_layer_table)
+
+        # 参与合并的图层：勾选、合并方式、优先级、标签偏移、标签映射（如 "3:1, 4:1"）
+        self.layer_table = QTableWidget(0, 5)
+        self.layer_table.setHorizontalHeaderLabels(["Layer", "Mode", "Priority", "Offset", "Remap"])
+        self.layer_table.verticalHeader().setVisible(False)
+
+        self.offset_button = QPushButton("Auto Offset")
+        self.offset_button.clicked.connect(self.auto_offset)
+        self.merge_button = QPushButton("Merge Masks")
+        self.merge_button.clicked.connect(self.merge)
+        self.refresh_button = QPushButton("Refresh Layers")
+        self.refresh_button.clicked.connect(self.update_layer_list)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.status_label)
+        layout.addWidget(QLabel("Base Mask:"))
+        layout.addWidget(self.base_selector)
+        layout.addWidget(self.layer_table)
+        layout.addWidget(self.offset_button)
+        layout.addWidget(self.merge_button)
+        layout.addWidget(self.refresh_button)
+        self.setLayout(layout)
+
+        self.update_layer_list()
+
+        # 自动更新图层列表
+        self.viewer.layers.events.inserted.connect(self.update_layer_list)
+        self.viewer.layers.events.removed.connect(self.update_layer_list)
+
+    def labels_layers(self):
+        return [layer for layer in self.viewer.layers if isinstance(layer, Labels)]
+
+    def update_layer_list(self):
+        """更新基础图层列表和合并图层表格，仅显示 Labels 图层。"""
+        current = self.base_selector.currentText()
+        self.base_selector.blockSignals(True)
+        self.base_selector.clear()
+        for layer in self.labels_layers():
+            self.base_selector.addItem(layer.name)
+        if current:
+            self.base_selector.setCurrentText(current)
+        self.base_selector.blockSignals(False)
+        self.update_layer_table()
+
+    def update_layer_table(self):
+        base_name = self.base_selector.currentText()
+        names = [layer.name for layer in self.labels_layers() if layer.name != base_name]
+        self.layer_table.setRowCount(len(names))
+        for row, name in enumerate(names):
+            item = QTableWidgetItem(name)
+            item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
+            item.setCheckState(Qt.Unchecked)
+            self.layer_table.setItem(row, LAYER_COLUMN, item)
+
+            mode = QComboBox()
+            mode.addItems(MERGE_MODES)
+            self.layer_table.setCellWidget(row, MODE_COLUMN, mode)
+
+            priority = QSpinBox()
+            priority.setRange(-999, 999)
+            priority.setValue(row)
+            self.layer_table.setCellWidget(row, PRIORITY_COLUMN, priority)
+
+            offset = QSpinBox()
+            offset.setRange(0, 2 ** 31 - 1)
+            self.layer_table.setCellWidget(row, OFFSET_COLUMN, offset)
+
+            remap = QLineEdit()
+            remap.setPlaceholderText("3:1, 4:1")
+            self.layer_table.setCellWidget(row, LUT_COLUMN, remap)
+
+    def selected_rows(self):
+        """勾选的行及对应的图层。"""
+        rows = []
+        for row in range(self.layer_table.rowCount()):
+            item = self.layer_table.item(row, LAYER_COLUMN)
+            if item is not None and item.checkState() == Qt.Checked:
+                rows.append((row, self.viewer.layers[item.text()]))
+        return rows
+
+    def row_lut(self, row, data, regions):
+        """第 ``row`` 行的标签映射编译成的查找表，未填写时返回 None。
+
+        Raises
+        ------
+        ValueError
+            映射无法解析。
+        """
+        text = self.layer_table.cellWidget(row, LUT_COLUMN).text()
+        if not text.strip():
+            return None
+        found = value_range(data, regions)
+        return mapping_lut(parse_mapping_spec(text), found[1] if found else 0)
+
+    def auto_offset(self):
+        """按优先级依次设置偏移量，使各层的标签接在基础层和之前各层的最大标签之后。"""
+        base_name = self.base_selector.currentText()
+        if not base_name:
+            self.status_label.setText("No base layer selected.")
+            return
+        base = self.viewer.layers[base_name].data
+        rows = sorted(
+            self.selected_rows(),
+            key=lambda entry: self.layer_table.cellWidget(entry[0], PRIORITY_COLUMN).value(),
+        )
+        regions = list(iter_chunk_regions(base.shape, merge_grid(base)))
+        found = value_range(base, regions)
+        next_offset = found[1] if found else 0
+        try:
+            for row, layer in rows:
+                self.layer_table.cellWidget(row, OFFSET_COLUMN).setValue(next_offset)
+                lut = self.row_lut(row, layer.data, regions)
+                if lut is not None:
+                    # 映射后的最大标签不超过查找表中的最大值
+                    next_offset += int(lut.max())
+                    continue
+                found = value_range(layer.data, regions)
+                next_offset += found[1] if found else 0
+        except ValueError as e:
+            self.status_label.setText(f"Error: {str(e)}")
+            return
+        self.status_label.setText(f"Offsets set, labels will end at {next_offset}")
+
+    def merge(self):
+        base_name = self.base_selector.currentText()
+        if not base_name:
+            self.status_label.setText("No base layer selected.")
+            return
+        base_layer = self.viewer.layers[base_name]
+        rows = self.selected_rows()
+        if not rows:
+            self.status_label.setText("Check at least one layer to merge.")
+            return
+        if base_layer.multiscale or any(layer.multiscale for _, layer in rows):
+            self.status_label.setText("Multiscale masks are not supported.")
+            return
+
+        base_data = base_layer.data
+        try:
+            sources = [
+                MergeSource(
+                    layer.data,
+                    mode=self.layer_table.cellWidget(row, MODE_COLUMN).currentText(),
+                    priority=self.layer_table.cellWidget(row, PRIORITY_COLUMN).value(),
+                    offset=self.layer_table.cellWidget(row, OFFSET_COLUMN).value(),
+                    lut=self.row_lut(
+                        row,
+                        layer.data,
+                        list(iter_chunk_regions(layer.data.shape, merge_grid(base_data, layer.data))),
+                    ),
+                )
+                for row, layer in rows
+            ]
+            merged, changed, conflicts = merge_sources(base_data, sources)
+        except ValueError as e:
+            self.status_label.setText(f"Error: {str(e)}")
+            print(f"Error merging masks: {e}")
+            return
+
+        if merged is not base_data:
+            # Dask 数据不可原地修改，替换为延迟计算的合并结果，冲突数未知
+            base_layer.data = merged
+            self.status_label.setText(f"Merged {len(sources)} layers lazily into '{base_name}'")
+            return
+
+        for region in changed:
+            mark_layer_region(base_layer, region)
+        refresh_regions(base_layer, changed)
+        report = ", ".join(f"{layer.name}: {count}" for (_, layer), count in zip(rows, conflicts))
+        self.status_label.setText(
+            f"Merged {len(sources)} layers, {len(changed)} chunks changed\nConflict voxels - {report}"
+        )
+        print(f"Merged {len(sources)} layers into '{base_name}', conflict voxels: {report}")
+
+
+# 提供插件小部件
+@napari_hook_implementation
+def napari_experimental_provide_dock_widget(viewer: napari.Viewer) -> QWidget:
+    return MultiMaskMerger(viewer)
@@ -0,0 +1,232 @@
+"""
+无提示的整卷自动分割。
+
+在每个切片上铺设规则的点网格，每个点作为一个单点提示，按大批量送入掩码解码器；
+候选掩码按预测 IoU 和稳定性得分过滤，再以外接框做向量化 NMS 去重。
+相邻切片之间按重叠（IoU）匹配实例，使同一对象在整个体数据中保持同一标签。
+下一个切片的图像编码在后台线程中进行，与当前切片的解码和后处理重叠。
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from torchvision.ops import nms
+
+from .lazy_volume import read_slice
+from .sam_embedding_cache import apply_embedding, slice_to_rgb
+
+DEFAULT_POINTS_PER_SIDE = 32
+# 每批的全分辨率 logits 占 points_per_batch × 3 × H × W × 4 字节，1024² 切片约 768 MB
+DEFAULT_POINTS_PER_BATCH = 64
+
+
+def point_grid(points_per_side, height, width):
+    """切片上均匀分布的 (N, 2) 网格点，坐标为 (X, Y) 顺序，位于各网格单元中心。"""
+    offset = 1 / (2 * points_per_side)
+    side = np.linspace(offset, 1 - offset, points_per_side)
+    xs, ys = np.meshgrid(side * width, side * height)
+    return np.stack([xs.ravel(), ys.ravel()], axis=-1)
+
+
+def stability_score(logits, threshold, offset=1.0):
+    """阈值上下平移 ``offset`` 后两个二值掩码的 IoU，对 (K, H, W) 的 logits 批量计算。"""
+    intersections = (logits > threshold + offset).sum(dim=(-1, -2), dtype=torch.int32)
+    unions = (logits > threshold - offset).sum(dim=(-1, -2), dtype=torch.int32)
+    return intersections / unions.clamp(min=1)
+
+
+def mask_boxes(masks):
+    """(K, H, W) 布尔掩码的 XYXY 外接框，空掩码为 (0, 0, 0, 0)。"""
+    height, width = masks.shape[-2:]
+    rows = masks.any(dim=-1)
+    cols = masks.any(dim=-2)
+    y0 = rows.int().argmax(dim=-1)
+    y1 = height - 1 - rows.flip(-1).int().argmax(dim=-1)
+    x0 = cols.int().argmax(dim=-1)
+    x1 = width - 1 - cols.flip(-1).int().argmax(dim=-1)
+    boxes = torch.stack([x0, y0, x1, y1], dim=-1)
+    return torch.where(rows.any(dim=-1)[:, None], boxes, torch.zeros_like(boxes))
+
+
+def generate_masks(
+    predictor,
+    points_per_side=DEFAULT_POINTS_PER_SIDE,
+    points_per_batch=DEFAULT_POINTS_PER_BATCH,
+    pred_iou_thresh=0.88,
+    stability_thresh=0.95,
+    nms_thresh=0.7,
+    min_area=0,
+):
+    """对 ``predictor`` 当前图像做网格提示的自动分割，返回 (masks, scores)。
+
+    ``masks`` 为 (K, H, W) 的布尔数组，``scores`` 为对应的预测 IoU，按得分从高到低排列。
+    每批候选先在批内做 NMS，只有留下的掩码被保留到 CPU 上，最后再做一次全局 NMS。
+    """
+    height, width = predictor.original_size
+    threshold = predictor.model.mask_threshold
+    points = point_grid(points_per_side, height, width)
+
+    kept_masks, kept_scores, kept_boxes = [], [], []
+    for start in range(0, len(points), points_per_batch):
+        batch = points[start:start + points_per_batch]
+        coords = torch.as_tensor(
+            predictor.transform.apply_coords(batch[:, None], predictor.original_size),
+            dtype=torch.float,
+            device=predictor.device,
+        )
+        labels = torch.ones(coords.shape[:2], dtype=torch.int, device=predictor.device)
+        logits, iou_predictions, _ = predictor.predict_torch(
+            coords, labels, multimask_output=True, return_logits=True
+        )
+        logits = logits.flatten(0, 1)
+        scores = iou_predictions.flatten()
+
+        keep = scores > pred_iou_thresh
+        logits, scores = logits[keep], scores[keep]
+        keep = stability_score(logits, threshold) >= stability_thresh
+        masks, scores = logits[keep] > threshold, scores[keep]
+        del logits
+        keep = masks.sum(dim=(-1, -2)) > max(min_area, 0)
+        masks, scores = masks[keep], scores[keep]
+        if len(masks) == 0:
+            continue
+
+        boxes = mask_boxes(masks).float()
+        keep = nms(boxes, scores.float(), nms_thresh)
+        kept_masks.append(masks[keep].cpu())
+        kept_scores.append(scores[keep].cpu())
+        kept_boxes.append(boxes[keep].cpu())
+
+    if not kept_masks:
+        return np.zeros((0, height, width), dtype=bool), np.zeros(0, dtype=np.float32)
+
+    masks, scores, boxes = torch.cat(kept_masks), torch.cat(kept_scores), torch.cat(kept_boxes)
+    keep = nms(boxes, scores.float(), nms_thresh)  # nms 按得分降序返回
+    return masks[keep].numpy(), scores[keep].numpy()
+
+
+def paint_masks(masks, dtype=np.uint32):
+    """将按得分降序排列的掩码绘制为标签图 1..K，重叠像素归属得分较高的掩码。"""
+    label_map = np.zeros(masks.shape[1:], dtype=dtype)
+    for index in range(len(masks) - 1, -1, -1):
+        label_map[masks[index]] = index + 1
+    return label_map
+
+
+def match_labels(previous, current, next_id, min_iou=0.3):
+    """按与上一切片的 IoU 为 ``current`` 的实例分配体数据中的标签。
+
+    每个上一切片的标签最多匹配一个当前实例，按 IoU 从高到低贪心匹配；
+    未匹配（IoU 低于 ``min_iou``）的实例获得从 ``next_id`` 开始的新标签。
+    返回 (重新编号的标签图, 下一个可用标签)。
+    """
+    current_ids, current_index = np.unique(current, return_inverse=True)
+    current_index = current_index.reshape(current.shape)
+    has_background = current_ids[0] == 0
+    n_current = len(current_ids)
+
+    if previous is None or not previous.any():
+        previous_ids = np.zeros(1, dtype=current.dtype)
+        previous_index = np.zeros(current.shape, dtype=np.intp)
+    else:
+        previous_ids, previous_index = np.unique(previous, return_inverse=True)
+        previous_index = previous_index.reshape(previous.shape)
+    n_previous = len(previous_ids)
+
+    # 两两重叠面积的列联表，一次 bincount 完成
+    overlap = np.bincount(
+        (previous_index * n_current + current_index).ravel(),
+        minlength=n_previous * n_current,
+    ).reshape(n_previous, n_current)
+    previous_area = overlap.sum(axis=1)
+    current_area = overlap.sum(axis=0)
+    iou = overlap / np.maximum(previous_area[:, None] + current_area[None, :] - overlap, 1)
+    if previous_ids[0] == 0:
+        iou[0] = 0
+    if has_background:
+        iou[:, 0] = 0
+
+    new_ids = np.zeros(n_current, dtype=np.int64)
+    used_previous = np.zeros(n_previous, dtype=bool)
+    assigned = np.zeros(n_current, dtype=bool)
+    if has_background:
+        assigned[0] = True
+    pairs = np.argwhere(iou >= max(min_iou, np.finfo(float).tiny))
+    for p, c in pairs[np.argsort(-iou[pairs[:, 0], pairs[:, 1]], kind="stable")]:
+        if used_previous[p] or assigned[c]:
+            continue
+        used_previous[p] = assigned[c] = True
+        new_ids[c] = previous_ids[p]
+
+    unmatched = np.flatnonzero(~assigned)
+    new_ids[unmatched] = np.arange(next_id, next_id + len(unmatched))
+    dtype = np.result_type(current.dtype, np.min_scalar_type(next_id + len(unmatched)))
+    return new_ids.astype(dtype)[current_index], next_id + len(unmatched)
+
+
+def auto_segment_volume(
+    predictor,
+    image,
+    embedding_cache,
+    model_key,
+    image_id,
+    z_indices=None,
+    points_per_side=DEFAULT_POINTS_PER_SIDE,
+    points_per_batch=DEFAULT_POINTS_PER_BATCH,
+    pred_iou_thresh=0.88,
+    stability_thresh=0.95,
+    nms_thresh=0.7,
+    min_area=0,
+    min_iou=0.3,
+    prefetch=2,
+):
+    """逐切片自动分割体数据，每完成一个切片产出 (z, label_map)。
+
+    Parameters
+    ----------
+    z_indices : sequence of int, optional
+        要分割的切片，默认全部切片，按给定顺序处理。
+    points_per_side, points_per_batch : int
+        每边的网格点数，以及每次送入解码器的点数。
+    pred_iou_thresh, stability_thresh, nms_thresh, min_area :
+        候选掩码的过滤条件，见 `generate_masks`。
+    min_iou : float
+        相邻切片实例匹配所需的最小 IoU，低于该值的实例获得新标签。
+    prefetch : int
+        提前在后台编码的切片数。
+    """
+    targets = list(range(image.shape[0]) if z_indices is None else z_indices)
+
+    def encode(z):
+        slice_image = read_slice(image, z)
+        key = embedding_cache.make_key(model_key, image_id, z, slice_image)
+        return embedding_cache.get_or_compute(key, predictor, slice_to_rgb(slice_image))
+
+    prefetch = max(int(prefetch), 1)
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sam-auto")
+    try:
+        queue = deque(executor.submit(encode, z) for z in targets[:prefetch])
+        previous, previous_z, next_id = None, None, 1
+        for offset, z in enumerate(targets):
+            embedding = queue.popleft().result()
+            if offset + prefetch < len(targets):
+                queue.append(executor.submit(encode, targets[offset + prefetch]))
+            apply_embedding(predictor, embedding)
+
+            masks, _ = generate_masks(
+                predictor,
+                points_per_side=points_per_side,
+                points_per_batch=points_per_batch,
+                pred_iou_thresh=pred_iou_thresh,
+                stability_thresh=stability_thresh,
+                nms_thresh=nms_thresh,
+                min_area=min_area,
+            )
+            # 只与紧邻的上一切片匹配，跳过的切片之间不延续标签
+            adjacent = previous if previous_z is not None and abs(z - previous_z) == 1 else None
+            label_map, next_id = match_labels(adjacent, paint_masks(masks), next_id, min_iou)
+            yield z, label_map
+            previous, previous_z = label_map, z
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
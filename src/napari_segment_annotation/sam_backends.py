@@ -0,0 +1,333 @@
+"""
+SAM 推理后端。
+
+没有 GPU 的工作站上，fp32 PyTorch 图像编码器是分割的主要耗时。这里提供可替换的后端：
+
+- ``pytorch``：原始 PyTorch 模型；
+- ``pytorch-int8``：图像编码器的全连接层做动态 int8 量化（仅 CPU）；
+- ``onnx``：编码器和掩码解码器导出为 ONNX，由 ONNX Runtime 运行；
+- ``onnx-int8``：在 ``onnx`` 基础上对编码器做动态 int8 量化。
+
+ONNX 后端的预测器实现了 `SamPredictor` 的同名接口（``set_image``、``predict_torch``、
+``features`` 等），编码缓存、批量解码和分块推理无需区分后端。
+导出的 ONNX 文件按检查点缓存在磁盘上，只在第一次使用时导出。
+"""
+import hashlib
+import inspect
+import json
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from segment_anything import SamPredictor, sam_model_registry
+from segment_anything.utils.transforms import ResizeLongestSide
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+BACKENDS = ("pytorch", "pytorch-int8", "onnx", "onnx-int8")
+
+ONNX_OPSET = 17
+
+DEFAULT_EXPORT_DIR = os.path.expanduser("~/.cache/segment_anything/onnx")
+
+# torch>=2.5 默认使用 dynamo 导出，SAM 的编码器需要旧的 TorchScript 导出路径
+_EXPORT_KWARGS = (
+    {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+)
+
+
+def is_onnx_backend(backend):
+    return backend.startswith("onnx")
+
+
+def check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"不支持的推理后端：{backend}，可选 {', '.join(BACKENDS)}")
+    if is_onnx_backend(backend) and onnxruntime is None:
+        raise ImportError("ONNX 后端需要安装 onnxruntime：pip install onnxruntime onnx")
+
+
+def quantize_encoder(sam):
+    """将图像编码器的全连接层替换为动态 int8 量化版本（就地修改，仅 CPU）。"""
+    sam.image_encoder = torch.ao.quantization.quantize_dynamic(
+        sam.image_encoder, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return sam
+
+
+class _EncoderForExport(torch.nn.Module):
+    """只包含图像编码器，输入为已归一化并补齐到 ``img_size`` 的 (1, 3, S, S) 图像。"""
+
+    def __init__(self, sam):
+        super().__init__()
+        self.image_encoder = sam.image_encoder
+
+    def forward(self, image):
+        return self.image_encoder(image)
+
+
+class _DecoderForExport(torch.nn.Module):
+    """提示编码器 + 掩码解码器，输出低分辨率掩码。
+
+    `SamOnnxModel` 的上采样在导出时会把输入尺寸固化为常量，这里不导出上采样，
+    由预测器按原图尺寸另行完成，与 ``Sam.postprocess_masks`` 一致。
+    """
+
+    def __init__(self, sam):
+        super().__init__()
+        from segment_anything.utils.onnx import SamOnnxModel
+
+        self.onnx_model = SamOnnxModel(sam, return_single_mask=False)
+
+    def forward(self, image_embeddings, point_coords, point_labels, mask_input, has_mask_input):
+        model = self.onnx_model
+        sparse_embedding = model._embed_points(point_coords, point_labels)
+        dense_embedding = model._embed_masks(mask_input, has_mask_input)
+        return model.mask_decoder.predict_masks(
+            image_embeddings=image_embeddings,
+            image_pe=model.model.prompt_encoder.get_dense_pe(),
+            sparse_prompt_embeddings=sparse_embedding,
+            dense_prompt_embeddings=dense_embedding,
+        )
+
+
+def onnx_paths(export_dir, checkpoint_path, model_type):
+    """导出文件路径 (encoder, encoder_int8, decoder, meta)，按检查点路径和修改时间区分。"""
+    path = os.path.abspath(checkpoint_path)
+    text = f"{model_type}|{path}|{os.path.getmtime(path)}"
+    prefix = os.path.join(
+        export_dir, f"{model_type}_{hashlib.blake2b(text.encode(), digest_size=8).hexdigest()}"
+    )
+    return (
+        prefix + "_encoder.onnx",
+        prefix + "_encoder_int8.onnx",
+        prefix + "_decoder.onnx",
+        prefix + ".json",
+    )
+
+
+def export_onnx(sam, encoder_path, decoder_path, meta_path):
+    """将 SAM 的图像编码器和掩码解码器（含提示编码器）导出为两个 ONNX 文件。"""
+    os.makedirs(os.path.dirname(encoder_path), exist_ok=True)
+    img_size = sam.image_encoder.img_size
+    with torch.no_grad():
+        torch.onnx.export(
+            _EncoderForExport(sam),
+            torch.zeros(1, 3, img_size, img_size),
+            encoder_path,
+            input_names=["image"],
+            output_names=["image_embeddings"],
+            opset_version=ONNX_OPSET,
+            **_EXPORT_KWARGS,
+        )
+
+        # 解码器返回全部掩码 token，由预测器按 multimask_output 选择，与 SamPredictor 一致
+        embed_dim = sam.prompt_encoder.embed_dim
+        embed_size = sam.prompt_encoder.image_embedding_size
+        mask_size = [4 * x for x in embed_size]
+        inputs = {
+            "image_embeddings": torch.zeros(1, embed_dim, *embed_size),
+            "point_coords": torch.randint(0, img_size, (2, 3, 2), dtype=torch.float),
+            "point_labels": torch.randint(0, 4, (2, 3), dtype=torch.float),
+            "mask_input": torch.zeros(1, 1, *mask_size),
+            "has_mask_input": torch.tensor([0.0]),
+        }
+        torch.onnx.export(
+            _DecoderForExport(sam),
+            tuple(inputs.values()),
+            decoder_path,
+            input_names=list(inputs),
+            output_names=["low_res_masks", "iou_predictions"],
+            dynamic_axes={
+                "point_coords": {0: "num_objects", 1: "num_points"},
+                "point_labels": {0: "num_objects", 1: "num_points"},
+                "low_res_masks": {0: "num_objects"},
+                "iou_predictions": {0: "num_objects"},
+            },
+            opset_version=ONNX_OPSET,
+            **_EXPORT_KWARGS,
+        )
+
+    with open(meta_path, "w") as f:
+        json.dump(
+            {
+                "img_size": img_size,
+                "mask_threshold": sam.mask_threshold,
+                "pixel_mean": sam.pixel_mean.flatten().tolist(),
+                "pixel_std": sam.pixel_std.flatten().tolist(),
+            },
+            f,
+        )
+
+
+def quantize_onnx(fp32_path, int8_path):
+    """对 ONNX 模型做动态 int8 量化。"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QUInt8)
+
+
+class OnnxSam:
+    """ONNX Runtime 会话形式的 SAM 模型，作为模型缓存中的条目。
+
+    Parameters
+    ----------
+    encoder_path, decoder_path, meta_path : str
+        `export_onnx` 导出的文件。
+    intra_op_threads, inter_op_threads : int
+        ONNX Runtime 的算子内/算子间线程数，0 表示由 ONNX Runtime 决定。
+    """
+
+    def __init__(self, encoder_path, decoder_path, meta_path, intra_op_threads=0, inter_op_threads=0):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.img_size = meta["img_size"]
+        self.mask_threshold = meta["mask_threshold"]
+        self.pixel_mean = np.array(meta["pixel_mean"], dtype=np.float32)
+        self.pixel_std = np.array(meta["pixel_std"], dtype=np.float32)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        providers = ["CPUExecutionProvider"]
+        self.encoder = onnxruntime.InferenceSession(encoder_path, options, providers=providers)
+        self.decoder = onnxruntime.InferenceSession(decoder_path, options, providers=providers)
+        self.nbytes = os.path.getsize(encoder_path) + os.path.getsize(decoder_path)
+
+
+class OnnxSamPredictor:
+    """与 `SamPredictor` 接口一致、由 ONNX Runtime 运行的预测器。"""
+
+    def __init__(self, model):
+        self.model = model
+        self.device = torch.device("cpu")
+        self.transform = ResizeLongestSide(model.img_size)
+        self.reset_image()
+
+    def reset_image(self):
+        self.is_image_set = False
+        self.features = None
+        self.original_size = None
+        self.input_size = None
+
+    def set_image(self, image, image_format="RGB"):
+        """运行图像编码器。``image`` 为 (H, W, 3) 的 uint8 RGB 图像。"""
+        if image_format != "RGB":
+            image = image[..., ::-1]
+        input_image = self.transform.apply_image(image)
+        height, width = input_image.shape[:2]
+        x = (input_image.astype(np.float32) - self.model.pixel_mean) / self.model.pixel_std
+        padded = np.zeros((self.model.img_size, self.model.img_size, 3), dtype=np.float32)
+        padded[:height, :width] = x
+        features = self.model.encoder.run(None, {"image": padded.transpose(2, 0, 1)[None]})[0]
+
+        self.reset_image()
+        self.features = torch.from_numpy(features)
+        self.original_size = tuple(image.shape[:2])
+        self.input_size = (height, width)
+        self.is_image_set = True
+
+    def predict_torch(
+        self,
+        point_coords,
+        point_labels,
+        boxes=None,
+        mask_input=None,
+        multimask_output=True,
+        return_logits=False,
+    ):
+        """与 `SamPredictor.predict_torch` 相同，提示坐标已经过 ``transform`` 变换。"""
+        if not self.is_image_set:
+            raise RuntimeError("An image must be set with .set_image(...) before mask prediction.")
+
+        coords = None if point_coords is None else point_coords.cpu().numpy().astype(np.float32)
+        labels = None if point_labels is None else point_labels.cpu().numpy().astype(np.float32)
+        if boxes is not None:
+            # ONNX 模型中框以两个角点（标签 2、3）表示
+            corners = boxes.cpu().numpy().astype(np.float32).reshape(-1, 2, 2)
+            corner_labels = np.tile(np.array([[2, 3]], dtype=np.float32), (len(corners), 1))
+            coords = corners if coords is None else np.concatenate([coords, corners], axis=1)
+            labels = corner_labels if labels is None else np.concatenate([labels, corner_labels], axis=1)
+        else:
+            # 没有框时补一个标签为 -1 的点，与 PromptEncoder 的处理一致
+            coords = np.concatenate([coords, np.zeros((len(coords), 1, 2), np.float32)], axis=1)
+            labels = np.concatenate([labels, -np.ones((len(labels), 1), np.float32)], axis=1)
+
+        mask_size = [4 * x for x in self.features.shape[-2:]]
+        if mask_input is None:
+            mask_input = np.zeros((1, 1, *mask_size), dtype=np.float32)
+            has_mask_input = np.zeros(1, dtype=np.float32)
+        else:
+            mask_input = mask_input.cpu().numpy().astype(np.float32)
+            has_mask_input = np.ones(1, dtype=np.float32)
+
+        low_res_masks, iou_predictions = self.model.decoder.run(
+            None,
+            {
+                "image_embeddings": self.features.cpu().numpy(),
+                "point_coords": coords,
+                "point_labels": labels,
+                "mask_input": mask_input,
+                "has_mask_input": has_mask_input,
+            },
+        )
+        selected = slice(1, None) if multimask_output else slice(0, 1)
+        low_res_masks = torch.from_numpy(low_res_masks[:, selected])
+        masks = self.postprocess_masks(low_res_masks)
+        if not return_logits:
+            masks = masks > self.model.mask_threshold
+        return masks, torch.from_numpy(iou_predictions[:, selected]), low_res_masks
+
+    def postprocess_masks(self, masks):
+        """低分辨率掩码上采样到原图尺寸，与 ``Sam.postprocess_masks`` 相同。"""
+        size = self.model.img_size
+        masks = F.interpolate(masks, (size, size), mode="bilinear", align_corners=False)
+        masks = masks[..., : self.input_size[0], : self.input_size[1]]
+        return F.interpolate(masks, self.original_size, mode="bilinear", align_corners=False)
+
+
+def ensure_onnx_export(model_type, checkpoint_path, backend="onnx", export_dir=DEFAULT_EXPORT_DIR):
+    """导出文件不存在时从检查点导出（和量化），返回 (encoder, decoder, meta) 路径。"""
+    check_backend(backend)
+    encoder_path, encoder_int8_path, decoder_path, meta_path = onnx_paths(
+        export_dir, checkpoint_path, model_type
+    )
+    if not all(os.path.exists(p) for p in (encoder_path, decoder_path, meta_path)):
+        print(f"正在导出 ONNX 模型 {model_type}: {export_dir}")
+        sam = sam_model_registry[model_type](checkpoint=checkpoint_path)
+        sam.eval()
+        export_onnx(sam, encoder_path, decoder_path, meta_path)
+        del sam
+    if backend == "onnx-int8":
+        if not os.path.exists(encoder_int8_path):
+            print("正在量化 ONNX 图像编码器 (int8)")
+            quantize_onnx(encoder_path, encoder_int8_path)
+        encoder_path = encoder_int8_path
+    return encoder_path, decoder_path, meta_path
+
+
+def load_onnx_model(
+    model_type,
+    checkpoint_path,
+    backend="onnx",
+    export_dir=DEFAULT_EXPORT_DIR,
+    intra_op_threads=0,
+    inter_op_threads=0,
+):
+    """返回 ONNX 后端的 `OnnxSam`，首次使用时导出模型。"""
+    return OnnxSam(
+        *ensure_onnx_export(model_type, checkpoint_path, backend, export_dir),
+        intra_op_threads=intra_op_threads,
+        inter_op_threads=inter_op_threads,
+    )
+
+
+def create_predictor(model):
+    """为缓存中的模型创建预测器：PyTorch 模型用 `SamPredictor`，ONNX 模型用 `OnnxSamPredictor`。"""
+    if isinstance(model, OnnxSam):
+        return OnnxSamPredictor(model)
+    return SamPredictor(model)
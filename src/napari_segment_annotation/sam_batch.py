@@ -0,0 +1,341 @@
+"""
+无界面的批量 SAM 分割。
+
+读取体数据和提示点文件（CSV/JSON，字段为 z, y, x, label, object_id），
+用进程池并行分割包含提示点的切片，结果写入按切片分块的 Zarr 数组。
+每个工作进程只加载一次模型，并使用各自的 torch 线程数；切片之间互不依赖，
+各进程直接把结果写入自己负责的切片块，不经主进程传递掩码。
+
+``sam-auto`` 子命令对整个体数据做无提示的自动分割（见 `sam_auto`）。
+
+命令行用法::
+
+    napari-segment-annotation sam-batch volume.npy prompts.csv output.zarr --workers 4 --threads 2
+    napari-segment-annotation sam-auto volume.npy output.zarr --threads 8
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import torch
+import zarr
+
+from .lazy_volume import open_volume, slice_chunks
+from .sam_auto import (
+    DEFAULT_POINTS_PER_BATCH,
+    DEFAULT_POINTS_PER_SIDE,
+    auto_segment_volume,
+)
+from .sam_backends import BACKENDS, ensure_onnx_export, is_onnx_backend
+from .sam_embedding_cache import EmbeddingCache, get_embedding_cache
+from .sam_inference import label_dtype, segment_prompted_slices
+from .sam_model_cache import (
+    MODEL_URLS,
+    get_model_cache,
+    load_predictor,
+    resolve_checkpoint,
+)
+from .sam_tiling import DEFAULT_TILE_OVERLAP, segment_prompted_slices_tiled
+
+PROMPT_FIELDS = ("z", "y", "x", "label", "object_id")
+
+# 每个工作进程的编码缓存只用于同一切片内的多个图块，内存上限不必很大
+WORKER_EMBEDDING_CACHE_BYTES = 256 * 1024**2
+
+# 工作进程中的模型、数据和输出，由 `_init_worker` 设置
+_WORKER = {}
+
+
+def load_prompt_file(path):
+    """读取提示点文件，返回与 `get_prompt_points` 相同的 (point_data, point_labels, object_ids)。
+
+    CSV 需要包含 z, y, x 列，label（默认 1）和 object_id（默认 1）列可选；
+    JSON 为记录列表，或 ``{"points": [...]}``，每条记录包含同名字段。
+    """
+    if str(path).endswith(".json"):
+        with open(path) as f:
+            records = json.load(f)
+        if isinstance(records, dict):
+            records = records["points"]
+    else:
+        with open(path, newline="") as f:
+            records = list(csv.DictReader(f))
+
+    missing = [name for name in PROMPT_FIELDS[:3] if records and name not in records[0]]
+    if not records or missing:
+        raise ValueError(f"提示点文件 {path} 为空或缺少字段：{', '.join(missing)}")
+
+    point_data = np.array([[float(r[name]) for name in PROMPT_FIELDS[:3]] for r in records])
+    point_labels = np.array([int(float(r.get("label", 1))) for r in records], dtype=int)
+    object_ids = np.array([int(float(r.get("object_id", 1))) for r in records], dtype=int)
+    if np.any(object_ids <= 0):
+        raise ValueError("'object_id' 必须为正整数。")
+    return point_data, point_labels, object_ids
+
+
+def create_output(output_path, shape, dtype):
+    """在磁盘上创建全零的输出标签数组，每个切片一个块，已存在时覆盖。"""
+    return zarr.open_array(
+        output_path,
+        mode="w",
+        shape=tuple(shape),
+        chunks=slice_chunks(shape),
+        dtype=dtype,
+        fill_value=0,
+    )
+
+
+def _init_worker(
+    volume_path,
+    output_path,
+    model_type,
+    checkpoint_path,
+    backend,
+    threads,
+    embedding_cache_dir,
+    tile_size,
+    tile_overlap,
+):
+    """工作进程初始化：设置线程数，加载模型，打开输入和输出数组。"""
+    if threads:
+        torch.set_num_threads(threads)
+    get_model_cache().configure(max_models=1, intra_op_threads=threads, inter_op_threads=1)
+    predictor, model_key = load_predictor(model_type, checkpoint_path, backend=backend)
+    _WORKER.update(
+        predictor=predictor,
+        model_key=model_key,
+        image=open_volume(volume_path),
+        image_id=os.path.abspath(volume_path),
+        output=zarr.open_array(output_path, mode="r+"),
+        embedding_cache=EmbeddingCache(WORKER_EMBEDDING_CACHE_BYTES, embedding_cache_dir),
+        tile_size=tile_size,
+        tile_overlap=tile_overlap,
+    )
+
+
+def _segment_slice(z, point_data, point_labels, object_ids):
+    """在工作进程中分割切片 z 并写入输出，返回 (z, 非零像素数, 秒数)。"""
+    start = time.perf_counter()
+    state = _WORKER
+    args = (
+        state["predictor"], state["image"], point_data, point_labels, object_ids,
+        state["embedding_cache"], state["model_key"], state["image_id"],
+    )
+    if state["tile_size"]:
+        blocks = segment_prompted_slices_tiled(
+            *args, tile_size=state["tile_size"], overlap=state["tile_overlap"]
+        )
+    else:
+        blocks = (
+            (z, (slice(None), slice(None)), mask_slice)
+            for z, mask_slice in segment_prompted_slices(*args)
+        )
+
+    nonzero = 0
+    for z, region, block in blocks:
+        # 全零结果不写入，输出数组不为它创建块文件
+        count = int(np.count_nonzero(block))
+        if count:
+            state["output"][(z,) + region] = block
+        nonzero += count
+    return z, nonzero, time.perf_counter() - start
+
+
+def run_batch(
+    volume_path,
+    prompts_path,
+    output_path,
+    model_type="vit_b",
+    checkpoint_path="",
+    backend="pytorch",
+    workers=1,
+    threads=0,
+    embedding_cache_dir="",
+    tile_size=0,
+    tile_overlap=DEFAULT_TILE_OVERLAP,
+):
+    """批量分割 ``volume_path`` 中包含提示点的切片，结果写入 ``output_path``。
+
+    Parameters
+    ----------
+    workers : int
+        工作进程数，每个进程加载一份模型；为 1 时在当前进程中运行。
+    threads : int
+        每个工作进程的 torch（ONNX 后端为 ONNX Runtime）线程数，0 表示使用默认值。
+
+    其余参数与 `sam_segmentation_widget` 的同名参数相同。返回输出的 Zarr 数组。
+    """
+    if tile_size and tile_overlap >= tile_size:
+        raise ValueError("分块重叠必须小于分块大小。")
+    point_data, point_labels, object_ids = load_prompt_file(prompts_path)
+    shape = open_volume(volume_path).shape
+    if len(shape) != 3:
+        raise ValueError(f"图像应为 3D 数据，形状为 (Z, Y, X)，实际为 {shape}")
+
+    dtype = np.result_type(np.uint16, label_dtype(object_ids.max()))
+    output = create_output(output_path, shape, dtype)
+
+    z_indices = np.unique(point_data[:, 0].astype(int))
+    tasks = []
+    for z in z_indices:
+        on_slice = point_data[:, 0].astype(int) == z
+        tasks.append((z, point_data[on_slice], point_labels[on_slice], object_ids[on_slice]))
+    print(f"共 {len(tasks)} 个包含提示点的切片，{workers} 个工作进程")
+
+    # 检查点下载和 ONNX 导出只在主进程中进行一次，避免多个工作进程同时写同一文件
+    checkpoint_path = resolve_checkpoint(model_type, checkpoint_path)
+    if is_onnx_backend(backend):
+        ensure_onnx_export(model_type, checkpoint_path, backend)
+
+    init_args = (
+        volume_path, output_path, model_type, checkpoint_path, backend,
+        threads, embedding_cache_dir, tile_size, tile_overlap,
+    )
+    start = time.perf_counter()
+
+    def report(index, result):
+        z, nonzero, seconds = result
+        elapsed = time.perf_counter() - start
+        print(
+            f"已完成切片 {index}/{len(tasks)} (z={z})，非零像素: {nonzero}，"
+            f"{seconds:.2f} 秒，累计 {elapsed:.1f} 秒"
+        )
+
+    if workers <= 1:
+        _init_worker(*init_args)
+        for index, task in enumerate(tasks, start=1):
+            report(index, _segment_slice(*task))
+        return output
+
+    # spawn 启动的进程不继承父进程的 torch 线程池和 CUDA 状态
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=_init_worker, initargs=init_args
+    ) as executor:
+        futures = [executor.submit(_segment_slice, *task) for task in tasks]
+        for index, future in enumerate(as_completed(futures), start=1):
+            report(index, future.result())
+    return output
+
+
+def run_auto(
+    volume_path,
+    output_path,
+    model_type="vit_b",
+    checkpoint_path="",
+    backend="pytorch",
+    threads=0,
+    embedding_cache_dir="",
+    **options,
+):
+    """自动分割 ``volume_path`` 的所有切片，结果写入 ``output_path``，返回输出的 Zarr 数组。
+
+    相邻切片的实例合并依赖上一切片的结果，切片按顺序处理；编码与解码在
+    `auto_segment_volume` 中重叠。``options`` 传给 `auto_segment_volume`。
+    """
+    image = open_volume(volume_path)
+    if image.ndim != 3:
+        raise ValueError(f"图像应为 3D 数据，形状为 (Z, Y, X)，实际为 {image.shape}")
+    if threads:
+        torch.set_num_threads(threads)
+        get_model_cache().configure(intra_op_threads=threads)
+    predictor, model_key = load_predictor(model_type, checkpoint_path, backend=backend)
+    output = create_output(output_path, image.shape, np.uint32)
+
+    slices = auto_segment_volume(
+        predictor, image, get_embedding_cache(embedding_cache_dir), model_key,
+        os.path.abspath(volume_path), **options,
+    )
+    start = time.perf_counter()
+    for index, (z, label_map) in enumerate(slices, start=1):
+        if label_map.any():
+            output[z] = label_map
+        rate = index * 60 / max(time.perf_counter() - start, 1e-9)
+        print(
+            f"已完成切片 {index}/{image.shape[0]} (z={z})，实例数: {len(np.unique(label_map)) - 1}，"
+            f"{rate:.1f} 切片/分钟"
+        )
+    return output
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="napari-segment-annotation",
+        description="napari-segment-annotation 命令行工具",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser("sam-batch", help="无界面批量 SAM 分割")
+    batch.add_argument("volume", help="3D 体数据 (.npy / .zarr / .tif)")
+    batch.add_argument("prompts", help="提示点文件 (.csv / .json)，字段 z,y,x,label,object_id")
+    batch.add_argument("output", help="输出 Zarr 目录")
+    batch.add_argument("--model-type", default="vit_b", choices=sorted(MODEL_URLS))
+    batch.add_argument("--checkpoint", default="", help="模型检查点，缺省时下载默认检查点")
+    batch.add_argument("--backend", default="pytorch", choices=BACKENDS)
+    batch.add_argument("--workers", type=int, default=1, help="工作进程数")
+    batch.add_argument("--threads", type=int, default=0, help="每个工作进程的线程数 (0 默认)")
+    batch.add_argument("--embedding-cache-dir", default="", help="编码磁盘缓存目录")
+    batch.add_argument("--tile-size", type=int, default=0, help="分块大小 (0 不分块)")
+    batch.add_argument("--tile-overlap", type=int, default=DEFAULT_TILE_OVERLAP)
+
+    auto = commands.add_parser("sam-auto", help="无提示的整卷自动分割")
+    auto.add_argument("volume", help="3D 体数据 (.npy / .zarr / .tif)")
+    auto.add_argument("output", help="输出 Zarr 目录")
+    auto.add_argument("--model-type", default="vit_b", choices=sorted(MODEL_URLS))
+    auto.add_argument("--checkpoint", default="", help="模型检查点，缺省时下载默认检查点")
+    auto.add_argument("--backend", default="pytorch", choices=BACKENDS)
+    auto.add_argument("--threads", type=int, default=0, help="torch 线程数 (0 默认)")
+    auto.add_argument("--embedding-cache-dir", default="", help="编码磁盘缓存目录")
+    auto.add_argument("--points-per-side", type=int, default=DEFAULT_POINTS_PER_SIDE)
+    auto.add_argument("--points-per-batch", type=int, default=DEFAULT_POINTS_PER_BATCH)
+    auto.add_argument("--pred-iou-thresh", type=float, default=0.88)
+    auto.add_argument("--stability-thresh", type=float, default=0.95)
+    auto.add_argument("--nms-thresh", type=float, default=0.7)
+    auto.add_argument("--min-area", type=int, default=0)
+    auto.add_argument("--min-iou", type=float, default=0.3, help="跨切片匹配 IoU")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "sam-batch":
+        run_batch(
+            args.volume,
+            args.prompts,
+            args.output,
+            model_type=args.model_type,
+            checkpoint_path=args.checkpoint,
+            backend=args.backend,
+            workers=args.workers,
+            threads=args.threads,
+            embedding_cache_dir=args.embedding_cache_dir,
+            tile_size=args.tile_size,
+            tile_overlap=args.tile_overlap,
+        )
+    elif args.command == "sam-auto":
+        run_auto(
+            args.volume,
+            args.output,
+            model_type=args.model_type,
+            checkpoint_path=args.checkpoint,
+            backend=args.backend,
+            threads=args.threads,
+            embedding_cache_dir=args.embedding_cache_dir,
+            points_per_side=args.points_per_side,
+            points_per_batch=args.points_per_batch,
+            pred_iou_thresh=args.pred_iou_thresh,
+            stability_thresh=args.stability_thresh,
+            nms_thresh=args.nms_thresh,
+            min_area=args.min_area,
+            min_iou=args.min_iou,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,249 @@
+"""
+SAM 图像编码（embedding）缓存。
+
+ViT 编码器占 CPU 上分割时间的绝大部分，而提示编码器和掩码解码器只需几毫秒。
+这里按 (模型, 图像层, Z 索引, 切片内容哈希) 缓存每个切片的 ``features``、
+``original_size`` 和 ``input_size``，修改提示点后重新分割只需运行解码器。
+可选的磁盘缓存以内存映射的 ``.npy`` 保存编码结果，跨 napari 会话复用。
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Tuple
+
+import numpy as np
+import torch
+
+
+class SliceEmbedding(NamedTuple):
+    """`SamPredictor` 预测所需的单个切片编码结果。"""
+
+    features: np.ndarray
+    original_size: Tuple[int, int]
+    input_size: Tuple[int, int]
+
+    @property
+    def nbytes(self):
+        return self.features.nbytes
+
+
+def slice_to_rgb(slice_image):
+    """将 (Y, X) 或 (Y, X, C) 切片转换为 SAM 需要的 (Y, X, 3)。"""
+    if slice_image.ndim == 2:
+        return np.stack([slice_image] * 3, axis=-1)
+    if slice_image.shape[2] == 1:
+        return np.repeat(slice_image, 3, axis=2)
+    return slice_image
+
+
+def compute_embedding(predictor, image_rgb):
+    """运行图像编码器，不改变 ``predictor`` 当前设置的图像。"""
+    # 浅拷贝共享模型权重，只在副本上设置图像，便于在后台线程中预先编码
+    encoder = copy.copy(predictor)
+    encoder.set_image(image_rgb)
+    return SliceEmbedding(
+        features=encoder.features.detach().cpu().numpy(),
+        original_size=tuple(encoder.original_size),
+        input_size=tuple(encoder.input_size),
+    )
+
+
+def apply_embedding(predictor, embedding):
+    """将缓存的编码结果设置到 ``predictor``，等价于 ``set_image``。"""
+    predictor.reset_image()
+    predictor.features = torch.tensor(
+        np.asarray(embedding.features), device=predictor.device
+    )
+    predictor.original_size = embedding.original_size
+    predictor.input_size = embedding.input_size
+    predictor.is_image_set = True
+
+
+def slice_digest(slice_image):
+    """切片内容的哈希，作为数据版本标识。"""
+    slice_image = np.ascontiguousarray(slice_image)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{slice_image.shape}{slice_image.dtype}".encode())
+    digest.update(slice_image.view(np.uint8).reshape(-1))
+    return digest.hexdigest()
+
+
+def model_digest(model_key):
+    """模型标识的哈希。设备不影响编码结果，不参与磁盘缓存的文件名。
+
+    量化后端的编码结果与 fp32 不同，推理后端参与哈希；``pytorch`` 与 ``onnx``
+    同为 fp32 编码器，共用磁盘缓存。
+    """
+    model_type, path, mtime = model_key[:3]
+    text = f"{model_type}|{os.path.basename(path)}|{mtime}"
+    backend = model_key[4] if len(model_key) > 4 else "pytorch"
+    if backend.endswith("-int8"):
+        text += f"|{backend}"
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+class EmbeddingCache:
+    """内存 LRU + 可选磁盘两级的切片编码缓存。
+
+    Parameters
+    ----------
+    max_memory_bytes : int
+        内存中保留的编码结果总字节数上限。
+    cache_dir : str, optional
+        磁盘缓存目录，为空时只使用内存缓存。
+    """
+
+    def __init__(self, max_memory_bytes=1024**3, cache_dir=None):
+        self.max_memory_bytes = max_memory_bytes
+        self.cache_dir = cache_dir or None
+        self._entries = OrderedDict()  # key -> SliceEmbedding
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        self._inflight = {}  # key -> threading.Event，正在编码的切片
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model_key, image_id, z, slice_image):
+        """缓存键: (模型, 图像层标识, Z 索引, 切片内容哈希)。"""
+        return (tuple(model_key), image_id, int(z), slice_digest(slice_image))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or (
+            self.cache_dir is not None and os.path.exists(self._disk_path(key))
+        )
+
+    @property
+    def memory_bytes(self):
+        return self._nbytes
+
+    def get(self, key):
+        """返回缓存的编码结果，未命中时返回 None。"""
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+        embedding = self._load_from_disk(key)
+        with self._lock:
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._put_memory(key, embedding)
+        return embedding
+
+    def put(self, key, embedding):
+        with self._lock:
+            self._put_memory(key, embedding)
+        self._save_to_disk(key, embedding)
+
+    def get_or_compute(self, key, predictor, image_rgb):
+        """命中时直接返回，否则运行编码器并写入缓存。
+
+        多个线程同时请求同一切片时（例如预取和点击），编码器只运行一次。
+        """
+        embedding = self.get(key)
+        if embedding is not None:
+            return embedding
+
+        with self._lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+        if not owner:
+            event.wait()
+            embedding = self.get(key)
+            if embedding is not None:
+                return embedding
+            return self.get_or_compute(key, predictor, image_rgb)
+
+        try:
+            embedding = compute_embedding(predictor, image_rgb)
+            self.put(key, embedding)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+        return embedding
+
+    def clear(self, disk=False):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+        if disk and self.cache_dir is not None and os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith((".npy", ".json")):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def _put_memory(self, key, embedding):
+        if key in self._entries:
+            self._nbytes -= self._entries.pop(key).nbytes
+        self._entries[key] = embedding
+        self._nbytes += embedding.nbytes
+        while len(self._entries) > 1 and self._nbytes > self.max_memory_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+
+    def _disk_path(self, key):
+        # 磁盘缓存只依赖模型和切片内容，图像层标识在新会话中会变化
+        model_key, _, _, digest = key
+        return os.path.join(self.cache_dir, f"{model_digest(model_key)}_{digest}.npy")
+
+    def _load_from_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        path = self._disk_path(key)
+        meta_path = path[:-4] + ".json"
+        if not (os.path.exists(path) and os.path.exists(meta_path)):
+            return None
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            features = np.load(path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            print(f"读取编码缓存失败 {path}: {e}")
+            return None
+        return SliceEmbedding(
+            features=features,
+            original_size=tuple(meta["original_size"]),
+            input_size=tuple(meta["input_size"]),
+        )
+
+    def _save_to_disk(self, key, embedding):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._disk_path(key)
+        meta_path = path[:-4] + ".json"
+        # 先写临时文件再替换，避免中断时留下不完整的缓存
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(path + suffix, "wb") as f:
+            np.save(f, np.asarray(embedding.features))
+        os.replace(path + suffix, path)
+        with open(meta_path + suffix, "w") as f:
+            json.dump(
+                {
+                    "original_size": list(embedding.original_size),
+                    "input_size": list(embedding.input_size),
+                },
+                f,
+            )
+        os.replace(meta_path + suffix, meta_path)
+
+
+_EMBEDDING_CACHE = EmbeddingCache()
+
+
+def get_embedding_cache(cache_dir=None):
+    """返回进程级共享的编码缓存，``cache_dir`` 非空时启用磁盘缓存。"""
+    _EMBEDDING_CACHE.cache_dir = cache_dir or None
+    return _EMBEDDING_CACHE
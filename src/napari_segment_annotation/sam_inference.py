@@ -0,0 +1,222 @@
+"""
+SAM 推理的公共部分：读取提示点、逐切片预测和输出标签层。
+
+分割控件、实时模式都基于这里的函数，它们不依赖 Qt 界面，
+也可以在没有 napari 窗口的情况下调用。
+"""
+import numpy as np
+import torch
+
+from .lazy_volume import create_sparse_labels, read_slice
+from .sam_embedding_cache import apply_embedding, slice_to_rgb
+
+
+def get_prompt_points(points_layer):
+    """返回提示点 (point_data, point_labels, object_ids)，无有效提示点时返回 None。
+
+    'label' 属性为 1（前景）或 0（背景）；'object_id' 属性区分同一切片上的不同对象，
+    缺省时所有点属于对象 1。
+    """
+    if points_layer is None or len(points_layer.data) == 0:
+        print("请在图像上添加提示点。")
+        return None
+
+    point_data = points_layer.data
+    label_property = points_layer.properties.get('label', None)
+    if label_property is None:
+        point_labels = np.ones(len(points_layer.data), dtype=int)
+    else:
+        point_labels = np.array(label_property)
+        if len(point_labels) != len(points_layer.data):
+            print("点层的 'label' 属性长度与点的数量不一致。")
+            return None
+
+    object_property = points_layer.properties.get('object_id', None)
+    if object_property is None or len(object_property) == 0:
+        object_ids = np.ones(len(points_layer.data), dtype=int)
+    else:
+        object_ids = np.asarray(object_property, dtype=int)
+        if len(object_ids) != len(points_layer.data):
+            print("点层的 'object_id' 属性长度与点的数量不一致。")
+            return None
+        if np.any(object_ids <= 0):
+            print("'object_id' 必须为正整数。")
+            return None
+    return point_data, point_labels, object_ids
+
+
+def set_point_defaults(points_layer, **values):
+    """设置之后新添加提示点的属性默认值，只修改点层已有的属性。"""
+    defaults = points_layer.feature_defaults
+    updated = {name: defaults[name].iloc[0] for name in defaults.columns}
+    updated.update({name: value for name, value in values.items() if name in updated})
+    points_layer.feature_defaults = updated
+
+
+def prompts_on_slice(point_data, point_labels, object_ids, z):
+    """返回切片 z 上的提示点 (coords, labels, object_ids)，坐标为 SAM 使用的 (X, Y) 顺序。"""
+    on_slice = point_data[:, 0].astype(int) == z
+    coords = point_data[on_slice][:, 1:][:, ::-1]
+    return coords, point_labels[on_slice], object_ids[on_slice]
+
+
+def label_dtype(max_label):
+    """能容纳 ``max_label`` 的最小无符号整数类型（至少 uint8）。"""
+    return np.result_type(np.uint8, np.min_scalar_type(max(int(max_label), 0)))
+
+
+def stack_object_prompts(coords, labels, object_ids):
+    """按对象分组并补齐为批量提示。
+
+    返回 (ids, batch_coords, batch_labels)，形状分别为 (B,)、(B, N, 2)、(B, N)。
+    点数不足 N 的对象用标签 -1 补齐，SAM 的提示编码器会忽略这些点。
+    只有背景点的对象被跳过。
+    """
+    ids = np.unique(object_ids[labels == 1])
+    counts = np.array([np.count_nonzero(object_ids == i) for i in ids], dtype=int)
+    n_points = int(counts.max()) if len(ids) else 0
+
+    batch_coords = np.zeros((len(ids), n_points, 2), dtype=float)
+    batch_labels = np.full((len(ids), n_points), -1, dtype=int)
+    for row, (object_id, count) in enumerate(zip(ids, counts)):
+        mine = object_ids == object_id
+        batch_coords[row, :count] = coords[mine]
+        batch_labels[row, :count] = labels[mine]
+    return ids, batch_coords, batch_labels
+
+
+def object_logits(predictor, batch_coords=None, batch_labels=None, boxes=None, max_batch=32):
+    """分批运行掩码解码器，逐批产出 (start, logits)。
+
+    ``batch_coords``/``batch_labels`` 形状为 (B, N, 2)/(B, N)，``boxes`` 为 (B, 4) 的 XYXY 框，
+    二者至少提供一个。``logits`` 是形状为 (b, H, W) 的张量，对应第 ``start`` 起的 b 个对象；
+    每批最多 ``max_batch`` 个对象，以限制 logits 占用的内存。
+    """
+    n_objects = len(boxes) if boxes is not None else len(batch_coords)
+    for start in range(0, n_objects, max_batch):
+        stop = start + max_batch
+        coords_torch = labels_torch = boxes_torch = None
+        if batch_coords is not None:
+            coords_torch = torch.as_tensor(
+                predictor.transform.apply_coords(batch_coords[start:stop], predictor.original_size),
+                dtype=torch.float,
+                device=predictor.device,
+            )
+            labels_torch = torch.as_tensor(batch_labels[start:stop], dtype=torch.int, device=predictor.device)
+        if boxes is not None:
+            boxes_torch = torch.as_tensor(
+                predictor.transform.apply_boxes(boxes[start:stop], predictor.original_size),
+                dtype=torch.float,
+                device=predictor.device,
+            )
+        logits, _, _ = predictor.predict_torch(
+            coords_torch,
+            labels_torch,
+            boxes=boxes_torch,
+            multimask_output=False,
+            return_logits=True,
+        )
+        yield start, logits[:, 0]
+
+
+def decode_objects(predictor, ids, batch_coords=None, batch_labels=None, boxes=None, max_batch=32):
+    """批量解码一组对象的提示，返回多标签掩码。
+
+    提示的形状见 `object_logits`。像素归属于 logits 最大的对象，低于阈值的像素为 0。
+    """
+    height, width = predictor.original_size
+    label_map = np.zeros((height, width), dtype=label_dtype(ids.max() if len(ids) else 0))
+    if len(ids) == 0:
+        return label_map
+
+    best_logits = None
+    best_index = None
+    for start, logits in object_logits(predictor, batch_coords, batch_labels, boxes, max_batch):
+        chunk_logits, chunk_index = logits.max(dim=0)
+        chunk_index = chunk_index + start
+        if best_logits is None:
+            best_logits, best_index = chunk_logits, chunk_index
+        else:
+            better = chunk_logits > best_logits
+            best_logits = torch.where(better, chunk_logits, best_logits)
+            best_index = torch.where(better, chunk_index, best_index)
+
+    foreground = (best_logits > predictor.model.mask_threshold).cpu().numpy()
+    object_index = best_index.cpu().numpy()
+    label_map[foreground] = ids[object_index[foreground]]
+    return label_map
+
+
+def predict_objects(predictor, coords, labels, object_ids, max_batch=32):
+    """在一次批量解码中预测切片上的所有对象，返回多标签掩码。
+
+    每个对象的点作为一组提示，堆叠后通过 ``predict_torch`` 一次解码，
+    结果中每个对象的值为其 object_id。
+    """
+    ids, batch_coords, batch_labels = stack_object_prompts(coords, labels, object_ids)
+    return decode_objects(predictor, ids, batch_coords, batch_labels, max_batch=max_batch)
+
+
+def set_slice_image(predictor, embedding_cache, model_key, image_id, z, slice_image, cache_key=None):
+    """为 ``predictor`` 设置切片图像，优先使用缓存的编码结果。返回缓存键。
+
+    调用方已算出缓存键时通过 ``cache_key`` 传入，避免再次对整个切片求哈希。
+    """
+    # 切片内容未变化时复用缓存的编码结果，只运行提示编码器和掩码解码器
+    if cache_key is None:
+        cache_key = embedding_cache.make_key(model_key, image_id, z, slice_image)
+    embedding = embedding_cache.get_or_compute(cache_key, predictor, slice_to_rgb(slice_image))
+    apply_embedding(predictor, embedding)
+    return cache_key
+
+
+def segment_prompted_slices(
+    predictor,
+    image,
+    point_data,
+    point_labels,
+    object_ids,
+    embedding_cache,
+    model_key,
+    image_id,
+):
+    """逐个分割包含提示点的切片，每完成一个切片产出 (z, label_map)。
+
+    ``image`` 可以是 Dask/Zarr 数组，只读取包含提示点的切片。
+    同一切片上的所有对象在一次批量解码中完成，结果中每个对象的值为其 object_id。
+    """
+    z_indices = np.unique(point_data[:, 0].astype(int))
+    print(f"包含提示点的切片索引: {z_indices}")
+
+    for z in z_indices:
+        coords, labels, ids = prompts_on_slice(point_data, point_labels, object_ids, z)
+        if len(coords) == 0:
+            continue
+
+        set_slice_image(predictor, embedding_cache, model_key, image_id, z, read_slice(image, z))
+        yield z, predict_objects(predictor, coords, labels, ids)
+
+
+def segmentation_layer_name(image_layer):
+    return f"SAM 分割结果 ({image_layer.name})"
+
+
+def get_segmentation_layer(viewer, image_layer, reset=False, dtype=np.uint16):
+    """返回图像层对应的 SAM 结果标签层，不存在或 ``reset`` 时新建空数据。
+
+    标签数据是按切片分块的 Zarr 数组，只有写入了分割结果的切片占用内存。
+    已有标签层的数据类型放不下 ``dtype`` 时也会重建。
+    """
+    name = segmentation_layer_name(image_layer)
+    shape = image_layer.data.shape
+    if name in viewer.layers:
+        layer = viewer.layers[name]
+        too_small = not np.can_cast(dtype, layer.data.dtype)
+        if reset or too_small or layer.data.shape != shape:
+            layer.data = create_sparse_labels(shape, dtype=dtype)
+            print(f"已更新标签层: {name}")
+        return layer
+
+    layer = viewer.add_labels(create_sparse_labels(shape, dtype=dtype), name=name)
+    print(f"已添加新的标签层: {name}")
+    return layer
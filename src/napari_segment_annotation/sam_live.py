@@ -0,0 +1,221 @@
+"""
+点击即分割的实时模式。
+
+每次提示点变化时，只对当前切片运行提示编码器和掩码解码器（图像编码来自
+`EmbeddingCache`），并只更新输出标签层的这一层切片。快速连续点击会被合并：
+防抖计时器结束后才发起预测，同一时间只有一个预测在运行，
+过期的预测结果直接丢弃而不会排队。切换切片时的预编码同样防抖，同一时间只有一个
+编码在运行，快速滚动经过的切片不会各自排队编码。
+"""
+import threading
+import time
+
+import numpy as np
+from napari.qt.threading import thread_worker
+from qtpy.QtCore import QTimer
+
+from .lazy_volume import read_slice
+from .sam_embedding_cache import get_embedding_cache, slice_to_rgb
+from .sam_inference import (
+    get_prompt_points,
+    get_segmentation_layer,
+    predict_objects,
+    prompts_on_slice,
+    set_slice_image,
+)
+from .sam_model_cache import load_predictor
+
+
+class LiveSegmentation:
+    """将提示点层的变化实时转换为当前切片的 SAM 分割结果。
+
+    Parameters
+    ----------
+    viewer : napari.Viewer
+    image_layer : napari.layers.Image
+        3D 图像层 (Z, Y, X)。
+    points_layer : napari.layers.Points
+        提示点层，'label' 属性为 1（前景）或 0（背景），'object_id' 属性区分对象。
+    model_type, checkpoint_path, embedding_cache_dir, backend : str
+        与 `sam_segmentation_widget` 的同名参数相同。
+    debounce_ms : int
+        最后一次点击后等待多久再发起预测。
+    prefetch_ms : int
+        切片停止变化多久后再预编码当前切片。
+    """
+
+    def __init__(
+        self,
+        viewer,
+        image_layer,
+        points_layer,
+        model_type="vit_b",
+        checkpoint_path="",
+        embedding_cache_dir="",
+        debounce_ms=40,
+        backend="pytorch",
+        prefetch_ms=150,
+    ):
+        self.viewer = viewer
+        self.image_layer = image_layer
+        self.points_layer = points_layer
+        self.model_type = model_type
+        self.checkpoint_path = checkpoint_path
+        self.backend = backend
+        self.embedding_cache = get_embedding_cache(embedding_cache_dir)
+
+        self._predictor = None
+        self._model_key = None
+        self._predictor_lock = threading.Lock()
+        self._applied_key = None  # 当前设置到预测器上的编码缓存键
+
+        self._generation = 0  # 每次新请求递增，用于丢弃过期结果
+        self._pending_z = None
+        self._busy = False
+
+        self._timer = QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(debounce_ms)
+        self._timer.timeout.connect(self._dispatch)
+
+        self._prefetch_generation = 0  # 每次切换切片递增，过期的预编码在开始前跳过
+        self._prefetch_z = None
+        self._prefetching = False
+        self._prefetch_timer = QTimer()
+        self._prefetch_timer.setSingleShot(True)
+        self._prefetch_timer.setInterval(prefetch_ms)
+        self._prefetch_timer.timeout.connect(self._dispatch_prefetch)
+
+        self.output_layer = get_segmentation_layer(viewer, image_layer)
+        self.points_layer.events.data.connect(self._on_points_changed)
+        self.viewer.dims.events.current_step.connect(self._on_step_changed)
+        self.prefetch(self.current_z())
+
+    def close(self):
+        """停止实时模式，丢弃尚未返回的结果。"""
+        self._timer.stop()
+        self._generation += 1
+        self._pending_z = None
+        self._prefetch_timer.stop()
+        self._prefetch_generation += 1
+        self._prefetch_z = None
+        self.points_layer.events.data.disconnect(self._on_points_changed)
+        self.viewer.dims.events.current_step.disconnect(self._on_step_changed)
+
+    def current_z(self):
+        """当前显示的 Z 切片在图像数据中的索引。"""
+        z = self.image_layer.world_to_data(self.viewer.dims.point)[0]
+        return int(np.clip(round(z), 0, self.image_layer.data.shape[0] - 1))
+
+    def request_update(self, z):
+        """请求重新预测切片 z，防抖后执行，之前的请求作废。"""
+        self._generation += 1
+        self._pending_z = z
+        self._timer.start()
+
+    def prefetch(self, z):
+        """请求在后台提前计算切片 z 的图像编码，使第一次点击也只需运行解码器。
+
+        防抖后执行，之前尚未开始的预编码作废。
+        """
+        self._prefetch_generation += 1
+        self._prefetch_z = z
+        self._prefetch_timer.start()
+
+    def _on_points_changed(self, event=None):
+        self.request_update(self.current_z())
+
+    def _on_step_changed(self, event=None):
+        self.prefetch(self.current_z())
+
+    def _dispatch(self):
+        # 已有预测在运行时不排队，完成后只处理最新的请求
+        if self._busy or self._pending_z is None:
+            return
+        z, self._pending_z = self._pending_z, None
+
+        prompts = get_prompt_points(self.points_layer)
+        if prompts is None:
+            coords, labels, object_ids = np.empty((0, 2)), np.empty(0, dtype=int), np.empty(0, dtype=int)
+        else:
+            coords, labels, object_ids = prompts_on_slice(*prompts, z)
+
+        self._busy = True
+        worker = self._predict_slice(z, coords, labels, object_ids, self._generation)
+        worker.returned.connect(self._on_result)
+        worker.finished.connect(self._on_worker_finished)
+        worker.start()
+
+    def _dispatch_prefetch(self):
+        # 已有编码在运行时不排队，完成后只编码最新的切片
+        if self._prefetching or self._prefetch_z is None:
+            return
+        z, self._prefetch_z = self._prefetch_z, None
+        self._prefetching = True
+        worker = self._encode_slice(z, self._prefetch_generation)
+        worker.finished.connect(self._on_prefetch_finished)
+        worker.start()
+
+    def _on_prefetch_finished(self):
+        self._prefetching = False
+        if self._prefetch_z is not None:
+            self._dispatch_prefetch()
+
+    def _on_worker_finished(self):
+        self._busy = False
+        if self._pending_z is not None:
+            self._dispatch()
+
+    def _on_result(self, result):
+        generation, z, label_map, seconds = result
+        if generation != self._generation:
+            return  # 之后又有新的点击，结果已过期
+        if not np.can_cast(label_map.dtype, self.output_layer.data.dtype):
+            print(f"object_id 超出标签层数据类型 {self.output_layer.data.dtype} 的范围。")
+            return
+        self.output_layer.data[z, :, :] = label_map
+        self.output_layer.refresh()
+        print(f"实时分割切片 z={z}，解码耗时 {seconds * 1000:.0f} ms")
+
+    def _ensure_predictor(self):
+        with self._predictor_lock:
+            if self._predictor is None:
+                self._predictor, self._model_key = load_predictor(
+                    self.model_type, self.checkpoint_path, backend=self.backend
+                )
+            return self._predictor
+
+    def _slice_image(self, z):
+        return read_slice(self.image_layer.data, z)
+
+    @thread_worker
+    def _encode_slice(self, z, generation):
+        if generation != self._prefetch_generation:
+            return  # 开始前又切换了切片
+        predictor = self._ensure_predictor()
+        slice_image = self._slice_image(z)
+        key = self.embedding_cache.make_key(
+            self._model_key, self.image_layer.unique_id, z, slice_image
+        )
+        self.embedding_cache.get_or_compute(key, predictor, slice_to_rgb(slice_image))
+
+    @thread_worker
+    def _predict_slice(self, z, coords, labels, object_ids, generation):
+        predictor = self._ensure_predictor()
+        slice_image = self._slice_image(z)
+        if not np.any(labels == 1):
+            return generation, z, np.zeros(slice_image.shape[:2], dtype=np.uint8), 0.0
+
+        key = self.embedding_cache.make_key(
+            self._model_key, self.image_layer.unique_id, z, slice_image
+        )
+        if key != self._applied_key:
+            set_slice_image(
+                predictor, self.embedding_cache, self._model_key,
+                self.image_layer.unique_id, z, slice_image, cache_key=key,
+            )
+            self._applied_key = key
+
+        start = time.perf_counter()
+        label_map = predict_objects(predictor, coords, labels, object_ids)
+        return generation, z, label_map, time.perf_counter() - start
@@ -0,0 +1,271 @@
+"""
+进程级 SAM 模型缓存。
+
+加载 SAM 检查点（尤其是 vit_h）在 CPU 上需要几十秒和数 GB 内存，
+因此已加载的模型按 (model_type, 检查点路径, 检查点修改时间, 设备, 推理后端)
+常驻内存，按 LRU 顺序淘汰，并支持显式卸载。推理后端见 `sam_backends`。
+"""
+import gc
+import itertools
+import os
+import threading
+import urllib.request
+from collections import OrderedDict
+
+import torch
+from magicgui import magic_factory
+from segment_anything import sam_model_registry
+
+from .sam_backends import (
+    check_backend,
+    create_predictor,
+    is_onnx_backend,
+    load_onnx_model,
+    quantize_encoder,
+)
+
+DEFAULT_CHECKPOINT_DIR = os.path.expanduser("~/.cache/segment_anything")
+
+# `SamModelCache.configure` 中未给出的参数，与表示"不限制"的 None 区分
+_UNSET = object()
+
+MODEL_URLS = {
+    "vit_b": "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_b_01ec64.pth",
+    "vit_l": "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_l_0b3195.pth",
+    "vit_h": "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth",
+}
+
+
+def download_default_checkpoint(model_type, save_dir):
+    """
+    下载默认的 SAM 模型检查点文件。
+    """
+    url = MODEL_URLS.get(model_type)
+    if not url:
+        raise ValueError(f"不支持的模型类型：{model_type}")
+
+    os.makedirs(save_dir, exist_ok=True)
+    save_path = os.path.join(save_dir, os.path.basename(url))
+
+    if not os.path.exists(save_path):
+        print(f"正在下载模型检查点文件：{url}")
+        urllib.request.urlretrieve(url, save_path)
+        print(f"模型检查点文件已保存到：{save_path}")
+    else:
+        print(f"模型检查点文件已存在：{save_path}")
+
+    return save_path
+
+
+def resolve_checkpoint(model_type, checkpoint_path=""):
+    """返回检查点路径，未提供时下载默认检查点。"""
+    if not checkpoint_path:
+        return download_default_checkpoint(model_type, DEFAULT_CHECKPOINT_DIR)
+    return checkpoint_path
+
+
+def default_device(backend="pytorch"):
+    """检测设备（GPU 或 CPU）。量化和 ONNX 后端只在 CPU 上运行。"""
+    if backend != "pytorch":
+        return torch.device("cpu")
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def load_sam_model(
+    model_type,
+    checkpoint_path,
+    device,
+    backend="pytorch",
+    intra_op_threads=0,
+    inter_op_threads=0,
+):
+    """从磁盘加载 SAM 模型并移动到指定设备。
+
+    ONNX 后端返回 `OnnxSam`，线程数只对 ONNX 后端有效。
+    """
+    check_backend(backend)
+    if backend != "pytorch" and torch.device(device).type != "cpu":
+        raise ValueError(f"推理后端 {backend} 只支持 CPU，当前设备为 {device}")
+    if is_onnx_backend(backend):
+        return load_onnx_model(
+            model_type,
+            checkpoint_path,
+            backend,
+            intra_op_threads=intra_op_threads,
+            inter_op_threads=inter_op_threads,
+        )
+    sam = sam_model_registry[model_type](checkpoint=checkpoint_path)
+    sam.to(device)
+    sam.eval()
+    if backend == "pytorch-int8":
+        quantize_encoder(sam)
+    return sam
+
+
+def model_nbytes(model):
+    """模型参数与缓冲区占用的字节数（ONNX 模型为导出文件大小）。"""
+    if not isinstance(model, torch.nn.Module):
+        return model.nbytes
+    return sum(
+        t.numel() * t.element_size()
+        for t in itertools.chain(model.parameters(), model.buffers())
+    )
+
+
+class SamModelCache:
+    """按 LRU 顺序保留已加载 SAM 模型的缓存。
+
+    Parameters
+    ----------
+    max_models : int
+        最多同时常驻的模型数量。
+    max_memory_bytes : int or None
+        常驻模型的总字节数上限，None 表示不限制。
+        最近使用的模型即使超出上限也会保留。
+    loader : callable, optional
+        ``loader(model_type, checkpoint_path, device, backend=..., intra_op_threads=...,
+        inter_op_threads=...)``，默认 `load_sam_model`。
+    """
+
+    def __init__(self, max_models=2, max_memory_bytes=None, loader=None):
+        self.max_models = max_models
+        self.max_memory_bytes = max_memory_bytes
+        self.intra_op_threads = 0
+        self.inter_op_threads = 0
+        self._loader = loader or load_sam_model
+        self._models = OrderedDict()  # key -> (model, nbytes)
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(model_type, checkpoint_path, device, backend="pytorch"):
+        path = os.path.abspath(checkpoint_path)
+        return (model_type, path, os.path.getmtime(path), str(device), backend)
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def keys(self):
+        with self._lock:
+            return list(self._models)
+
+    @property
+    def memory_bytes(self):
+        with self._lock:
+            return sum(nbytes for _, nbytes in self._models.values())
+
+    def configure(
+        self,
+        max_models=None,
+        max_memory_bytes=_UNSET,
+        intra_op_threads=None,
+        inter_op_threads=None,
+    ):
+        """修改缓存上限并立即按新上限淘汰，未给出的参数保持不变。
+
+        ``max_memory_bytes`` 为 None 时取消内存上限。
+        ONNX Runtime 线程数变化时，已加载的 ONNX 模型会被卸载，下次使用时按新线程数创建会话。
+        """
+        with self._lock:
+            if max_models is not None:
+                self.max_models = max_models
+            if max_memory_bytes is not _UNSET:
+                self.max_memory_bytes = max_memory_bytes
+            threads = (
+                self.intra_op_threads if intra_op_threads is None else intra_op_threads,
+                self.inter_op_threads if inter_op_threads is None else inter_op_threads,
+            )
+            if threads != (self.intra_op_threads, self.inter_op_threads):
+                self.intra_op_threads, self.inter_op_threads = threads
+                for key in [k for k in self._models if is_onnx_backend(k[4])]:
+                    del self._models[key]
+            self._evict()
+
+    def get_model(self, model_type, checkpoint_path, device=None, backend="pytorch"):
+        """返回缓存中的模型，未命中时从磁盘加载。"""
+        device = device if device is not None else default_device(backend)
+        key = self.make_key(model_type, checkpoint_path, device, backend)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key][0]
+
+            # 检查点文件被替换（修改时间变化）时，丢弃旧版本
+            for old_key in list(self._models):
+                if old_key[:2] == key[:2] and old_key[3:] == key[3:]:
+                    del self._models[old_key]
+
+            print(f"正在加载模型 {model_type} ({backend}): {key[1]} -> {device}")
+            model = self._loader(
+                model_type,
+                checkpoint_path,
+                device,
+                backend=backend,
+                intra_op_threads=self.intra_op_threads,
+                inter_op_threads=self.inter_op_threads,
+            )
+            self._models[key] = (model, model_nbytes(model))
+            self._evict()
+            return model
+
+    def get_predictor(self, model_type, checkpoint_path, device=None, backend="pytorch"):
+        """基于缓存模型创建新的预测器（预测器本身很轻量）。
+
+        PyTorch 后端返回 `SamPredictor`，ONNX 后端返回接口相同的 `OnnxSamPredictor`。
+        """
+        return create_predictor(self.get_model(model_type, checkpoint_path, device, backend))
+
+    def unload(self, model_type=None):
+        """卸载缓存中的模型，model_type 为 None 时全部卸载。返回卸载数量。"""
+        with self._lock:
+            keys = [k for k in self._models if model_type in (None, k[0])]
+            for key in keys:
+                del self._models[key]
+        if keys:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        return len(keys)
+
+    def _evict(self):
+        while len(self._models) > 1 and (
+            len(self._models) > self.max_models
+            or (
+                self.max_memory_bytes is not None
+                and self.memory_bytes > self.max_memory_bytes
+            )
+        ):
+            key, _ = self._models.popitem(last=False)
+            print(f"已从缓存中移除模型: {key[0]} ({key[1]})")
+
+
+_MODEL_CACHE = SamModelCache()
+
+
+def get_model_cache():
+    """返回进程级共享的模型缓存。"""
+    return _MODEL_CACHE
+
+
+def load_predictor(model_type, checkpoint_path="", device=None, backend="pytorch"):
+    """通过共享缓存获取预测器，返回 (predictor, model_key)。
+
+    未提供检查点路径时下载默认检查点；``model_key`` 用作编码缓存的模型标识。
+    """
+    check_backend(backend)
+    device = device if device is not None else default_device(backend)
+    checkpoint_path = resolve_checkpoint(model_type, checkpoint_path)
+    predictor = _MODEL_CACHE.get_predictor(model_type, checkpoint_path, device, backend)
+    return predictor, SamModelCache.make_key(model_type, checkpoint_path, device, backend)
+
+
+@magic_factory(
+    call_button="卸载模型",
+    model_type={"choices": ["all", "vit_b", "vit_l", "vit_h"]},
+)
+def unload_sam_models(model_type: str = "all") -> None:
+    """释放缓存中常驻的 SAM 模型。"""
+    count = get_model_cache().unload(None if model_type == "all" else model_type)
+    print(f"已卸载 {count} 个模型。")
@@ -0,0 +1,135 @@
+"""
+沿 Z 方向传播 SAM 分割结果。
+
+从带提示点的种子切片出发逐层向外推进：每个对象在新切片上的提示由相邻切片的掩码
+生成（外接框 + 掩码内部的一个正点），同一切片上的所有对象在一次批量解码中完成。
+对象面积骤减或与相邻切片的 IoU 过低时停止传播。后续切片的图像编码在后台线程中
+提前计算，吞吐受编码器而不是 Python 调度限制。
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import ndimage
+
+from .lazy_volume import read_slice
+from .sam_embedding_cache import apply_embedding, slice_to_rgb
+from .sam_inference import decode_objects
+
+
+def object_index_map(label_map, ids):
+    """将标签值映射为 ``ids``（已排序）中的位置 + 1，不在 ``ids`` 中的像素为 0。"""
+    position = np.searchsorted(ids, label_map)
+    position = np.minimum(position, len(ids) - 1)
+    return np.where(ids[position] == label_map, position + 1, 0)
+
+
+def mask_prompts(label_map, ids):
+    """由掩码生成每个对象的提示：XYXY 外接框 (B, 4) 和内部正点 (B, 1, 2)。"""
+    index_map = object_index_map(label_map, ids)
+    boxes = np.zeros((len(ids), 4), dtype=float)
+    points = np.zeros((len(ids), 1, 2), dtype=float)
+    for i, bbox in enumerate(ndimage.find_objects(index_map, max_label=len(ids))):
+        if bbox is None:
+            continue
+        ys, xs = np.nonzero(index_map[bbox] == i + 1)
+        # 取离质心最近的前景像素作为正点，保证点落在（可能非凸的）掩码内部
+        nearest = np.argmin((ys - ys.mean()) ** 2 + (xs - xs.mean()) ** 2)
+        y0, x0 = bbox[0].start, bbox[1].start
+        boxes[i] = (x0 + xs.min(), y0 + ys.min(), x0 + xs.max(), y0 + ys.max())
+        points[i, 0] = (x0 + xs[nearest], y0 + ys[nearest])
+    return boxes, points
+
+
+def continuing_objects(previous, current, ids, min_area_ratio, min_iou):
+    """返回面积比和 IoU 都达到阈值、可以继续传播的对象的布尔数组。"""
+    prev_index = object_index_map(previous, ids)
+    curr_index = object_index_map(current, ids)
+    n = len(ids) + 1
+    prev_area = np.bincount(prev_index.ravel(), minlength=n)[1:]
+    curr_area = np.bincount(curr_index.ravel(), minlength=n)[1:]
+    overlap = np.bincount(prev_index[prev_index == curr_index], minlength=n)[1:]
+    union = prev_area + curr_area - overlap
+    iou = overlap / np.maximum(union, 1)
+    return (curr_area > 0) & (curr_area >= min_area_ratio * prev_area) & (iou >= min_iou)
+
+
+def propagation_ranges(seed_z, depth):
+    """每个种子切片向下/向上传播的范围 (z0, step, stop)，stop 不包含在内。
+
+    两个种子之间的切片从中点分开，分别由两侧的种子传播，互不重叠。
+    """
+    ranges = []
+    for i, z0 in enumerate(seed_z):
+        lower = (seed_z[i - 1] + z0) // 2 if i > 0 else -1
+        upper = (z0 + seed_z[i + 1]) // 2 + 1 if i + 1 < len(seed_z) else depth
+        ranges.append((z0, -1, lower))
+        ranges.append((z0, 1, upper))
+    return ranges
+
+
+def propagate_from_seeds(
+    predictor,
+    image,
+    seeds,
+    embedding_cache,
+    model_key,
+    image_id,
+    min_area_ratio=0.5,
+    min_iou=0.3,
+    prefetch=2,
+    max_batch=32,
+):
+    """从种子切片的标签图出发沿 Z 传播，每完成一个新切片产出 (z, label_map)。
+
+    Parameters
+    ----------
+    seeds : dict
+        ``{z: label_map}``，通常是 `segment_prompted_slices` 的结果。
+    min_area_ratio : float
+        对象面积与相邻切片之比低于该值时停止传播。
+    min_iou : float
+        对象与相邻切片掩码的 IoU 低于该值时停止传播。
+    prefetch : int
+        提前在后台编码的切片数。
+    """
+    def encode(z):
+        slice_image = read_slice(image, z)
+        key = embedding_cache.make_key(model_key, image_id, z, slice_image)
+        return embedding_cache.get_or_compute(key, predictor, slice_to_rgb(slice_image))
+
+    prefetch = max(int(prefetch), 1)
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sam-prefetch")
+    try:
+        for z0, step, stop in propagation_ranges(sorted(seeds), image.shape[0]):
+            previous = np.asarray(seeds[z0])
+            ids = np.unique(previous[previous != 0])
+            targets = range(z0 + step, stop, step)
+            queue = deque(executor.submit(encode, z) for z in targets[:prefetch])
+
+            for offset, z in enumerate(targets):
+                if len(ids) == 0:
+                    break
+                embedding = queue.popleft().result()
+                if offset + prefetch < len(targets):
+                    queue.append(executor.submit(encode, targets[offset + prefetch]))
+                apply_embedding(predictor, embedding)
+
+                boxes, points = mask_prompts(previous, ids)
+                current = decode_objects(
+                    predictor, ids, points, np.ones((len(ids), 1), dtype=int),
+                    boxes=boxes, max_batch=max_batch,
+                )
+                keep = continuing_objects(previous, current, ids, min_area_ratio, min_iou)
+                if not keep.all():
+                    current[np.isin(current, ids[~keep])] = 0
+                    ids = ids[keep]
+                if len(ids) == 0:
+                    break
+                yield z, current
+                previous = current
+
+            for future in queue:
+                future.cancel()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -1,134 +1,335 @@
-import os
-import urllib.request
+import time
+
 import numpy as np
-import dask.array as da
 import napari
 from magicgui import magic_factory
+from magicgui.widgets import CheckBox, Label, PushButton, SpinBox
 from napari.layers import Image, Points, Labels
-from segment_anything import sam_model_registry, SamPredictor
-import torch
-
-def download_default_checkpoint(model_type, save_dir):
-    """
-    下载默认的 SAM 模型检查点文件。
-    """
-    model_urls = {
-        "vit_b": "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_b_01ec64.pth",
-        "vit_l": "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_l_0b3195.pth",
-        "vit_h": "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth",
-    }
-
-    url = model_urls.get(model_type)
-    if not url:
-        raise ValueError(f"不支持的模型类型：{model_type}")
-
-    os.makedirs(save_dir, exist_ok=True)
-    save_path = os.path.join(save_dir, os.path.basename(url))
-
-    if not os.path.exists(save_path):
-        print(f"正在下载模型检查点文件：{url}")
-        urllib.request.urlretrieve(url, save_path)
-        print(f"模型检查点文件已保存到：{save_path}")
-    else:
-        print(f"模型检查点文件已存在：{save_path}")
-
-    return save_path
-
-@magic_factory(call_button="开始分割")
+from napari.qt.threading import thread_worker
+
+from .sam_embedding_cache import get_embedding_cache
+from .sam_inference import (
+    get_prompt_points,
+    get_segmentation_layer,
+    label_dtype,
+    segment_prompted_slices,
+    set_point_defaults,
+)
+from .sam_auto import DEFAULT_POINTS_PER_BATCH, DEFAULT_POINTS_PER_SIDE, auto_segment_volume
+from .sam_backends import BACKENDS
+from .sam_live import LiveSegmentation
+from .sam_propagation import propagate_from_seeds
+from .sam_tiling import DEFAULT_TILE_OVERLAP, segment_prompted_slices_tiled
+from .sam_model_cache import (  # noqa: F401  download_default_checkpoint 保留旧的导入路径
+    download_default_checkpoint,
+    get_model_cache,
+    load_predictor,
+)
+
+# 当前正在运行的分割任务，新任务开始或点击“取消”时中止
+_CURRENT_RUN = {"worker": None}
+
+# 非分块模式下每次产出的是整个切片
+_WHOLE_SLICE = (slice(None), slice(None))
+
+
+def _init_segmentation_widget(widget):
+    """在控件中添加对象 ID、进度显示、取消按钮和实时模式开关。"""
+    object_id_box = SpinBox(name="object_id", label="当前对象 ID", value=1, min=1, max=65535)
+    progress_label = Label(name="progress", value="")
+    cancel_button = PushButton(name="cancel_button", text="取消")
+    cancel_button.enabled = False
+    live_checkbox = CheckBox(name="live_mode", text="实时模式（点击即分割）")
+    live = {"session": None}
+
+    def on_live_toggled(enabled):
+        if live["session"] is not None:
+            live["session"].close()
+            live["session"] = None
+        if not enabled:
+            progress_label.value = ""
+            return
+        if widget.image_layer.value is None or widget.points_layer.value is None:
+            print("请先选择图像层和提示点层。")
+            live_checkbox.value = False
+            return
+        live["session"] = LiveSegmentation(
+            widget.viewer.value,
+            widget.image_layer.value,
+            widget.points_layer.value,
+            model_type=widget.model_type.value,
+            checkpoint_path=widget.checkpoint_path.value,
+            embedding_cache_dir=widget.embedding_cache_dir.value,
+            backend=widget.backend.value,
+        )
+        progress_label.value = "实时模式：添加或移动提示点即可更新当前切片"
+
+    def on_object_id_changed(value):
+        # 之后添加的提示点属于新的对象
+        if widget.points_layer.value is not None:
+            set_point_defaults(widget.points_layer.value, object_id=value)
+
+    def on_cancel():
+        worker = _CURRENT_RUN["worker"]
+        if worker is not None:
+            worker.quit()
+            progress_label.value = "正在取消..."
+
+    def on_called(worker):
+        if worker is None:
+            return
+        cancel_button.enabled = True
+
+        def on_progress(result):
+            z, _, _, index, total, seconds = result
+            count = f"{index}/{total}" if total else f"{index}"
+            progress_label.value = f"切片 {count} (z={z})，{seconds:.2f} 秒/切片"
+
+        def on_finished():
+            cancel_button.enabled = False
+            if worker.abort_requested:
+                progress_label.value = "分割已取消"
+
+        worker.yielded.connect(on_progress)
+        worker.finished.connect(on_finished)
+
+    cancel_button.changed.connect(on_cancel)
+    live_checkbox.changed.connect(on_live_toggled)
+    object_id_box.changed.connect(on_object_id_changed)
+    widget.called.connect(on_called)
+    widget.extend([object_id_box, live_checkbox, progress_label, cancel_button])
+
+
+@magic_factory(
+    call_button="开始分割",
+    widget_init=_init_segmentation_widget,
+    backend={"label": "推理后端", "choices": list(BACKENDS)},
+    intra_op_threads={"label": "ONNX 算子内线程 (0 自动)", "min": 0, "max": 256},
+    inter_op_threads={"label": "ONNX 算子间线程 (0 自动)", "min": 0, "max": 256},
+    max_cached_models={"label": "缓存模型数", "min": 1, "max": 8},
+    max_cache_memory_mb={"label": "缓存内存上限 (MB, 0 不限)", "min": 0, "max": 1048576},
+    embedding_cache_dir={"label": "编码缓存目录 (可选)"},
+    propagate={"label": "沿 Z 传播"},
+    min_area_ratio={"label": "最小面积比", "min": 0.0, "max": 1.0, "step": 0.05},
+    min_iou={"label": "最小 IoU", "min": 0.0, "max": 1.0, "step": 0.05},
+    tile_size={"label": "分块大小 (0 不分块)", "min": 0, "max": 8192, "step": 256},
+    tile_overlap={"label": "分块重叠", "min": 0, "max": 1024, "step": 32},
+)
 def sam_segmentation_widget(
     viewer: napari.viewer.Viewer,
     image_layer: Image,
     points_layer: Points,
     model_type: str = "vit_b",
     checkpoint_path: str = "",
+    backend: str = "pytorch",
+    intra_op_threads: int = 0,
+    inter_op_threads: int = 0,
+    max_cached_models: int = 2,
+    max_cache_memory_mb: int = 0,
+    embedding_cache_dir: str = "",
+    propagate: bool = False,
+    min_area_ratio: float = 0.5,
+    min_iou: float = 0.3,
+    tile_size: int = 0,
+    tile_overlap: int = DEFAULT_TILE_OVERLAP,
 ):
-    # 检测设备（GPU 或 CPU）
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"使用设备: {device}")
-
-    # 如果没有提供检查点路径，下载默认的模型检查点文件
-    if not checkpoint_path:
-        cache_dir = os.path.expanduser("~/.cache/segment_anything")
-        checkpoint_path = download_default_checkpoint(model_type, cache_dir)
-
-    # 加载模型到指定设备
-    sam = sam_model_registry[model_type](checkpoint=checkpoint_path)
-    sam.to(device)
-    print(f"模型已加载到设备: {next(sam.parameters()).device}")
-
-    predictor = SamPredictor(sam)
-
     # 获取图像数据
     image = image_layer.data
 
-    # 如果是 Dask 数组，转换为 NumPy 数组
-    if isinstance(image, da.core.Array):
-        image = image.compute()
-
     # 检查图像维度
     if image.ndim != 3:
         print("图像应为 3D 数据，形状为 (Z, Y, X)")
-        return
+        return None
 
     # 获取提示点
-    if points_layer is not None and len(points_layer.data) > 0:
-        point_data = points_layer.data
-        label_property = points_layer.properties.get('label', None)
-        if label_property is None:
-            point_labels = np.ones(len(points_layer.data), dtype=int)
-        else:
-            point_labels = np.array(label_property)
-            if len(point_labels) != len(points_layer.data):
-                print("点层的 'label' 属性长度与点的数量不一致。")
-                return
-    else:
-        print("请在图像上添加提示点。")
-        return
-
-    z_indices = np.unique(point_data[:, 0].astype(int))
-    print(f"包含提示点的切片索引: {z_indices}")
-
-    masks = np.zeros_like(image, dtype=np.uint8)
-
-    for z in z_indices:
-        slice_image = image[z, :, :]
-
-        if slice_image.ndim == 2:
-            slice_image_rgb = np.stack([slice_image] * 3, axis=-1)
-        elif slice_image.shape[2] == 1:
-            slice_image_rgb = np.repeat(slice_image, 3, axis=2)
-        else:
-            slice_image_rgb = slice_image
-
-        predictor.set_image(slice_image_rgb)
-
-        mask_z = point_data[:, 0].astype(int) == z
-        coords = point_data[mask_z][:, 1:]
-        labels = point_labels[mask_z]
-
-        if len(coords) == 0:
-            continue
-
-        coords = coords[:, ::-1]
-
-        mask_slice, _, _ = predictor.predict(
-            point_coords=coords,
-            point_labels=labels,
-            multimask_output=False,
+    prompts = get_prompt_points(points_layer)
+    if prompts is None:
+        return None
+    point_data, point_labels, object_ids = prompts
+    if tile_size and propagate:
+        print("分块模式暂不支持沿 Z 传播，请关闭其中一项。")
+        return None
+    if tile_size and tile_overlap >= tile_size:
+        print("分块重叠必须小于分块大小。")
+        return None
+    total = len(np.unique(point_data[:, 0].astype(int)))
+
+    dtype = np.result_type(np.uint16, label_dtype(object_ids.max()))
+    segmentation_layer = get_segmentation_layer(viewer, image_layer, reset=True, dtype=dtype)
+
+    image_id = image_layer.unique_id
+
+    # 传播的切片数、分块模式下产出的块数事先未知，进度条显示为不确定状态
+    progress_total = 0 if propagate or tile_size else total
+
+    # 模型加载、数据读取和逐切片推理都在后台线程中进行，界面保持响应
+    @thread_worker(progress={"total": progress_total, "desc": "SAM 分割"})
+    def run():
+        # 从进程级缓存获取模型，只有首次使用时才从磁盘加载；
+        # 没有提供检查点路径时下载默认的模型检查点文件
+        get_model_cache().configure(
+            max_models=max_cached_models,
+            max_memory_bytes=max_cache_memory_mb * 1024 * 1024 or None,
+            intra_op_threads=intra_op_threads,
+            inter_op_threads=inter_op_threads,
+        )
+        # 没有 GPU 时可选择量化或 ONNX Runtime 后端，首次使用 ONNX 后端时会导出模型
+        predictor, model_key = load_predictor(model_type, checkpoint_path, backend=backend)
+        print(f"模型已加载到设备: {predictor.device}")
+        embedding_cache = get_embedding_cache(embedding_cache_dir)
+
+        # Dask/Zarr 图像不整体读入内存，只读取包含提示点的切片
+        start = time.perf_counter()
+        if tile_size:
+            # 大切片按重叠图块编码，只处理提示点触及的图块，逐块写入结果
+            blocks = segment_prompted_slices_tiled(
+                predictor, image, point_data, point_labels, object_ids,
+                embedding_cache, model_key, image_id,
+                tile_size=tile_size, overlap=tile_overlap,
+            )
+            done = []
+            for z, region, block in blocks:
+                if not done or done[-1] != z:
+                    done.append(z)
+                seconds = (time.perf_counter() - start) / len(done)
+                yield z, region, block, len(done), total, seconds
+            return
+
+        slices = segment_prompted_slices(
+            predictor, image, point_data, point_labels, object_ids,
+            embedding_cache, model_key, image_id,
+        )
+        seeds = {}
+        for index, (z, mask_slice) in enumerate(slices, start=1):
+            seeds[z] = mask_slice
+            seconds = (time.perf_counter() - start) / index
+            yield z, _WHOLE_SLICE, mask_slice, index, progress_total, seconds
+
+        if not propagate:
+            return
+        # 以提示切片的结果为种子，逐层向上下传播，直到对象面积或 IoU 低于阈值
+        propagated = propagate_from_seeds(
+            predictor, image, seeds, embedding_cache, model_key, image_id,
+            min_area_ratio=min_area_ratio, min_iou=min_iou,
         )
-        
-        print(f"Generated mask slice shape: {mask_slice.shape}, dtype: {mask_slice.dtype}")
-        masks[z, :, :] = mask_slice[0]
-        print(f"Updated mask at slice {z}. Non-zero values: {np.count_nonzero(masks[z, :, :])}")
-
-    segmentation_layer_name = f"SAM 分割结果 ({image_layer.name})"
-    if segmentation_layer_name in viewer.layers:
-        segmentation_layer = viewer.layers[segmentation_layer_name]
-        segmentation_layer.data = masks
-        print(f"已更新标签层: {segmentation_layer_name}")
-    else:
-        viewer.add_labels(masks, name=segmentation_layer_name)
-        print(f"已添加新的标签层: {segmentation_layer_name}")
+        for index, (z, mask_slice) in enumerate(propagated, start=len(seeds) + 1):
+            seconds = (time.perf_counter() - start) / index
+            yield z, _WHOLE_SLICE, mask_slice, index, progress_total, seconds
+
+    def on_yielded(result):
+        if worker.abort_requested:
+            return
+        z, region, mask_slice, index, total, seconds = result
+        # 每完成一个切片（分块模式下为一个图块单元）就更新标签层，无需等待整个体数据；
+        # 全零结果不写入，稀疏标签数组不为它分配块
+        if mask_slice.any():
+            segmentation_layer.data[(z,) + region] = mask_slice
+        segmentation_layer.refresh()
+        if region is not _WHOLE_SLICE:
+            return
+        count = f"{index}/{total}" if total else f"{index}"
+        print(f"已完成切片 {count} (z={z})，非零像素: {np.count_nonzero(mask_slice)}，{seconds:.2f} 秒/切片")
+
+    previous = _CURRENT_RUN["worker"]
+    if previous is not None:
+        previous.quit()
+
+    def on_finished():
+        if _CURRENT_RUN["worker"] is worker:
+            _CURRENT_RUN["worker"] = None
+
+    worker = run()
+    worker.yielded.connect(on_yielded)
+    worker.finished.connect(on_finished)
+    _CURRENT_RUN["worker"] = worker
+    worker.start()
+    return worker
+
+@magic_factory(
+    call_button="自动分割",
+    backend={"label": "推理后端", "choices": list(BACKENDS)},
+    embedding_cache_dir={"label": "编码缓存目录 (可选)"},
+    points_per_side={"label": "每边网格点数", "min": 4, "max": 128},
+    points_per_batch={"label": "每批点数", "min": 1, "max": 4096},
+    pred_iou_thresh={"label": "预测 IoU 阈值", "min": 0.0, "max": 1.0, "step": 0.01},
+    stability_thresh={"label": "稳定性阈值", "min": 0.0, "max": 1.0, "step": 0.01},
+    nms_thresh={"label": "NMS 阈值", "min": 0.0, "max": 1.0, "step": 0.05},
+    min_area={"label": "最小面积 (像素)", "min": 0, "max": 1000000},
+    min_iou={"label": "跨切片匹配 IoU", "min": 0.0, "max": 1.0, "step": 0.05},
+)
+def sam_auto_segmentation_widget(
+    viewer: napari.viewer.Viewer,
+    image_layer: Image,
+    model_type: str = "vit_b",
+    checkpoint_path: str = "",
+    backend: str = "pytorch",
+    embedding_cache_dir: str = "",
+    points_per_side: int = DEFAULT_POINTS_PER_SIDE,
+    points_per_batch: int = DEFAULT_POINTS_PER_BATCH,
+    pred_iou_thresh: float = 0.88,
+    stability_thresh: float = 0.95,
+    nms_thresh: float = 0.7,
+    min_area: int = 0,
+    min_iou: float = 0.3,
+):
+    """无需提示点，对整个体数据做网格提示的自动分割，相邻切片的实例按重叠合并。"""
+    if image_layer is None or image_layer.data.ndim != 3:
+        print("图像应为 3D 数据，形状为 (Z, Y, X)")
+        return None
+
+    image = image_layer.data
+    total = image.shape[0]
+    # 整卷实例数可能超过 uint16 的范围
+    segmentation_layer = get_segmentation_layer(viewer, image_layer, reset=True, dtype=np.uint32)
+    image_id = image_layer.unique_id
+
+    @thread_worker(progress={"total": total, "desc": "SAM 自动分割"})
+    def run():
+        # 与提示分割使用同一个模型缓存，已加载的模型直接复用
+        predictor, model_key = load_predictor(model_type, checkpoint_path, backend=backend)
+        print(f"模型已加载到设备: {predictor.device}")
+        slices = auto_segment_volume(
+            predictor, image, get_embedding_cache(embedding_cache_dir), model_key, image_id,
+            points_per_side=points_per_side,
+            points_per_batch=points_per_batch,
+            pred_iou_thresh=pred_iou_thresh,
+            stability_thresh=stability_thresh,
+            nms_thresh=nms_thresh,
+            min_area=min_area,
+            min_iou=min_iou,
+        )
+        start = time.perf_counter()
+        for index, (z, label_map) in enumerate(slices, start=1):
+            seconds = (time.perf_counter() - start) / index
+            yield z, _WHOLE_SLICE, label_map, index, total, seconds
+
+    def on_yielded(result):
+        if worker.abort_requested:
+            return
+        z, _, label_map, index, total, seconds = result
+        if label_map.any():
+            segmentation_layer.data[z] = label_map
+        segmentation_layer.refresh()
+        print(
+            f"已完成切片 {index}/{total} (z={z})，实例数: {len(np.unique(label_map)) - 1}，"
+            f"{60 / max(seconds, 1e-9):.1f} 切片/分钟"
+        )
+
+    previous = _CURRENT_RUN["worker"]
+    if previous is not None:
+        previous.quit()
+
+    def on_finished():
+        if _CURRENT_RUN["worker"] is worker:
+            _CURRENT_RUN["worker"] = None
+
+    worker = run()
+    worker.yielded.connect(on_yielded)
+    worker.finished.connect(on_finished)
+    _CURRENT_RUN["worker"] = worker
+    worker.start()
+    return worker
+
 
 def main():
     viewer = napari.Viewer()
@@ -149,7 +350,7 @@ def main():
             if not points_layer:
                 points_layer = viewer.add_points(
                     name='提示点',
-                    properties={'label': []},
+                    properties={'label': [], 'object_id': []},
                     face_color='label',
                     face_color_cycle=['red', 'blue'],
                     edge_color='white',
@@ -169,8 +370,10 @@ def main():
             if label is not None:
                 position = event.position
                 data_position = layer.world_to_data(position)
-                layer.add([data_position], properties={'label': [label]})
-                print(f"Added point: {data_position}, Label: {label}")
+                object_id = widget.object_id.value
+                set_point_defaults(layer, label=label, object_id=object_id)
+                layer.add([data_position])
+                print(f"Added point: {data_position}, Label: {label}, Object: {object_id}")
                 print(f"All points in layer after addition: {layer.data}")
             else:
                 print("Unsupported mouse button clicked.")
@@ -183,7 +386,7 @@ def main():
             if not points_layer:
                 points_layer = viewer.add_points(
                     name='提示点',
-                    properties={'label': []},
+                    properties={'label': [], 'object_id': []},
                     face_color='red',  # Updated to use 'red' directly
                     edge_color='white',
                     size=10,
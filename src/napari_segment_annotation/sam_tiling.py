@@ -0,0 +1,250 @@
+"""
+大切片的分块 SAM 推理。
+
+``SamPredictor.set_image`` 会把图像长边缩放到 1024 像素，8k×8k 的切片因此丢失细节。
+分块模式将切片划分为互相重叠的图块，只编码包含提示点、或落在对象提示框内的图块，
+各图块的解码 logits 在重叠区按权重线性过渡后拼接。
+
+拼接以“单元”为单位输出：每个单元属于一个图块（边界取在相邻图块重叠区的中点），
+覆盖该单元的所有图块处理完后立即判定并产出，不保留整个切片大小的中间结果。
+运行时间与被触及的图块数成正比，峰值内存与图块大小而不是切片面积成正比。
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .lazy_volume import read_tile
+from .sam_embedding_cache import apply_embedding, slice_to_rgb
+from .sam_inference import (
+    label_dtype,
+    object_logits,
+    prompts_on_slice,
+    stack_object_prompts,
+)
+
+DEFAULT_TILE_SIZE = 1024
+DEFAULT_TILE_OVERLAP = 128
+
+
+def tile_starts(size, tile_size, overlap):
+    """单个轴上各图块的起点，步长为 ``tile_size - overlap``，最后一块与边界对齐。"""
+    if size <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    if stride <= 0:
+        raise ValueError("图块重叠必须小于图块大小")
+    return list(range(0, size - tile_size, stride)) + [size - tile_size]
+
+
+def cell_bounds(starts, size, tile_size):
+    """单个轴上各单元的边界，单元 k 属于图块 k，边界取相邻图块重叠区的中点。"""
+    bounds = [0]
+    for previous, start in zip(starts[:-1], starts[1:]):
+        bounds.append((start + min(previous + tile_size, size)) // 2)
+    bounds.append(size)
+    return bounds
+
+
+def blend_ramp(length, overlap):
+    """图块边缘向内线性增长的权重，重叠区之外为 1，边缘处仍大于 0。"""
+    distance = np.minimum(np.arange(length), np.arange(length)[::-1]) + 1
+    return np.minimum(distance / (overlap + 1), 1.0).astype(np.float32)
+
+
+def tile_prompts(coords, labels, object_ids, box):
+    """图块内各对象的提示，坐标已平移到图块内。
+
+    在图块中有正点的对象使用图块内的点；图块中没有正点、但对象的提示框
+    （该对象所有正点的外接框）与图块相交的对象使用裁剪到图块内的提示框。
+    返回 ((point_ids, batch_coords, batch_labels), (box_ids, boxes))。
+    """
+    x0, y0, x1, y1 = box
+    inside = (coords[:, 0] >= x0) & (coords[:, 0] < x1) & (coords[:, 1] >= y0) & (coords[:, 1] < y1)
+    offset = np.array([x0, y0], dtype=float)
+    point_prompts = stack_object_prompts(coords[inside] - offset, labels[inside], object_ids[inside])
+
+    box_ids = []
+    boxes = []
+    positive = labels == 1
+    for object_id in np.unique(object_ids[positive]):
+        if object_id in point_prompts[0]:
+            continue
+        mine = coords[positive & (object_ids == object_id)]
+        bx0, by0 = np.maximum(mine.min(axis=0), (x0, y0))
+        bx1, by1 = np.minimum(mine.max(axis=0), (x1 - 1, y1 - 1))
+        if bx0 <= bx1 and by0 <= by1:
+            box_ids.append(object_id)
+            boxes.append((bx0 - x0, by0 - y0, bx1 - x0, by1 - y0))
+    box_prompts = (np.array(box_ids, dtype=int), np.array(boxes, dtype=float).reshape(-1, 4))
+    return point_prompts, box_prompts
+
+
+def touched_tiles(coords, labels, object_ids, ys, xs, tile_size, shape):
+    """返回包含提示点或与对象提示框相交的图块 (row, col)，按行优先排序。"""
+    height, width = shape
+    touched = set()
+    positive = labels == 1
+    for object_id in np.unique(object_ids[positive]):
+        mine = coords[positive & (object_ids == object_id)]
+        (px0, py0), (px1, py1) = mine.min(axis=0), mine.max(axis=0)
+        for row, y0 in enumerate(ys):
+            if y0 > py1 or min(y0 + tile_size, height) <= py0:
+                continue
+            for col, x0 in enumerate(xs):
+                if x0 <= px1 and min(x0 + tile_size, width) > px0:
+                    touched.add((row, col))
+    return sorted(touched)
+
+
+def segment_tiled_slice(
+    predictor,
+    image,
+    z,
+    coords,
+    labels,
+    object_ids,
+    embedding_cache,
+    model_key,
+    image_id,
+    tile_size=DEFAULT_TILE_SIZE,
+    overlap=DEFAULT_TILE_OVERLAP,
+    max_batch=32,
+):
+    """分块分割切片 z，逐个产出 ((slice_y, slice_x), label_block)。
+
+    ``coords`` 为 (X, Y) 顺序的提示点坐标。未被任何图块触及的区域不产出，保持为 0。
+    """
+    height, width = image.shape[1:3]
+    ys, xs = tile_starts(height, tile_size, overlap), tile_starts(width, tile_size, overlap)
+    cell_ys = cell_bounds(ys, height, tile_size)
+    cell_xs = cell_bounds(xs, width, tile_size)
+    tiles = touched_tiles(coords, labels, object_ids, ys, xs, tile_size, (height, width))
+    dtype = label_dtype(object_ids.max() if len(object_ids) else 0)
+
+    def tile_region(tile):
+        row, col = tile
+        return (
+            slice(ys[row], min(ys[row] + tile_size, height)),
+            slice(xs[col], min(xs[col] + tile_size, width)),
+        )
+
+    def overlapping_cells(tile):
+        region_y, region_x = tile_region(tile)
+        rows = [r for r in range(len(ys)) if cell_ys[r] < region_y.stop and cell_ys[r + 1] > region_y.start]
+        cols = [c for c in range(len(xs)) if cell_xs[c] < region_x.stop and cell_xs[c + 1] > region_x.start]
+        return [(r, c) for r in rows for c in cols]
+
+    # 每个单元在最后一个覆盖它的图块处理完后即可输出
+    last_tile = {}
+    for index, tile in enumerate(tiles):
+        for cell in overlapping_cells(tile):
+            last_tile[cell] = index
+
+    def encode(tile):
+        region = tile_region(tile)
+        tile_image = read_tile(image, z, region)
+        key = embedding_cache.make_key(
+            model_key, (image_id, region[0].start, region[1].start), z, tile_image
+        )
+        return embedding_cache.get_or_compute(key, predictor, slice_to_rgb(tile_image))
+
+    # cell -> {object_id: [加权 logits 之和, 权重之和]}
+    pending = {}
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sam-tile")
+    try:
+        queue = deque(executor.submit(encode, tile) for tile in tiles[:1])
+        for index, tile in enumerate(tiles):
+            embedding = queue.popleft().result()
+            if index + 1 < len(tiles):
+                queue.append(executor.submit(encode, tiles[index + 1]))
+            apply_embedding(predictor, embedding)
+
+            region_y, region_x = tile_region(tile)
+            window = np.outer(
+                blend_ramp(region_y.stop - region_y.start, overlap),
+                blend_ramp(region_x.stop - region_x.start, overlap),
+            )
+            tile_box = (region_x.start, region_y.start, region_x.stop, region_y.stop)
+            (point_ids, batch_coords, batch_labels), (box_ids, boxes) = tile_prompts(
+                coords, labels, object_ids, tile_box
+            )
+            groups = []
+            if len(point_ids):
+                groups.append((point_ids, {"batch_coords": batch_coords, "batch_labels": batch_labels}))
+            if len(box_ids):
+                groups.append((box_ids, {"boxes": boxes}))
+
+            cells = overlapping_cells(tile)
+            for ids, prompts in groups:
+                for start, logits in object_logits(predictor, max_batch=max_batch, **prompts):
+                    logits = logits.cpu().numpy()
+                    for object_id, object_logit in zip(ids[start:], logits):
+                        weighted = object_logit * window
+                        for row, col in cells:
+                            cy = slice(max(cell_ys[row], region_y.start), min(cell_ys[row + 1], region_y.stop))
+                            cx = slice(max(cell_xs[col], region_x.start), min(cell_xs[col + 1], region_x.stop))
+                            local = (
+                                slice(cy.start - region_y.start, cy.stop - region_y.start),
+                                slice(cx.start - region_x.start, cx.stop - region_x.start),
+                            )
+                            cell_shape = (cell_ys[row + 1] - cell_ys[row], cell_xs[col + 1] - cell_xs[col])
+                            sums = pending.setdefault((row, col), {}).setdefault(
+                                object_id,
+                                [np.zeros(cell_shape, np.float32), np.zeros(cell_shape, np.float32)],
+                            )
+                            target = (
+                                slice(cy.start - cell_ys[row], cy.stop - cell_ys[row]),
+                                slice(cx.start - cell_xs[col], cx.stop - cell_xs[col]),
+                            )
+                            sums[0][target] += weighted[local]
+                            sums[1][target] += window[local]
+
+            for row, col in cells:
+                if last_tile[(row, col)] != index:
+                    continue
+                objects = pending.pop((row, col), None)
+                if not objects:
+                    continue
+                region = (slice(cell_ys[row], cell_ys[row + 1]), slice(cell_xs[col], cell_xs[col + 1]))
+                yield region, _decide_cell(objects, predictor.model.mask_threshold, dtype)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _decide_cell(objects, threshold, dtype):
+    """单元内每个像素取融合 logits 最大的对象，低于阈值的像素为 0。"""
+    ids = np.array(list(objects), dtype=int)
+    blended = np.stack([
+        np.where(weight > 0, total / np.maximum(weight, 1e-6), -np.inf)
+        for total, weight in objects.values()
+    ])
+    best = blended.argmax(axis=0)
+    foreground = np.take_along_axis(blended, best[None], axis=0)[0] > threshold
+    return np.where(foreground, ids[best], 0).astype(dtype)
+
+
+def segment_prompted_slices_tiled(
+    predictor,
+    image,
+    point_data,
+    point_labels,
+    object_ids,
+    embedding_cache,
+    model_key,
+    image_id,
+    tile_size=DEFAULT_TILE_SIZE,
+    overlap=DEFAULT_TILE_OVERLAP,
+):
+    """分块分割每个包含提示点的切片，产出 (z, (slice_y, slice_x), label_block)。"""
+    for z in np.unique(point_data[:, 0].astype(int)):
+        coords, labels, ids = prompts_on_slice(point_data, point_labels, object_ids, z)
+        if len(coords) == 0:
+            continue
+        blocks = segment_tiled_slice(
+            predictor, image, z, coords, labels, ids,
+            embedding_cache, model_key, image_id,
+            tile_size=tile_size, overlap=overlap,
+        )
+        for region, block in blocks:
+            yield z, region, block
@@ -0,0 +1,167 @@
+"""
+逐切片 TIFF 序列的延迟读取。
+
+显微镜通常把体数据导出为一个目录下每个 Z 切片一个 TIFF 文件。这里只读取第一个文件的
+元数据来确定形状和数据类型，整个序列包装为每个切片一块的 Dask 数组：打开几乎不耗时，
+浏览时只解码当前显示的切片；一次读取多个切片时在线程池中并行解码。
+写入时同样逐切片流式写出多页 TIFF，不整体读入内存。
+"""
+import glob
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import dask.array as da
+import numpy as np
+import tifffile
+from dask import delayed
+from dask.base import tokenize
+
+TIFF_SUFFIXES = (".tif", ".tiff")
+
+
+def _natural_key(path):
+    """按文件名中的数字大小排序，``slice_2`` 排在 ``slice_10`` 之前。"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", path)]
+
+
+def is_tiff(path):
+    return str(path).lower().endswith(TIFF_SUFFIXES)
+
+
+def is_tiff_stack_path(path):
+    """``path`` 是否为 TIFF 目录、至少匹配一个 TIFF 文件的 glob 模式或多个 TIFF 文件的列表。
+
+    文件名本身含有 ``*``、``?``、``[`` 的已有文件（如 ``brain[1].npy``）不视为 glob 模式。
+    """
+    if isinstance(path, (list, tuple)):
+        return len(path) > 1 and all(is_tiff(p) for p in path)
+    path = str(path)
+    if glob.has_magic(path) and not os.path.exists(path):
+        return any(is_tiff(f) for f in glob.iglob(path))
+    return os.path.isdir(path) and any(is_tiff(name) for name in os.listdir(path))
+
+
+def list_tiff_files(path):
+    """目录、glob 模式或路径列表对应的 TIFF 文件，按文件名自然排序。"""
+    if isinstance(path, (list, tuple)):
+        files = [str(p) for p in path]
+    elif os.path.isdir(path):
+        files = [os.path.join(path, name) for name in os.listdir(path)]
+    else:
+        files = glob.glob(str(path))
+    return sorted((f for f in files if is_tiff(f)), key=_natural_key)
+
+
+class TiffStack:
+    """由逐切片 TIFF 文件组成的只读数组，``__getitem__`` 只解码选中的切片。
+
+    Parameters
+    ----------
+    files : list of str
+        按 Z 顺序排列的文件，每个文件是一个 (Y, X) 或 (Y, X, C) 切片。
+    max_workers : int, optional
+        同时解码的线程数，默认由 `ThreadPoolExecutor` 决定。
+    """
+
+    def __init__(self, files, max_workers=None):
+        if not files:
+            raise FileNotFoundError("没有找到 TIFF 文件。")
+        self.files = list(files)
+        self.max_workers = max_workers
+        # 只读取第一个文件的元数据，假定其余切片形状和类型相同
+        with tifffile.TiffFile(self.files[0]) as tif:
+            series = tif.series[0]
+            plane_shape, self.dtype = tuple(series.shape), np.dtype(series.dtype)
+        self.shape = (len(self.files),) + plane_shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read_plane(self, z):
+        plane = tifffile.imread(self.files[z])
+        if plane.shape != self.shape[1:]:
+            raise ValueError(
+                f"{self.files[z]} 的形状 {plane.shape} 与第一个切片的 {self.shape[1:]} 不一致"
+            )
+        return plane.astype(self.dtype, copy=False)
+
+    def __getitem__(self, index):
+        index = index if isinstance(index, tuple) else (index,)
+        z_index, rest = index[0], index[1:]
+        if isinstance(z_index, (int, np.integer)):
+            return self.read_plane(int(z_index) % len(self))[rest]
+
+        z_values = np.arange(len(self))[z_index]
+        out = np.empty((len(z_values),) + self.shape[1:], dtype=self.dtype)
+        if len(z_values) == 1:
+            out[0] = self.read_plane(z_values[0])
+        elif len(z_values):
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for i, plane in enumerate(executor.map(self.read_plane, z_values)):
+                    out[i] = plane
+        return out[(slice(None),) + rest]
+
+
+def read_tiff_stack(path, max_workers=None):
+    """以每个切片一块的 Dask 数组延迟打开 TIFF 序列（目录、glob 模式或文件列表）。"""
+    stack = TiffStack(list_tiff_files(path), max_workers=max_workers)
+    # 每块一个切片，dask 计算多个块时由其线程池并行解码；
+    # 按文件列表命名，避免 dask 对整个对象求哈希
+    return da.from_array(
+        stack,
+        chunks=(1,) + stack.shape[1:],
+        name=f"tiff-stack-{tokenize(stack.files, stack.shape, str(stack.dtype))}",
+        asarray=False,
+        fancy=False,
+        meta=np.empty((0,) * stack.ndim, dtype=stack.dtype),
+    )
+
+
+def _read_page(path, index):
+    return tifffile.imread(path, key=index)
+
+
+def read_tiff_file(path):
+    """以 Dask 数组延迟打开单个 TIFF 文件，多页文件每页一块，只解码显示的页。"""
+    path = str(path)
+    with tifffile.TiffFile(path) as tif:
+        series = tif.series[0]
+        shape, dtype = tuple(series.shape), np.dtype(series.dtype)
+        count = len(series.pages)
+        page_shape = tuple(series.pages[0].shape)
+    if count == 1:
+        return da.from_array(tifffile.imread(path), chunks=-1)
+    token = tokenize(path, os.path.getmtime(path), shape, str(dtype))
+    pages = [
+        da.from_delayed(delayed(_read_page)(path, i, dask_key_name=f"tiff-page-{token}-{i}"), page_shape, dtype)
+        for i in range(count)
+    ]
+    return da.stack(pages).reshape(shape)
+
+
+def write_tiff_pages(path, data, dtype=None, bigtiff=None):
+    """把体数据逐切片写入一个多页 TIFF，一次只在内存中保留两个切片。
+
+    下一个切片在后台线程中读取（Dask/Zarr 数据可能需要解码），与当前切片的写入重叠。
+    ``bigtiff`` 默认在数据超过约 4 GB 时启用。
+    """
+    dtype = np.dtype(dtype or data.dtype)
+    if bigtiff is None:
+        bigtiff = int(np.prod(data.shape, dtype=np.int64)) * dtype.itemsize > 2 ** 32 - 2 ** 25
+    planes = list(range(data.shape[0])) if data.ndim > 2 else [Ellipsis]
+
+    def read(z):
+        return np.asarray(data[z]).astype(dtype, copy=False)
+
+    with tifffile.TiffWriter(path, bigtiff=bigtiff) as tif, ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(read, planes[0])
+        for i in range(len(planes)):
+            plane = future.result()
+            if i + 1 < len(planes):
+                future = executor.submit(read, planes[i + 1])
+            tif.write(plane, contiguous=True, photometric="minisblack")
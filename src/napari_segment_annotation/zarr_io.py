@@ -0,0 +1,244 @@
+"""
+分块压缩的 Zarr / OME-Zarr 读写与多尺度金字塔。
+
+写入遵循 OME-Zarr 0.4 的 ``multiscales`` 元数据：第 0 层是原始分辨率，之后每层在
+Y/X 方向上缩小一半，直到长边不超过 ``min_size``。图像层用均值降采样，标签层用众数
+降采样（不产生原本不存在的标签值）。由于只在平面内降采样，每个 Z 切片的所有金字塔层
+都能从该切片独立算出，写入按切片在线程池中并行，峰值内存与切片数量无关。
+
+读取时每个层级包装为 Dask 数组，napari 只加载当前可见层级和范围内的块。
+"""
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import dask.array as da
+import numpy as np
+import zarr
+from numcodecs import Blosc
+
+OME_ZARR_VERSION = "0.4"
+
+# 平面内的块大小，Z 方向每块一个切片
+DEFAULT_CHUNK_EDGE = 512
+DEFAULT_MIN_SIZE = 256
+
+DEFAULT_COMPRESSOR = Blosc(cname="zstd", clevel=5, shuffle=Blosc.BITSHUFFLE)
+
+
+def pyramid_shapes(shape, axes, min_size=DEFAULT_MIN_SIZE):
+    """各金字塔层的形状：``axes`` 上每层减半（向上取整），直到长边不超过 ``min_size``。"""
+    shapes = [tuple(shape)]
+    while max(shapes[-1][axis] for axis in axes) > min_size:
+        shapes.append(tuple(
+            (size + 1) // 2 if axis in axes else size
+            for axis, size in enumerate(shapes[-1])
+        ))
+    return shapes
+
+
+def _corners(block, axes):
+    """把 ``axes`` 补齐为偶数长度（复制边缘）后，返回每个 2×2 窗口中各位置的取值。"""
+    pad = [(0, block.shape[axis] % 2 if axis in axes else 0) for axis in range(block.ndim)]
+    if any(after for _, after in pad):
+        block = np.pad(block, pad, mode="edge")
+    corners = []
+    for offsets in itertools.product((0, 1), repeat=len(axes)):
+        index = [slice(None)] * block.ndim
+        for axis, offset in zip(axes, offsets):
+            index[axis] = slice(offset, None, 2)
+        corners.append(block[tuple(index)])
+    return corners
+
+
+def downsample_mean(block, axes):
+    """在 ``axes`` 上做 2 倍均值降采样，整数类型四舍五入后保持原类型。"""
+    corners = _corners(block, axes)
+    mean = np.mean(corners, axis=0, dtype=np.float64)
+    if np.issubdtype(block.dtype, np.integer):
+        mean = np.rint(mean)
+    return mean.astype(block.dtype)
+
+
+def downsample_mode(block, axes):
+    """在 ``axes`` 上做 2 倍众数降采样，出现次数相同时取窗口中靠前的值。"""
+    candidates = np.stack(_corners(block, axes))
+    counts = (candidates[:, None] == candidates[None]).sum(axis=1)
+    best = counts.argmax(axis=0)
+    return np.take_along_axis(candidates, best[None], axis=0)[0]
+
+
+def default_axes(ndim, rgb=False):
+    """OME-Zarr 的轴描述；RGB 图像的颜色通道在最后。"""
+    types = {"t": "time", "c": "channel", "z": "space", "y": "space", "x": "space"}
+    count = ndim - 1 if rgb else ndim
+    names = list(types)[-count:] if count <= len(types) else [f"dim_{i}" for i in range(count)]
+    if rgb:
+        names.append("c")
+    return [{"name": name, "type": types[name]} if name in types else {"name": name} for name in names]
+
+
+def write_multiscale(
+    group,
+    data,
+    name=None,
+    labels=False,
+    rgb=False,
+    scale=None,
+    chunk_edge=DEFAULT_CHUNK_EDGE,
+    min_size=DEFAULT_MIN_SIZE,
+    compressor=DEFAULT_COMPRESSOR,
+    max_workers=None,
+):
+    """把 ``data`` 及其金字塔写入 Zarr 组 ``group``，并写入 OME-Zarr 元数据。
+
+    Parameters
+    ----------
+    data : array-like
+        NumPy、Dask 或 Zarr 数组，按切片读取，不整体读入内存。
+        napari 的多尺度数据（数组列表）只使用第 0 层。
+    labels : bool
+        标签数据用众数降采样，并写入 ``image-label`` 元数据。
+    rgb : bool
+        最后一维为颜色通道，不参与降采样。
+    scale : sequence of float, optional
+        第 0 层的像素尺寸（napari 图层的 ``scale``）。
+    max_workers : int, optional
+        并行写入的线程数，默认由 `ThreadPoolExecutor` 决定。
+    """
+    if isinstance(data, (list, tuple)):
+        data = data[0]
+    ndim = data.ndim
+    axes = tuple(range(ndim - 3, ndim - 1) if rgb else range(ndim - 2, ndim))
+    shapes = pyramid_shapes(data.shape, axes, min_size)
+    chunks = tuple(
+        min(size, chunk_edge) if axis in axes else (size if rgb and axis == ndim - 1 else 1)
+        for axis, size in enumerate(data.shape)
+    )
+    arrays = [
+        group.create_dataset(
+            str(level),
+            shape=shape,
+            chunks=tuple(min(c, s) for c, s in zip(chunks, shape)),
+            dtype=data.dtype,
+            compressor=compressor,
+            dimension_separator="/",
+            overwrite=True,
+        )
+        for level, shape in enumerate(shapes)
+    ]
+    downsample = downsample_mode if labels else downsample_mean
+
+    # 平面之前的所有维度逐个遍历，每个平面独立计算所有层级
+    leading = data.shape[:axes[0]]
+
+    def write_plane(index):
+        plane = index + (Ellipsis,)
+        block = np.asarray(data[plane])
+        plane_axes = tuple(axis - len(index) for axis in axes)
+        arrays[0][plane] = block
+        for array in arrays[1:]:
+            block = downsample(block, plane_axes)
+            array[plane] = block
+
+    planes = list(np.ndindex(*leading)) if leading else [()]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 逐个取结果，使写入中的异常在这里抛出
+        for _ in executor.map(write_plane, planes):
+            pass
+
+    scale = list(scale) if scale is not None else [1.0] * ndim
+    if len(scale) < ndim:
+        # napari 的 RGB 图层不为颜色通道记录 scale
+        scale += [1.0] * (ndim - len(scale))
+    datasets = []
+    for level in range(len(shapes)):
+        factor = [2 ** level if axis in axes else 1 for axis in range(ndim)]
+        datasets.append({
+            "path": str(level),
+            "coordinateTransformations": [
+                {"type": "scale", "scale": [float(s * f) for s, f in zip(scale, factor)]}
+            ],
+        })
+    group.attrs["multiscales"] = [{
+        "version": OME_ZARR_VERSION,
+        "name": name or "",
+        "axes": default_axes(ndim, rgb),
+        "datasets": datasets,
+        "type": "mode" if labels else "mean",
+    }]
+    if labels:
+        group.attrs["image-label"] = {"version": OME_ZARR_VERSION}
+    return arrays
+
+
+def write_ome_zarr(path, layers, **kwargs):
+    """把若干图层写入一个 OME-Zarr 目录，返回写入的路径。
+
+    ``layers`` 为 napari 的 (data, meta, layer_type) 列表。第一个图像层写在根组，
+    其余图像层写入以图层名命名的子组，标签层写入 ``labels/<name>``。
+    ``kwargs`` 传给 `write_multiscale`。
+    """
+    root = zarr.open_group(path, mode="w")
+    label_names = []
+    root_used = False
+    for data, meta, layer_type in layers:
+        name = meta.get("name") or layer_type
+        options = dict(name=name, scale=meta.get("scale"), **kwargs)
+        if layer_type == "labels":
+            label_names.append(name)
+            group = root.require_group("labels").require_group(name)
+            write_multiscale(group, data, labels=True, **options)
+        elif layer_type == "image":
+            group = root if not root_used else root.require_group(name)
+            root_used = True
+            write_multiscale(group, data, rgb=bool(meta.get("rgb")), **options)
+    if label_names:
+        root["labels"].attrs["labels"] = label_names
+    return [path]
+
+
+def _read_group(group, layer_type=None):
+    """读取一个带 ``multiscales`` 元数据的组，返回 napari 的 (data, meta, layer_type)。"""
+    multiscale = group.attrs["multiscales"][0]
+    levels = [da.from_zarr(group[dataset["path"]]) for dataset in multiscale["datasets"]]
+    meta = {}
+    if multiscale.get("name"):
+        meta["name"] = multiscale["name"]
+    for transform in multiscale["datasets"][0].get("coordinateTransformations", []):
+        if transform.get("type") == "scale":
+            meta["scale"] = transform["scale"]
+    axes = multiscale.get("axes", [])
+    if layer_type is None:
+        layer_type = "labels" if "image-label" in group.attrs else "image"
+    if layer_type == "image" and axes and axes[-1].get("name") == "c":
+        meta["rgb"] = True
+    if "scale" in meta and meta.get("rgb"):
+        meta["scale"] = meta["scale"][:-1]
+    if len(levels) > 1:
+        meta["multiscale"] = True
+        return levels, meta, layer_type
+    return levels[0], meta, layer_type
+
+
+def read_ome_zarr(path):
+    """读取 OME-Zarr（或普通 Zarr 数组）目录，返回 napari 图层元组列表。
+
+    根组和所有带 ``multiscales`` 元数据的子组都作为图层返回，``labels/`` 下的组作为标签层。
+    普通 Zarr 数组作为单层延迟读取，带 ``image-label`` 属性时（如增量保存的标签）作为标签层。
+    """
+    node = zarr.open(path, mode="r")
+    if isinstance(node, zarr.Array):
+        layer_type = "labels" if "image-label" in node.attrs else "image"
+        return [(da.from_zarr(node), {"name": os.path.basename(os.path.normpath(path))}, layer_type)]
+
+    layers = []
+    if "multiscales" in node.attrs:
+        layers.append(_read_group(node))
+    for name, child in node.groups():
+        if name == "labels":
+            for label_name in child.attrs.get("labels", [n for n, _ in child.groups()]):
+                layers.append(_read_group(child[label_name], "labels"))
+        elif "multiscales" in child.attrs:
+            layers.append(_read_group(child))
+    return layers